@@ -1,38 +1,69 @@
 from __future__ import print_function
-from qutip import steadystate, expect, correlation_3op_1t
 import numpy as np
 
 
-def cross_correlation(experiment, start_time, stop_time, steps=500, flip_time_axis=False):
+def _correlation(liouvillian, ss, a_op, b_op, c_op, stop_time, steps, adaptive, tolerance, propagation_method):
+    # <A(0)B(tau)C(0)> on uniform or adaptive times, the stop time is estimated from the spectral gap if it is None
+    from ntypecqed.solvers import adaptive_correlation_3op_1t, correlation_3op_1t, correlation_time
+
+    if adaptive:
+        return adaptive_correlation_3op_1t(liouvillian, ss, a_op, b_op, c_op, stop_time=stop_time, tolerance=tolerance,
+                                           method=propagation_method)
+    if stop_time is None:
+        stop_time = correlation_time(liouvillian, ss, a_op, b_op, c_op, tolerance=tolerance,
+                                     method=propagation_method)
+    tau_list = np.linspace(0, stop_time, steps)
+    return tau_list, correlation_3op_1t(liouvillian, ss, tau_list, a_op, b_op, c_op, method=propagation_method)
+
+
+def cross_correlation(experiment, start_time=None, stop_time=None, steps=500, flip_time_axis=False,
+                      steadystate_method='auto', propagation_method='auto', backend='liouvillian', adaptive=False,
+                      tolerance=1e-3):
     """Performs a cross correlation between signal and probe light field
 
     :param experiment: The experiment on which the scan is performed
     :type experiment: ntypecqed.simulation.NTypeExperiment
-    :param start_time: Start time of the correlation
+    :param start_time: Start time of the correlation, None estimates it from the spectral gap of the Liouvillian
     :type start_time: float
-    :param stop_time: Stop time of the correlation
+    :param stop_time: Stop time of the correlation, None estimates it from the spectral gap of the Liouvillian
     :type stop_time: float
-    :param steps: Number of steps
+    :param steps: Number of steps for each sign of the time, ignored for adaptive sampling
     :type steps: int
     :param flip_time_axis: if True the positive time direction is a signal photon first and a probe photon second
     :type flip_time_axis: bool
+    :param steadystate_method: Steady state method, *auto* selects the fastest method for the system size,
+        see :func:`ntypecqed.solvers.select_method`
+    :type steadystate_method: str
+    :param propagation_method: Propagation method of the correlation, *auto* selects the fastest method for the
+        system size, see :func:`ntypecqed.solvers.select_method`
+    :type propagation_method: str
+    :param backend: Either *liouvillian* or the matrix free *kernel*, which only supports the *iterative* steady state
+        and the *ode* propagation, see :meth:`ntypecqed.simulation.NTypeExperiment.liouvillian_operator`
+    :type backend: str
+    :param adaptive: Sample the times adaptively, densely around zero and sparsely in the tail, see
+        :func:`ntypecqed.solvers.adaptive_correlation_3op_1t`
+    :type adaptive: bool
+    :param tolerance: Relative accuracy of the adaptive sampling and of the estimated time window
+    :type tolerance: float
     :return: tuple(times, correlation value)
     """
+    from qutip import expect
 
-    if start_time > 0 or stop_time < 0 or start_time >= stop_time:
-        raise (ValueError, 'Wrong times, conditions are start_time<0, stop_time>0 and start_time < stop_time')
+    if (start_time is not None and start_time > 0) or (stop_time is not None and stop_time < 0) or \
+            (start_time is not None and stop_time is not None and start_time >= stop_time):
+        raise ValueError('Wrong times, conditions are start_time<0, stop_time>0 and start_time < stop_time')
 
-    tau_list_pos = np.linspace(0, abs(stop_time), steps)
-    tau_list_neg = np.linspace(0, abs(start_time), steps)
-    ss = steadystate(experiment.driven_hamiltonian, experiment.environment.c_ops)
+    liouvillian = experiment.liouvillian_operator(backend)
+    ss = experiment.steadystate(steadystate_method, backend)
     photon_number_field_1, photon_number_field_2 = expect(experiment.environment.n_a, ss), \
                                                    expect(experiment.environment.n_b, ss)
-    corr_data_pos = correlation_3op_1t(experiment.driven_hamiltonian, ss, tau_list_pos, experiment.environment.c_ops,
-                                       experiment.environment.b.dag(), experiment.environment.n_a,
-                                       experiment.environment.b)
-    corr_data_neg = correlation_3op_1t(experiment.driven_hamiltonian, ss, tau_list_neg, experiment.environment.c_ops,
-                                       experiment.environment.a.dag(), experiment.environment.n_b,
-                                       experiment.environment.a)
+    tau_list_pos, corr_data_pos = _correlation(liouvillian, ss, experiment.environment.b.dag(),
+                                               experiment.environment.n_a, experiment.environment.b, stop_time, steps,
+                                               adaptive, tolerance, propagation_method)
+    tau_list_neg, corr_data_neg = _correlation(liouvillian, ss, experiment.environment.a.dag(),
+                                               experiment.environment.n_b, experiment.environment.a,
+                                               None if start_time is None else abs(start_time), steps, adaptive,
+                                               tolerance, propagation_method)
     # norm the correlation
     corr_data_pos /= (photon_number_field_1 * photon_number_field_2)
     corr_data_neg /= (photon_number_field_1 * photon_number_field_2)
@@ -47,48 +78,85 @@ def cross_correlation(experiment, start_time, stop_time, steps=500, flip_time_ax
         return np.concatenate((tau_list_neg, tau_list_pos)), np.concatenate((corr_data_neg, corr_data_pos))
 
 
-def self_correlation(experiment, stop_time, steps=500, field='probe'):
+def self_correlation(experiment, stop_time=None, steps=500, field='probe', steadystate_method='auto',
+                     propagation_method='auto', backend='liouvillian', adaptive=False, tolerance=1e-3):
     """Returns the self correlation of one of the cavity fields
 
     :param experiment: The experiment on which the scan is performed
     :type experiment: ntypecqed.simulation.NTypeExperiment
-    :param stop_time: Stop time of the correlation
+    :param stop_time: Stop time of the correlation, None estimates it from the spectral gap of the Liouvillian, see
+        :func:`ntypecqed.solvers.correlation_time`
     :type stop_time: float
-    :param steps: Number of steps
+    :param steps: Number of steps, ignored for adaptive sampling
     :type steps: int
     :param field: The field for which the self correlation is calculated, either 'probe' or 'signal'
     :type field: str
+    :param steadystate_method: Steady state method, *auto* selects the fastest method for the system size,
+        see :func:`ntypecqed.solvers.select_method`
+    :type steadystate_method: str
+    :param propagation_method: Propagation method of the correlation, *auto* selects the fastest method for the
+        system size, see :func:`ntypecqed.solvers.select_method`
+    :type propagation_method: str
+    :param backend: Either *liouvillian* or the matrix free *kernel*, which only supports the *iterative* steady state
+        and the *ode* propagation, see :meth:`ntypecqed.simulation.NTypeExperiment.liouvillian_operator`
+    :type backend: str
+    :param adaptive: Sample the times adaptively, densely around zero and sparsely in the tail, see
+        :func:`ntypecqed.solvers.adaptive_correlation_3op_1t`
+    :type adaptive: bool
+    :param tolerance: Relative accuracy of the adaptive sampling and of the estimated time window
+    :type tolerance: float
     :return: tuple(times, correlation value)
     """
+    from qutip import expect
+
     if field == 'probe':
         operator = experiment.environment.a
     elif field == 'signal':
         operator = experiment.environment.b
     else:
-        raise (ValueError, "No valid field name, valid fields are: 'probe' or 'signal'")
+        raise ValueError("No valid field name, valid fields are: 'probe' or 'signal'")
 
-    tau_list = np.linspace(0, stop_time, steps)
-    ss = steadystate(experiment.driven_hamiltonian, experiment.environment.c_ops)
+    liouvillian = experiment.liouvillian_operator(backend)
+    ss = experiment.steadystate(steadystate_method, backend)
     n = expect(operator.dag() * operator, ss)
-    corr_data = correlation_3op_1t(experiment.driven_hamiltonian, ss, tau_list, experiment.environment.c_ops,
-                                   operator.dag(), operator.dag() * operator, operator)
+    tau_list, corr_data = _correlation(liouvillian, ss, operator.dag(), operator.dag() * operator, operator, stop_time,
+                                       steps, adaptive, tolerance, propagation_method)
     corr_data /= (n * n)
     return tau_list, corr_data
 
 
-def triggered_self_correlation(experiment, stop_time, steps=500, trigger_photon='probe'):
+def triggered_self_correlation(experiment, stop_time=None, steps=500, trigger_photon='probe',
+                               steadystate_method='auto', propagation_method='auto', backend='liouvillian',
+                               adaptive=False, tolerance=1e-3):
     """Returns the triggered self correlation of one of the cavity fields
 
     :param experiment: The experiment on which the scan is performed
     :type experiment: ntypecqed.simulation.NTypeExperiment
-    :param stop_time: Stop time of the correlation
+    :param stop_time: Stop time of the correlation, None estimates it from the spectral gap of the Liouvillian, see
+        :func:`ntypecqed.solvers.correlation_time`
     :type stop_time: float
-    :param steps: Number of steps
+    :param steps: Number of steps, ignored for adaptive sampling
     :type steps: int
     :param trigger_photon: The photon which starts the self correlation, either 'probe' or 'signal'
     :type trigger_photon: str
+    :param steadystate_method: Steady state method, *auto* selects the fastest method for the system size,
+        see :func:`ntypecqed.solvers.select_method`
+    :type steadystate_method: str
+    :param propagation_method: Propagation method of the correlation, *auto* selects the fastest method for the
+        system size, see :func:`ntypecqed.solvers.select_method`
+    :type propagation_method: str
+    :param backend: Either *liouvillian* or the matrix free *kernel*, which only supports the *iterative* steady state
+        and the *ode* propagation, see :meth:`ntypecqed.simulation.NTypeExperiment.liouvillian_operator`
+    :type backend: str
+    :param adaptive: Sample the times adaptively, densely around zero and sparsely in the tail, see
+        :func:`ntypecqed.solvers.adaptive_correlation_3op_1t`
+    :type adaptive: bool
+    :param tolerance: Relative accuracy of the adaptive sampling and of the estimated time window
+    :type tolerance: float
     :return: tuple(times, correlation value)
     """
+    from qutip import expect
+
     if trigger_photon == 'probe':
         operator = experiment.environment.a
         self_op = experiment.environment.b
@@ -96,25 +164,30 @@ def triggered_self_correlation(experiment, stop_time, steps=500, trigger_photon=
         operator = experiment.environment.b
         self_op = experiment.environment.a
     else:
-        raise (ValueError, "No valid trigger photon name, valid names are: 'probe' or 'signal'")
-    tau_list = np.linspace(0, stop_time, steps)
-    ss = steadystate(experiment.driven_hamiltonian, experiment.environment.c_ops)
+        raise ValueError("No valid trigger photon name, valid names are: 'probe' or 'signal'")
+    liouvillian = experiment.liouvillian_operator(backend)
+    ss = experiment.steadystate(steadystate_method, backend)
     n_a, n_b = expect(experiment.environment.n_a, ss), expect(experiment.environment.n_b, ss)
-    corr_data = correlation_3op_1t(experiment.driven_hamiltonian, ss, tau_list, experiment.environment.c_ops,
-                                   operator.dag()*self_op.dag(), self_op.dag() * self_op, operator * self_op)
+    tau_list, corr_data = _correlation(liouvillian, ss, operator.dag()*self_op.dag(), self_op.dag() * self_op,
+                                       operator * self_op, stop_time, steps, adaptive, tolerance, propagation_method)
     corr_data /= (n_a * n_b * n_b)
     return tau_list, corr_data
 
-def double_coincidences(experiment, normed=True):
+def double_coincidences(experiment, normed=True, steadystate_method='auto'):
     """Returns the value of the cross correlation at time 0
 
     :param experiment: The experiment on which the scan is performed
     :type experiment: ntypecqed.simulation.NTypeExperiment
     :param normed: Normalize to the power level
     :type normed: bool
+    :param steadystate_method: Steady state method, *auto* selects the fastest method for the system size,
+        see :func:`ntypecqed.solvers.select_method`
+    :type steadystate_method: str
     :return: correlation value
     """
-    ss = steadystate(experiment.driven_hamiltonian, experiment.environment.c_ops)
+    from qutip import expect
+
+    ss = experiment.steadystate(steadystate_method)
     n_a, n_b = expect(experiment.environment.n_a, ss), expect(experiment.environment.n_b, ss)
     expectation_operator = experiment.environment.a.dag()*experiment.environment.b.dag()*experiment.environment.b*experiment.environment.a
     corr_data = expect(expectation_operator, ss)
@@ -122,7 +195,7 @@ def double_coincidences(experiment, normed=True):
         corr_data /= (n_a * n_b)
     return corr_data
 
-def triple_coincidences(experiment, trigger_photon='probe', normed=True):
+def triple_coincidences(experiment, trigger_photon='probe', normed=True, steadystate_method='auto'):
     """Returns the value of the triggered two photon self correlation at time 0
 
     :param experiment: The experiment on which the scan is performed
@@ -131,8 +204,13 @@ def triple_coincidences(experiment, trigger_photon='probe', normed=True):
     :type trigger_photon: str
     :param normed: Normalize to the power level
     :type normed: bool
+    :param steadystate_method: Steady state method, *auto* selects the fastest method for the system size,
+        see :func:`ntypecqed.solvers.select_method`
+    :type steadystate_method: str
     :return: correlation value
     """
+    from qutip import expect
+
     if trigger_photon == 'probe':
         trig_op = experiment.environment.a
         self_op = experiment.environment.b
@@ -140,8 +218,8 @@ def triple_coincidences(experiment, trigger_photon='probe', normed=True):
         trig_op = experiment.environment.b
         self_op = experiment.environment.a
     else:
-        raise (ValueError, "No valid trigger photon name, valid names are: 'probe' or 'signal'")
-    ss = steadystate(experiment.driven_hamiltonian, experiment.environment.c_ops)
+        raise ValueError("No valid trigger photon name, valid names are: 'probe' or 'signal'")
+    ss = experiment.steadystate(steadystate_method)
     n_a, n_b = expect(experiment.environment.n_a, ss), expect(experiment.environment.n_b, ss)
     expectation_operator = trig_op.dag()*self_op.dag()*self_op.dag()*self_op*self_op*trig_op
     corr_data = expect(expectation_operator, ss)
@@ -151,3 +229,184 @@ def triple_coincidences(experiment, trigger_photon='probe', normed=True):
         else:
             corr_data /= (n_b * n_a * n_a)
     return corr_data
+
+
+def _pulse_derivative(experiment, pulse, backend):
+    # returns f(t, Y) = L(t) Y for column stacked operators in the columns of Y, the Hamiltonian is linear in all
+    # parameters, so L(t) = L_static + sum_p pulse[p](t) L_p with the static part for pulse parameters set to zero
+    for key in pulse:
+        if key not in experiment.system_parameters:
+            raise KeyError('%s is no simulation parameter' % key)
+    if backend == 'kernel':
+        kernel = experiment.kernel
+        dimension = kernel.dimension
+
+        def derivative(t, columns):
+            parameters = dict(kernel.parameters)
+            parameters.update({key: f(t) for key, f in pulse.items()})
+            batch = columns.reshape((dimension, dimension, -1), order='F')
+            return kernel.rhs(batch, parameters).reshape((dimension ** 2, -1), order='F')
+        return derivative
+    elif backend != 'liouvillian':
+        raise ValueError("backend has to be either 'liouvillian' or 'kernel'")
+
+    from ntypecqed.gradients import liouvillian_derivatives
+
+    static = experiment.copy()
+    for key in pulse:
+        static[key] = 0.0
+    static_liouvillian = static.liouvillian
+    derivatives = liouvillian_derivatives(experiment, list(pulse))
+    pieces = [(f, derivatives[key]) for key, f in pulse.items()]
+
+    def derivative(t, columns):
+        result = static_liouvillian.dot(columns)
+        for f, piece in pieces:
+            result += f(t) * piece.dot(columns)
+        return result
+    return derivative
+
+
+def _two_time_chunk(experiment, pulse, start_time, starting_state, t_list, tau_list, a_op, b_op, c_op, backend,
+                    rtol, atol):
+    # integrates the state from start_time and the correlations of all times in t_list in one batch
+    from scipy.integrate import DOP853
+    from ntypecqed.solvers import expectation_vector, operator_vector
+
+    derivative = _pulse_derivative(experiment, pulse, backend)
+    dimension = starting_state.shape[0]
+    size = dimension ** 2
+    a_matrix, c_matrix = a_op.full(), c_op.full()
+    expectation = expectation_vector(b_op)
+    tau_list = np.asarray(tau_list, dtype=float)
+    result = np.zeros((len(t_list), len(tau_list)), dtype=complex)
+
+    # column 0 is the state, the other columns are C rho(t) A of the running correlations of the start times in active
+    columns = operator_vector(starting_state)[:, np.newaxis]
+    active = []
+    step = None
+    time = start_time
+    boundaries = list(t_list) + [t_list[-1] + tau_list[-1]]
+    for index, segment_end in enumerate(boundaries):
+        if segment_end > time:
+            # the solver is restarted at every start time with the step size of the last segment, the absolute
+            # tolerance is relative to the largest element of every column, because C rho A is often tiny
+            m = columns.shape[1]
+            scales = np.abs(columns).max(axis=0)
+            scales[scales == 0] = 1.0
+            solver = DOP853(lambda t, y: derivative(t, y.reshape((size, m), order='F')).ravel(order='F'), time,
+                            columns.ravel(order='F'), segment_end, rtol=rtol, atol=np.repeat(atol * scales, size),
+                            first_step=None if step is None else min(step, segment_end - time))
+            while solver.status == 'running':
+                step_start = solver.t
+                solver.step()
+                if solver.status == 'failed':
+                    raise RuntimeError('Integration of the master equation failed')
+                if solver.status == 'running':
+                    step = solver.step_size
+                step_end = solver.t
+                # correlation times of the running start times within this step, those at the end need no
+                # interpolation
+                interpolation = None
+                for column, j in enumerate(active, 1):
+                    times = t_list[j] + tau_list
+                    ends = np.isclose(times, step_end, rtol=1e-12, atol=1e-12)
+                    inside = np.flatnonzero((times > step_start) & (times < step_end) & ~ends)
+                    at_end = np.flatnonzero(ends)
+                    if len(inside) > 0:
+                        if interpolation is None:
+                            interpolation = solver.dense_output()
+                        states = interpolation(times[inside]).reshape((size, m, len(inside)), order='F')
+                        result[j, inside] = expectation.dot(states[:, column, :])
+                    if len(at_end) > 0:
+                        result[j, at_end] = expectation.dot(solver.y[column * size:(column + 1) * size])
+            columns = solver.y.reshape((size, -1), order='F')
+            time = segment_end
+        if index == len(t_list):
+            break
+        # start the correlation of t_list[index] and drop the correlations which are finished
+        rho = columns[:, 0].reshape((dimension, dimension), order='F')
+        started = operator_vector(c_matrix.dot(rho).dot(a_matrix))
+        result[index, tau_list == 0] = expectation.dot(started)
+        keep = [column for column, j in enumerate(active, 1) if t_list[j] + tau_list[-1] > time]
+        active = [active[column - 1] for column in keep] + [index]
+        columns = np.column_stack([columns[:, 0]] + [columns[:, column] for column in keep] + [started])
+    return result
+
+
+def two_time_correlation(experiment, pulse, t_list, tau_list, a_op=None, b_op=None, c_op=None, starting_state=None,
+                         start_time=None, backend='liouvillian', processes=1, rtol=1e-8, atol=1e-10):
+    """Returns the two time correlation <A(t)B(t+tau)C(t)> of a pulsed experiment
+
+    The parameters in pulse follow the given functions of time, all other parameters are taken from the experiment.
+    Instead of one integration of the master equation per start time, the state and the correlations of all start
+    times which are currently running are integrated together on one shared time axis: every start time t adds
+    C rho(t) A as new column to the integrated batch, which is dropped after t + tau_list[-1]. The cost grows
+    linearly with the number of start times instead of quadratically.
+
+    Example for the intensity correlation of the probe light during a Gaussian probe pulse::
+
+        pulse = {'eta_p': functools.partial(gaussian, amplitude=0.4, center=2.0, width=0.5)}
+        correlation = two_time_correlation(experiment, pulse, np.linspace(0, 4, 41), np.linspace(0, 1, 21))
+
+    :param experiment: The experiment on which the correlation is calculated
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param pulse: Functions f(t) for the time dependent parameters, they have to be picklable for processes > 1
+    :type pulse: dict
+    :param t_list: Sorted start times t
+    :type t_list: list(float)
+    :param tau_list: Sorted delays tau >= 0
+    :type tau_list: list(float)
+    :param a_op: Operator A, defaults to a.dag()
+    :type a_op: qutip.Qobj
+    :param b_op: Operator B, defaults to n_a
+    :type b_op: qutip.Qobj
+    :param c_op: Operator C, defaults to a
+    :type c_op: qutip.Qobj
+    :param starting_state: Density matrix at start_time, defaults to the steady state for the pulse parameters at
+        start_time
+    :type starting_state: qutip.Qobj
+    :param start_time: Time of the starting state, defaults to t_list[0]
+    :type start_time: float
+    :param backend: Either *liouvillian* or the matrix free *kernel*, see
+        :meth:`ntypecqed.simulation.NTypeExperiment.liouvillian_operator`
+    :type backend: str
+    :param processes: Number of processes among which the start times are split
+    :type processes: int
+    :param rtol: Relative tolerance of the integration
+    :type rtol: float
+    :param atol: Absolute tolerance of the integration relative to the largest element of the state and of every
+        C rho(t) A, which are rescaled at every start time
+    :type atol: float
+    :return: Array with one row per start time and one column per delay
+    :rtype: numpy.ndarray
+    """
+    t_list = np.asarray(t_list, dtype=float)
+    tau_list = np.asarray(tau_list, dtype=float)
+    if np.any(np.diff(t_list) < 0) or np.any(np.diff(tau_list) < 0) or tau_list[0] < 0:
+        raise ValueError('t_list and tau_list have to be sorted and tau_list has to be positive')
+    environment = experiment.environment
+    a_op = environment.a.dag() if a_op is None else a_op
+    b_op = environment.n_a if b_op is None else b_op
+    c_op = environment.a if c_op is None else c_op
+    start_time = t_list[0] if start_time is None else start_time
+    if start_time > t_list[0]:
+        raise ValueError('start_time has to be before the first start time')
+    if starting_state is None:
+        initial_experiment = experiment.copy()
+        for key, f in pulse.items():
+            initial_experiment[key] = f(start_time)
+        starting_state = initial_experiment.steadystate(backend=backend)
+    starting_state = starting_state.full()
+
+    if processes == 1 or len(t_list) < 2 * processes:
+        return _two_time_chunk(experiment, pulse, start_time, starting_state, t_list, tau_list, a_op, b_op, c_op,
+                               backend, rtol, atol)
+    import multiprocessing
+
+    chunks = [chunk for chunk in np.array_split(t_list, processes) if len(chunk) > 0]
+    arguments = [(experiment, pulse, start_time, starting_state, chunk, tau_list, a_op, b_op, c_op, backend, rtol,
+                  atol) for chunk in chunks]
+    with multiprocessing.get_context('spawn').Pool(len(chunks)) as pool:
+        results = pool.starmap(_two_time_chunk, arguments)
+    return np.concatenate(results)
@@ -0,0 +1,168 @@
+""" Counting Module
+
+This module calculates the full counting statistics of the photons which leave the cavity modes. A counting field s_k
+for every counted collapse operator c_k tilts the Liouvillian to L(s) = L + sum_k (exp(s_k) - 1) J_k with the jump
+superoperators J_k rho = c_k rho c_k^dag. The eigenvalue theta(s) of L(s) which vanishes for s = 0 is the cumulant
+generating function of the counted photon numbers per time, so its derivatives at s = 0 are the joint cumulants per
+time of the photon numbers. They are expanded around s = 0 to arbitrary order by recursive perturbation theory of the
+eigenvalue, which needs one sparse LU factorization of the Liouvillian and one solve per cumulant, instead of a
+correlation function for every quantity.
+"""
+import itertools
+from math import factorial
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+
+def _channels(experiment, channels):
+    # the counted collapse operators, by default the outputs of the probe and the signal cavity mode
+    if channels is None:
+        return experiment.environment.c_ops[:2]
+    return list(channels)
+
+
+def jump_superoperator(c_op):
+    """Returns the superoperator of a quantum jump rho -> c rho c^dag
+
+    :param c_op: The collapse operator
+    :type c_op: qutip.Qobj or scipy.sparse matrix
+    :rtype: scipy.sparse.csr_matrix
+    """
+    from ntypecqed.solvers import operator_matrix
+
+    c = c_op if sp.issparse(c_op) else operator_matrix(c_op)
+    return sp.kron(c.conj(), c).tocsr()
+
+
+def tilted_liouvillian(experiment, counting_fields, channels=None):
+    """Returns the Liouvillian tilted by the counting fields, L + sum_k (exp(s_k) - 1) J_k
+
+    :param experiment: The experiment
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param counting_fields: One counting field s_k per channel, real or complex
+    :type counting_fields: list(complex)
+    :param channels: The counted collapse operators, defaults to the collapse operators of the probe and signal
+        cavity mode, which count the photons of the a and b mode
+    :type channels: list(qutip.Qobj)
+    :rtype: scipy.sparse.csr_matrix
+    """
+    channels = _channels(experiment, channels)
+    if len(counting_fields) != len(channels):
+        raise ValueError('There has to be one counting field for every channel')
+    tilted = experiment.liouvillian
+    for field, c_op in zip(counting_fields, channels):
+        if field != 0:
+            tilted = tilted + (np.exp(field) - 1) * jump_superoperator(c_op)
+    return tilted.tocsr()
+
+
+def cumulant_generating_function(experiment, counting_fields, channels=None):
+    """Returns the scaled cumulant generating function theta(s) of the photon numbers for finite counting fields
+
+    theta(s) is the eigenvalue of the tilted Liouvillian with the largest real part, so
+    log <exp(sum_k s_k n_k(t))> approaches theta(s) t for long counting times t. It is found by shift-invert Arnoldi
+    iteration, use :func:`cumulants` for the derivatives at s = 0.
+
+    :param experiment: The experiment
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param counting_fields: One counting field s_k per channel
+    :type counting_fields: list(complex)
+    :param channels: The counted collapse operators, see :func:`tilted_liouvillian`
+    :type channels: list(qutip.Qobj)
+    :rtype: complex
+    """
+    import scipy.linalg
+    from ntypecqed.solvers import rate_scale
+
+    tilted = tilted_liouvillian(experiment, counting_fields, channels)
+    size = tilted.shape[0]
+    if size <= 64:
+        eigenvalues = scipy.linalg.eigvals(tilted.toarray())
+    else:
+        # the shift keeps the shifted matrix regular for s = 0, where theta is zero
+        shift = -1e-3 * rate_scale(tilted)
+        eigenvalues = spla.eigs(tilted.tocsc(), k=min(3, size - 2), sigma=shift, return_eigenvectors=False)
+    return eigenvalues[np.argmax(eigenvalues.real)]
+
+
+def _multi_indices(channels, order):
+    # all orders (m_1, ..., m_k) of joint cumulants up to the total order, sorted by the total order
+    indices = [index for index in itertools.product(range(order + 1), repeat=channels) if 0 < sum(index) <= order]
+    return sorted(indices, key=sum)
+
+
+def cumulants(experiment, order=4, channels=None):
+    """Returns the joint cumulants per time of the photon numbers emitted into the channels up to the given order
+
+    The cumulant of the orders (m_1, ..., m_k) is the derivative of the cumulant generating function
+    d^m_1/ds_1^m_1 ... d^m_k/ds_k^m_k theta(s) at s = 0. For counting times t much longer than the correlation time
+    the cumulants of the photon numbers counted during t are the returned cumulants times t, e.g. for the probe and
+    signal mode::
+
+        rates = cumulants(example_experiment, order=2)
+        mean_a, variance_a, covariance = rates[(1, 0)], rates[(2, 0)], rates[(1, 1)]
+
+    :param experiment: The experiment
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param order: Largest total order of the cumulants
+    :type order: int
+    :param channels: The counted collapse operators, see :func:`tilted_liouvillian`
+    :type channels: list(qutip.Qobj)
+    :return: dict with the cumulant per time for every tuple of orders of the channels
+    :rtype: dict
+    """
+    from ntypecqed.solvers import constrained, unit_vector, trace_vector
+
+    if order < 1:
+        raise ValueError('The order of the cumulants has to be at least 1')
+    channels = _channels(experiment, channels)
+    jumps = [jump_superoperator(c_op) for c_op in channels]
+    liouvillian_matrix = experiment.liouvillian
+    size = liouvillian_matrix.shape[0]
+    trace = trace_vector(int(round(np.sqrt(size))))
+    lu = spla.splu(constrained(liouvillian_matrix).tocsc())
+
+    def pseudo_inverse(vector):
+        # solves L x = vector with Tr(x) = 0 for a traceless vector, the first equation is redundant
+        vector = vector.copy()
+        vector[0] = 0.0
+        return lu.solve(vector)
+
+    # the series of the eigenvalue theta(s) = sum theta_m s^m and of its eigenvector rho(s) = sum rho_m s^m, which is
+    # normalized to Tr(rho(s)) = 1. The tilt (exp(s_k) - 1) J_k contributes J_k / n! to the order n of channel k.
+    zero = (0,) * len(channels)
+    vectors = {zero: lu.solve(unit_vector(size))}
+    theta = dict()
+    result = dict()
+    for index in _multi_indices(len(channels), order):
+        tilt = np.zeros(size, dtype=complex)
+        for k, jump in enumerate(jumps):
+            for n in range(1, index[k] + 1):
+                lower = index[:k] + (index[k] - n,) + index[k + 1:]
+                tilt += jump.dot(vectors[lower]) / factorial(n)
+        theta[index] = trace.dot(tilt)
+        result[index] = (theta[index] * np.prod([factorial(m) for m in index])).real
+        if sum(index) == order:
+            continue
+        # (L - theta_0) rho_m = -tilt + sum_{0 < j <= m} theta_j rho_{m - j}
+        source = tilt - theta[index] * vectors[zero]
+        for lower, value in theta.items():
+            rest = tuple(m - j for m, j in zip(index, lower))
+            if lower != index and min(rest) >= 0:
+                source -= value * vectors[rest]
+        vectors[index] = -pseudo_inverse(source)
+    return result
+
+
+def fano_factors(cumulant_rates):
+    """Returns the Fano factors, variance over mean of the counted photon numbers, of all channels
+
+    :param cumulant_rates: Cumulants of at least second order, see :func:`cumulants`
+    :type cumulant_rates: dict
+    :return: One Fano factor per channel
+    :rtype: numpy.ndarray
+    """
+    channels = len(next(iter(cumulant_rates)))
+    units = [tuple(int(i == k) for i in range(channels)) for k in range(channels)]
+    return np.array([cumulant_rates[tuple(2 * m for m in unit)] / cumulant_rates[unit] for unit in units])
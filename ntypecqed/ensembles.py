@@ -0,0 +1,234 @@
+""" Ensembles Module
+
+This module averages steady state observables over distributions of the simulation parameters, e.g. over the atom
+position (a distribution of g_p and g_s) or over Doppler and light shifts of the detunings. The Liouvillian is linear
+in all parameters, so it is assembled once as a static part plus one derivative per distributed parameter and every
+sample only adds sparse matrices instead of building the Hamiltonian again.
+"""
+import itertools
+import multiprocessing
+import numpy as np
+
+
+def _ppf(distribution):
+    # inverse cumulative distribution function of a distribution specification
+    if hasattr(distribution, 'ppf'):
+        return distribution.ppf
+    kind = distribution[0]
+    if kind == 'uniform':
+        low, high = distribution[1:]
+        return lambda u: low + (high - low) * np.asarray(u)
+    if kind == 'normal':
+        from scipy.stats import norm
+
+        mean, std = distribution[1:]
+        return lambda u: mean + std * norm.ppf(u)
+    raise ValueError("Distributions are ('uniform', low, high), ('normal', mean, std) or have a ppf method")
+
+
+def _quadrature(distribution, order):
+    # nodes and weights of a Gauss quadrature of the distribution with order nodes
+    if not hasattr(distribution, 'ppf') and distribution[0] == 'normal':
+        nodes, weights = np.polynomial.hermite_e.hermegauss(order)
+        mean, std = distribution[1:]
+        return mean + std * nodes, weights / weights.sum()
+    # Gauss-Legendre in the probability u = F(x), which is exact for the uniform distribution
+    nodes, weights = np.polynomial.legendre.leggauss(order)
+    return _ppf(distribution)(0.5 * (nodes + 1)), 0.5 * weights
+
+
+class _EnsembleStructure(object):
+    # static Liouvillian, derivatives and expectation vectors, everything a worker needs to evaluate samples
+
+    def __init__(self, experiment, parameters, observables, scan, steadystate_method):
+        from ntypecqed.gradients import liouvillian_derivatives
+        from ntypecqed.solvers import choose_method, expectation_vector
+
+        self.parameters = list(parameters)
+        varied = self.parameters + ([scan[0]] if scan is not None and scan[0] not in self.parameters else [])
+        derivatives = liouvillian_derivatives(experiment, varied)
+        static = experiment.liouvillian
+        for parameter in varied:
+            static = static - experiment[parameter] * derivatives[parameter]
+        self.static = static.tocsr()
+        self.derivatives = [derivatives[parameter].tocsr() for parameter in varied]
+        self.expectations = np.array([expectation_vector(observable) for observable in observables])
+        self.scan_values = None if scan is None else np.asarray(scan[1], dtype=float)
+        self.scan_index = None if scan is None else varied.index(scan[0])
+        self.scan_base = None if scan is None else experiment[scan[0]]
+        # the static part has the size and sparsity of the Liouvillian
+        self.steadystate_method = choose_method('steadystate', self.static, steadystate_method)
+        self.precision = getattr(experiment.environment, 'precision', 'double')
+
+    def evaluate(self, samples):
+        # (n, observables, scan points) expectation values of the samples
+        from ntypecqed.solvers import operator_vector, steadystate_matrix
+
+        scan_values = [None] if self.scan_values is None else self.scan_values
+        result = np.empty((len(samples), len(self.expectations), len(scan_values)), dtype=complex)
+        for i, sample in enumerate(samples):
+            values = list(sample) + ([0.0] if len(self.derivatives) > len(sample) else [])
+            for j, scan_value in enumerate(scan_values):
+                point = list(values)
+                if scan_value is not None:
+                    # a distributed parameter which is scanned is shifted from the scan value by the sample
+                    shift = point[self.scan_index] - self.scan_base if self.scan_index < len(sample) else 0.0
+                    point[self.scan_index] = scan_value + shift
+                liouvillian = self.static.copy()
+                for value, derivative in zip(point, self.derivatives):
+                    if value != 0:
+                        liouvillian = liouvillian + value * derivative
+                rho = steadystate_matrix(liouvillian, self.steadystate_method, self.precision)
+                result[i, :, j] = self.expectations.dot(operator_vector(rho))
+        return result
+
+
+_worker_structure = None
+
+
+def _init_ensemble_worker(structure):
+    global _worker_structure
+    _worker_structure = structure
+
+
+def _evaluate_chunk(samples):
+    return _worker_structure.evaluate(samples)
+
+
+def _evaluate(structure, samples, pool, processes):
+    if pool is None:
+        return structure.evaluate(samples)
+    chunks = [chunk for chunk in np.array_split(samples, 4 * processes) if len(chunk) > 0]
+    return np.concatenate(pool.map(_evaluate_chunk, chunks))
+
+
+def ensemble_average(experiment, distributions, observables=None, scan=None, method='qmc', tolerance=1e-3,
+                     order=4, max_order=32, initial_samples=16, max_samples=4096, replicas=4, processes=1,
+                     steadystate_method='auto', seed=None):
+    """Averages steady state observables over distributions of simulation parameters
+
+    Distributions are given per parameter as ('normal', mean, std), ('uniform', low, high) or as any object with a
+    ppf method, like the frozen distributions of scipy.stats. The distribution of a parameter which is also scanned
+    describes the parameter at the value of the experiment, the sampled value minus the value of the experiment is
+    added to every scan value. So a Doppler shift of the scanned laser is centred on the value of the experiment::
+
+        doppler = ('normal', example_experiment['probe_detuning'], 0.5)
+        distributions = {'g_p': scipy.stats.uniform(5, 6), 'probe_detuning': doppler}
+        mean, error = ensemble_average(example_experiment, distributions,
+                                       scan=('probe_detuning', np.linspace(-25, 25, 100)))
+
+    With method *quadrature* the average is a tensor product Gauss quadrature (Gauss-Hermite for normal
+    distributions, Gauss-Legendre in the probability otherwise) whose order is doubled until the average changes by
+    less than the tolerance or the order**d nodes of d parameters would exceed max_samples. With method *qmc*
+    several independently scrambled Sobol sequences are sampled in rounds of doubling size until the standard error
+    of the mean of the replicas is below the tolerance.
+
+    :param experiment: The experiment, all parameters without distribution keep their values
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param distributions: Distribution of every averaged simulation parameter
+    :type distributions: dict
+    :param observables: Observables, defaults to n_a and n_b
+    :type observables: list(qutip.Qobj)
+    :param scan: Optional scanned parameter and its values as tuple(name, values)
+    :type scan: tuple
+    :param method: Either *qmc* or *quadrature*
+    :type method: str
+    :param tolerance: Error of the average relative to the largest averaged value at which the sampling stops
+    :type tolerance: float
+    :param order: Initial number of quadrature nodes per parameter
+    :type order: int
+    :param max_order: Largest number of quadrature nodes per parameter
+    :type max_order: int
+    :param initial_samples: Number of samples per replica in the first round of qmc
+    :type initial_samples: int
+    :param max_samples: The qmc sampling stops at this total number of samples, the quadrature never uses more
+        nodes
+    :type max_samples: int
+    :param replicas: Number of independently scrambled Sobol sequences for the error estimate of qmc, at least 2
+    :type replicas: int
+    :param processes: Number of processes among which the samples of every round are split
+    :type processes: int
+    :param steadystate_method: Steady state method, *auto* selects the fastest method for the system size once,
+        see :func:`ntypecqed.solvers.select_method`
+    :type steadystate_method: str
+    :param seed: Seed of the scrambling
+    :type seed: int
+    :return: tuple(average, error estimate), arrays with one row per observable and one column per scan value if a
+        scan is given
+    :rtype: tuple(numpy.ndarray, numpy.ndarray)
+    """
+    for key in distributions:
+        if key not in experiment.system_parameters:
+            raise KeyError('%s is no simulation parameter' % key)
+    if scan is not None and scan[0] not in experiment.system_parameters:
+        raise KeyError('%s is no simulation parameter' % scan[0])
+    if method not in ('qmc', 'quadrature'):
+        raise ValueError("method has to be either 'qmc' or 'quadrature'")
+    if observables is None:
+        observables = [experiment.environment.n_a, experiment.environment.n_b]
+    parameters = list(distributions)
+    if method == 'quadrature' and order > max_order:
+        raise ValueError('The initial order %d of the quadrature exceeds max_order %d' % (order, max_order))
+    if method == 'quadrature' and order ** len(parameters) > max_samples:
+        raise ValueError('The quadrature of order %d needs %d > max_samples nodes for %d parameters, use qmc'
+                         % (order, order ** len(parameters), len(parameters)))
+    if method == 'qmc' and replicas < 2:
+        raise ValueError('The error estimate of qmc needs at least 2 replicas')
+    structure = _EnsembleStructure(experiment, parameters, observables, scan, steadystate_method)
+
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.get_context('spawn').Pool(processes, initializer=_init_ensemble_worker,
+                                                         initargs=(structure,))
+    try:
+        if method == 'quadrature':
+            mean, error = None, None
+            current_order = order
+            while current_order <= max_order and current_order ** len(parameters) <= max_samples:
+                rules = [_quadrature(distributions[parameter], current_order) for parameter in parameters]
+                samples = np.array(list(itertools.product(*[nodes for nodes, _ in rules])))
+                weights = np.array([np.prod(w) for w in itertools.product(*[weights for _, weights in rules])])
+                new_mean = np.tensordot(weights, _evaluate(structure, samples, pool, processes), axes=1)
+                if mean is not None:
+                    error = np.abs(new_mean - mean)
+                mean = new_mean
+                if error is not None and error.max() <= tolerance * np.abs(mean).max():
+                    break
+                current_order *= 2
+            if error is None:
+                error = np.full(mean.shape, np.inf)
+        else:
+            from scipy.stats import qmc
+
+            ppfs = [_ppf(distributions[parameter]) for parameter in parameters]
+            seeds = np.random.SeedSequence(seed).spawn(replicas)
+            sequences = [qmc.Sobol(len(parameters), scramble=True, seed=np.random.default_rng(s)) for s in seeds]
+            sums = None
+            count = 0
+            draw = initial_samples
+            while True:
+                # the same number of new points as already drawn keeps every sequence a balanced power of two
+                points = [sequence.random(draw) for sequence in sequences]
+                samples = np.concatenate([np.column_stack([ppf(u[:, k]) for k, ppf in enumerate(ppfs)])
+                                          for u in points])
+                results = _evaluate(structure, samples, pool, processes).reshape((replicas, draw) +
+                                                                                 (len(observables), -1))
+                new_sums = results.sum(axis=1)
+                sums = new_sums if sums is None else sums + new_sums
+                count += draw
+                replica_means = sums / count
+                mean = replica_means.mean(axis=0)
+                error = np.abs(replica_means.std(axis=0, ddof=1)) / np.sqrt(replicas)
+                if error.max() <= tolerance * np.abs(mean).max() or replicas * 2 * count > max_samples:
+                    break
+                draw = count
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if all(observable.isherm for observable in observables):
+        mean = mean.real
+    if scan is None:
+        mean, error = mean[:, 0], error[:, 0]
+    return mean, error
@@ -0,0 +1,203 @@
+""" Floquet Module
+
+This module calculates the periodic steady state of experiments whose parameters are modulated periodically, e.g. a
+sinusoidal control field omega_c(t), without integrating the master equation through the transients. The Liouvillian
+is linear in all parameters, so a modulation with the frequency f splits it into harmonics
+L(t) = sum_m L_m exp(i m 2 pi f t) and the periodic steady state rho(t) = sum_n rho_n exp(i n 2 pi f t) solves the
+harmonic balance equations i n 2 pi f rho_n = sum_m L_m rho_{n - m}. They are solved for all harmonics at once by
+GMRES, preconditioned with one incomplete sparse LU factorization per harmonic, and the number of harmonics is
+increased until the highest harmonics are below the tolerance.
+"""
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+
+def _modulation_harmonics(modulation, frequency, samples):
+    # Fourier coefficients c_m with p(t) = sum_m c_m exp(i m 2 pi f t) of every modulated parameter, sampled over one
+    # period, the Nyquist frequency is dropped because it is not resolved
+    times = np.arange(samples) / (samples * frequency)
+    order = samples // 2 - 1
+    harmonics = dict()
+    for key, function in modulation.items():
+        coefficients = np.fft.fft([function(t) for t in times]) / samples
+        harmonics[key] = {m: coefficients[m] for m in range(-order, order + 1)}
+    return harmonics
+
+
+def _harmonic_liouvillians(experiment, modulation, frequency, samples):
+    # the Liouvillian harmonics L_m as dict, small harmonics of the modulation are left out, and the modulation index
+    # sum |c_m| / (|m| f), which estimates the number of harmonics of the steady state like for phase modulation
+    from ntypecqed.gradients import liouvillian_derivatives
+
+    for key in modulation:
+        if key not in experiment.system_parameters:
+            raise KeyError('%s is no simulation parameter' % key)
+    harmonics = _modulation_harmonics(modulation, frequency, samples)
+    derivatives = liouvillian_derivatives(experiment, list(modulation))
+    liouvillians = {0: experiment.liouvillian}
+    index = 0.0
+    for key, coefficients in harmonics.items():
+        scale = max(abs(value) for value in coefficients.values())
+        for m, value in coefficients.items():
+            if m == 0:
+                value = value.real - experiment[key]
+            elif abs(value) <= 1e-12 * scale:
+                continue
+            else:
+                index += abs(value) / (abs(m) * frequency)
+            liouvillians[m] = liouvillians.get(m, 0) + value * derivatives[key]
+    return liouvillians, index
+
+
+def _solve_harmonics(liouvillians, frequency, harmonics, factors, guess=None, tol=1e-11):
+    # solves the harmonic balance equations for rho_n with |n| <= harmonics, Tr(rho_0) = 1 replaces the first equation
+    # of rho_0, the traces of all other harmonics vanish by themselves. A direct solve fills in dense blocks of the
+    # size of the Liouvillian, so GMRES is preconditioned with incomplete LU factorizations of the diagonal blocks
+    # L_0 - i n 2 pi f, which are kept in factors for the next number of harmonics.
+    from ntypecqed.solvers import constrained, trace_vector
+
+    size = liouvillians[0].shape[0]
+    blocks = 2 * harmonics + 1
+    numbers = np.arange(-harmonics, harmonics + 1)
+    floquet = sp.kron(sp.diags(-2j * np.pi * frequency * numbers), sp.identity(size, dtype=complex))
+    for m, liouvillian_matrix in liouvillians.items():
+        if abs(m) < blocks:
+            floquet = floquet + sp.kron(sp.eye(blocks, k=-m), liouvillian_matrix)
+    floquet = floquet.tocsr()
+    row = harmonics * size
+    trace = np.zeros(blocks * size, dtype=complex)
+    trace[row:row + size] = trace_vector(int(round(np.sqrt(size))))
+    matrix = sp.vstack([floquet[:row], sp.csr_matrix(trace[np.newaxis, :]), floquet[row + 1:]], format='csr')
+
+    identity = sp.identity(size, dtype=complex, format='csr')
+    for n in numbers:
+        if n not in factors:
+            block = constrained(liouvillians[0]) if n == 0 else liouvillians[0] - 2j * np.pi * frequency * n * identity
+            try:
+                factors[n] = spla.spilu(block.tocsc(), drop_tol=1e-3, fill_factor=20)
+            except RuntimeError:
+                # the incomplete factorization is singular, the complete one never is
+                factors[n] = spla.splu(block.tocsc())
+
+    def precondition(vector):
+        vector = vector.reshape((blocks, size))
+        return np.concatenate([factors[n].solve(part) for n, part in zip(numbers, vector)])
+
+    preconditioner = spla.LinearOperator(matrix.shape, precondition, dtype=complex)
+    b = np.zeros(blocks * size, dtype=complex)
+    b[row] = 1.0
+    x0 = None
+    if guess is not None:
+        # the harmonics of the previous truncation are the initial guess
+        x0 = np.zeros((blocks, size), dtype=complex)
+        offset = harmonics - len(guess) // 2
+        x0[offset:offset + len(guess)] = guess
+        x0 = x0.ravel()
+    try:
+        x, info = spla.gmres(matrix, b, x0=x0, M=preconditioner, rtol=tol, atol=0.0, restart=100, maxiter=20)
+    except TypeError:  # scipy < 1.12
+        x, info = spla.gmres(matrix, b, x0=x0, M=preconditioner, tol=tol, atol=0.0, restart=100, maxiter=20)
+    if info != 0:
+        raise RuntimeError('The harmonic balance equations did not converge, the modulation is too strong')
+    return x.reshape((blocks, size))
+
+
+def _periodic_vectors(experiment, modulation, frequency, tolerance, max_harmonics, samples):
+    # column stacked harmonics rho_n as (2 K + 1, d^2) array, truncated to the harmonics above the tolerance
+    if frequency <= 0:
+        raise ValueError('The modulation frequency has to be positive')
+    liouvillians, index = _harmonic_liouvillians(experiment, modulation, frequency, samples)
+    harmonics = min(max(2 * max(abs(m) for m in liouvillians), int(np.ceil(index)) + 8), max_harmonics)
+    factors = dict()
+    vectors = None
+    while True:
+        vectors = _solve_harmonics(liouvillians, frequency, harmonics, factors, vectors, min(1e-3 * tolerance, 1e-8))
+        amplitudes = np.abs(vectors).max(axis=1) / np.abs(vectors[harmonics]).max()
+        if max(amplitudes[0], amplitudes[-1]) <= tolerance:
+            break
+        if harmonics >= max_harmonics:
+            raise RuntimeError('The periodic steady state did not converge with %d harmonics' % harmonics)
+        harmonics = min(2 * harmonics, max_harmonics)
+    kept = np.flatnonzero(amplitudes > tolerance)
+    order = abs(kept - harmonics).max()
+    return vectors[harmonics - order:harmonics + order + 1]
+
+
+def periodic_steadystate(experiment, modulation, frequency, tolerance=1e-8, max_harmonics=256, samples=64):
+    """Returns the harmonics of the periodic steady state of an experiment with periodically modulated parameters
+
+    The modulation maps simulation parameters to periodic functions f(t) of the time in us, like the
+    time_dependent_parameters of the *kernel* backend of :func:`ntypecqed.transmission_experiments.solve_me`. The
+    steady state is rho(t) = sum_n rho_n exp(i n 2 pi frequency t) for n = -K, ..., K::
+
+        modulation = {'omega_c': lambda t: 3.0 + 1.5 * np.cos(2 * np.pi * 0.5 * t)}
+        harmonics = periodic_steadystate(example_experiment, modulation, 0.5)
+        rho_average = harmonics[len(harmonics) // 2]
+
+    :param experiment: The experiment, parameters without modulation keep their values
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param modulation: Periodic function of the time of every modulated simulation parameter
+    :type modulation: dict
+    :param frequency: Modulation frequency in MHz, the period of all functions has to be 1 / frequency
+    :type frequency: float
+    :param tolerance: Harmonics whose largest element is below tolerance times the largest element of rho_0 are
+        truncated
+    :type tolerance: float
+    :param max_harmonics: Largest number of harmonics K
+    :type max_harmonics: int
+    :param samples: Number of samples of the modulation per period for its Fourier series
+    :type samples: int
+    :return: The harmonics rho_n for n = -K, ..., K, the middle one is the time averaged density matrix
+    :rtype: list(qutip.Qobj)
+    """
+    from qutip import Qobj
+
+    vectors = _periodic_vectors(experiment, modulation, frequency, tolerance, max_harmonics, samples)
+    dimension = int(round(np.sqrt(vectors.shape[1])))
+    return [Qobj(vector.reshape((dimension, dimension), order='F'), dims=experiment.environment.n_a.dims)
+            for vector in vectors]
+
+
+def periodic_expectations(experiment, modulation, frequency, observables=None, times=None, tolerance=1e-8,
+                          max_harmonics=256, samples=64):
+    """Returns the time averaged expectation values in the periodic steady state of a modulated experiment
+
+    :param experiment: The experiment, parameters without modulation keep their values
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param modulation: Periodic function of the time of every modulated simulation parameter, see
+        :func:`periodic_steadystate`
+    :type modulation: dict
+    :param frequency: Modulation frequency in MHz
+    :type frequency: float
+    :param observables: Observables, defaults to n_a and n_b
+    :type observables: list(qutip.Qobj)
+    :param times: Optional times at which the expectation values in the periodic steady state are returned as well
+    :type times: numpy.ndarray
+    :param tolerance: Truncation of the harmonics, see :func:`periodic_steadystate`
+    :type tolerance: float
+    :param max_harmonics: Largest number of harmonics
+    :type max_harmonics: int
+    :param samples: Number of samples of the modulation per period for its Fourier series
+    :type samples: int
+    :return: The time averages, one per observable, and if times are given a tuple(time averages, array with the
+        expectation values with one row per observable and one column per time)
+    :rtype: numpy.ndarray or tuple(numpy.ndarray, numpy.ndarray)
+    """
+    from ntypecqed.solvers import expectation_vector
+
+    if observables is None:
+        observables = [experiment.environment.n_a, experiment.environment.n_b]
+    vectors = _periodic_vectors(experiment, modulation, frequency, tolerance, max_harmonics, samples)
+    expectations = np.array([expectation_vector(observable) for observable in observables]).dot(vectors.T)
+    hermitian = all(observable.isherm for observable in observables)
+    harmonics = len(vectors) // 2
+    averages = expectations[:, harmonics]
+    if times is None:
+        return averages.real if hermitian else averages
+    numbers = np.arange(-harmonics, harmonics + 1)
+    phases = np.exp(2j * np.pi * frequency * np.outer(numbers, np.asarray(times, dtype=float)))
+    values = expectations.dot(phases)
+    if hermitian:
+        return averages.real, values.real
+    return averages, values
@@ -0,0 +1,130 @@
+""" Gradients Module
+
+This module provides the derivatives of steady state observables with respect to the simulation parameters and the
+decay rates of the HilbertSpace. They are calculated with one sparse LU factorization of the Liouvillian and one
+adjoint solve per observable, see :func:`ntypecqed.solvers.steadystate_gradients`, instead of two steady states per
+parameter for finite differences.
+"""
+import numpy as np
+
+# decay rates of the HilbertSpace and their jump operators, the collapse operators are sqrt(2 pi rate) * operator
+RATE_OPERATORS = (('kappa_a', 'a'), ('kappa_b', 'b'), ('gamma31', 'sigma_13'), ('gamma32', 'sigma_23'),
+                  ('gamma42', 'sigma_24'), ('gamma41', 'sigma_14'), ('dephasing', 'sigma_22'))
+RATE_PARAMETERS = tuple(rate for rate, _ in RATE_OPERATORS)
+
+
+def liouvillian_derivatives(experiment, parameters=None):
+    """Returns the derivatives of the Liouvillian with respect to simulation parameters and decay rates
+
+    The Hamiltonian is linear in all simulation parameters and the dissipator is linear in all decay rates, so every
+    derivative is the superoperator of the term that belongs to the parameter.
+
+    :param experiment: The experiment whose Liouvillian is differentiated
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param parameters: Names of the parameters, defaults to all necessary_params of the experiment and the rates
+        in RATE_PARAMETERS
+    :type parameters: list(str)
+    :return: dict with the derivative of the Liouvillian for every parameter
+    :rtype: dict
+    """
+    from ntypecqed.solvers import dissipator, hamiltonian_superoperator
+
+    if parameters is None:
+        parameters = experiment.necessary_params + RATE_PARAMETERS
+    rate_operators = dict(RATE_OPERATORS)
+    for parameter in parameters:
+        if parameter not in experiment.system_parameters and parameter not in rate_operators:
+            raise KeyError('%s is neither a simulation parameter nor a decay rate' % parameter)
+    unit = experiment.copy()
+    derivatives = dict()
+    for parameter in parameters:
+        if parameter in rate_operators:
+            operator = getattr(experiment.environment, rate_operators[parameter])
+            derivatives[parameter] = 2 * np.pi * dissipator([operator])
+        else:
+            for key in unit.necessary_params:
+                unit[key] = 1.0 if key == parameter else 0.0
+            derivatives[parameter] = hamiltonian_superoperator(unit.driven_hamiltonian)
+    return derivatives
+
+
+def expectation_gradients(experiment, observables=None, parameters=None, derivatives=None):
+    """Returns steady state expectation values and their derivatives with respect to the parameters
+
+    :param experiment: The experiment on which the steady state is calculated
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param observables: Observables, defaults to n_a and n_b
+    :type observables: list(qutip.Qobj)
+    :param parameters: Names of the parameters, see :func:`liouvillian_derivatives`
+    :type parameters: list(str)
+    :param derivatives: Derivatives of the Liouvillian from :func:`liouvillian_derivatives`, which replace the
+        parameters. They do not depend on the parameter values, so scans build them only once
+    :type derivatives: dict
+    :return: tuple(array of the expectation values, dict with the array of derivatives per parameter), both real for
+        hermitian observables
+    :rtype: tuple(numpy.ndarray, dict)
+    """
+    from ntypecqed.solvers import steadystate_gradients
+
+    if observables is None:
+        observables = [experiment.environment.n_a, experiment.environment.n_b]
+    if derivatives is None:
+        derivatives = liouvillian_derivatives(experiment, parameters)
+    _, values, gradients = steadystate_gradients(experiment.liouvillian, derivatives, observables)
+    if all(observable.isherm for observable in observables):
+        values = values.real
+        gradients = {parameter: gradient.real for parameter, gradient in gradients.items()}
+    return values, gradients
+
+
+def _normed_gradients(experiment, operator, powers, normed, parameters):
+    # value and derivatives of <operator> / (n_a^powers[0] n_b^powers[1]) by the quotient rule
+    environment = experiment.environment
+    values, gradients = expectation_gradients(experiment, [operator, environment.n_a, environment.n_b], parameters)
+    if not normed:
+        return values[0], {parameter: gradient[0] for parameter, gradient in gradients.items()}
+    value = values[0] / (values[1] ** powers[0] * values[2] ** powers[1])
+    # dG/G = dC/C - powers[0] dn_a/n_a - powers[1] dn_b/n_b, written without dividing by C, which may vanish
+    return value, {parameter: gradient[0] / (values[1] ** powers[0] * values[2] ** powers[1]) -
+                   value * (powers[0] * gradient[1] / values[1] + powers[1] * gradient[2] / values[2])
+                   for parameter, gradient in gradients.items()}
+
+
+def double_coincidences_gradient(experiment, normed=True, parameters=None):
+    """Returns the value of the cross correlation at time 0 and its derivatives with respect to the parameters
+
+    :param experiment: The experiment on which the correlation is calculated
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param normed: Normalize to the power level, see :func:`ntypecqed.correlation_experiments.double_coincidences`
+    :type normed: bool
+    :param parameters: Names of the parameters, see :func:`liouvillian_derivatives`
+    :type parameters: list(str)
+    :return: tuple(correlation value, dict with the derivative per parameter)
+    """
+    environment = experiment.environment
+    operator = environment.a.dag() * environment.b.dag() * environment.b * environment.a
+    return _normed_gradients(experiment, operator, (1, 1), normed, parameters)
+
+
+def triple_coincidences_gradient(experiment, trigger_photon='probe', normed=True, parameters=None):
+    """Returns the triggered two photon self correlation at time 0 and its derivatives with respect to the parameters
+
+    :param experiment: The experiment on which the correlation is calculated
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param trigger_photon: The photon which starts the self correlation, either 'probe' or 'signal'
+    :type trigger_photon: str
+    :param normed: Normalize to the power level, see :func:`ntypecqed.correlation_experiments.triple_coincidences`
+    :type normed: bool
+    :param parameters: Names of the parameters, see :func:`liouvillian_derivatives`
+    :type parameters: list(str)
+    :return: tuple(correlation value, dict with the derivative per parameter)
+    """
+    environment = experiment.environment
+    if trigger_photon == 'probe':
+        trig_op, self_op, powers = environment.a, environment.b, (1, 2)
+    elif trigger_photon == 'signal':
+        trig_op, self_op, powers = environment.b, environment.a, (2, 1)
+    else:
+        raise ValueError("No valid trigger photon name, valid names are: 'probe' or 'signal'")
+    operator = trig_op.dag() * self_op.dag() * self_op.dag() * self_op * self_op * trig_op
+    return _normed_gradients(experiment, operator, powers, normed, parameters)
@@ -18,7 +18,23 @@ This modules provides the stage on which all simulations take place.
 #  |1>--------------------
 
 import numpy as np
-from qutip import *
+
+_default_environment = None
+
+
+def default_environment():
+    """Returns the shared default HilbertSpace, which is only built on first use
+
+    Building the operators needs QuTiP, therefore neither the import of QuTiP nor the construction
+    of the operators happens before an experiment actually needs its environment.
+
+    :return: The default HilbertSpace
+    :rtype: HilbertSpace
+    """
+    global _default_environment
+    if _default_environment is None:
+        _default_environment = HilbertSpace()
+    return _default_environment
 
 
 class HilbertSpace(object):
@@ -41,11 +57,16 @@ class HilbertSpace(object):
     :type gamma_d2: float
     :param gamma_dephasing: Dephasing rate between the two ground states (0.1*2*pi)
     :type gamma_dephasing: float
+    :param precision: Precision of the steady state factorizations, *single* needs half the memory for large
+        Hilbert spaces and is refined to double precision accuracy ('double')
+    :type precision: str
     """
     possible_params = ('N_a', 'N_b', 'kappa_a', 'kappa_b', 'gamma_d2', 'gamma_d1', 'dephasing', 'gamma31',
-                       'gamma32', 'gamma41', 'gamma42')
+                       'gamma32', 'gamma41', 'gamma42', 'precision')
 
     def __init__(self, **kwargs):
+        from qutip import basis, destroy, qeye, tensor
+        from ntypecqed.solvers import PRECISIONS
 
         for key in kwargs.keys():
             if key not in HilbertSpace.possible_params:
@@ -60,6 +81,9 @@ class HilbertSpace(object):
         self.gamma_d2 = kwargs.get('gamma_d2', 6.07)
         self.gamma_d1 = kwargs.get('gamma_d1', 5.75)
         self.gamma_dephasing = kwargs.get('dephasing', 0.128)
+        self.precision = kwargs.get('precision', 'double')
+        if self.precision not in PRECISIONS:
+            raise ValueError('%s is no precision, valid precisions are %s' % (self.precision, str(PRECISIONS)))
 
         # Clebsch-Gordans are chosen such that they add up to 1
         # for each excited state keeping the real ratios
@@ -107,6 +131,30 @@ class HilbertSpace(object):
         if self.gamma_dephasing > 0:
             self.c_ops.append(np.sqrt(self.gamma_dephasing * 2 * np.pi) * self.sigma_22)
 
+    @property
+    def dissipator(self):
+        """Property that returns the superoperator of all decays, it is built once on first use
+
+        :return: The Lindblad dissipator of the collapse operators
+        :rtype: scipy.sparse.csr_matrix
+        """
+        if getattr(self, '_dissipator', None) is None:
+            from ntypecqed.solvers import dissipator
+            self._dissipator = dissipator(self.c_ops)
+        return self._dissipator
+
+    @property
+    def parameters(self):
+        """Property that returns all parameters which define this HilbertSpace, e.g. to compare two of them
+
+        :return: The truncations, decay rates and precision
+        :rtype: dict
+        """
+        return dict(N_a=self.N_a, N_b=self.N_b, kappa_a=self.kappa_a, kappa_b=self.kappa_b, gamma_d1=self.gamma_d1,
+                    gamma_d2=self.gamma_d2, dephasing=self.gamma_dephasing, gamma31=self.gamma31,
+                    gamma32=self.gamma32, gamma41=self.gamma41, gamma42=self.gamma42,
+                    precision=getattr(self, 'precision', 'double'))
+
     def __repr__(self):
         return 'HilbertSpace(N_a=%s, N_b=%s, kappa_a=%s, kappa_b=%s, gamma_d1=%s, gamma_d2=%s, dephasing=%s)' % (
             self.N_a, self.N_b, self.kappa_a, self.kappa_b, self.gamma_d1, self.gamma_d2, self.gamma_dephasing)
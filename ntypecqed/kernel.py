@@ -0,0 +1,245 @@
+""" Kernel Module
+
+This module provides a matrix free master equation kernel for the N-type system. It applies the right-hand side of
+the master equation directly from the photon numbers and atomic levels instead of assembling the Liouvillian, so
+the memory scales with the density matrix.
+"""
+import numpy as np
+import scipy.linalg
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+# positions of the atomic states in the atomic basis of the HilbertSpace
+S1, S3, S2, S4 = 0, 1, 2, 3
+
+# Hamiltonian terms T + T.dag() with T = parameter * (mode operator) * |to><from|,
+# given as (parameter, mode, to, from), mode 0 is the probe mode a and mode 1 the signal mode b
+_COUPLINGS = (('g_p', 0, S3, S1), ('g_s', 1, S4, S2), ('omega_c', None, S2, S3))
+_CAVITY_DRIVES = {'probe': ('eta_p', 0, None, None), 'signal': ('eta_s', 1, None, None)}
+_ATOM_DRIVES = {'probe': ('eta_p', None, S1, S3), 'signal': ('eta_s', None, S2, S4)}
+
+
+def _coupling_matrix(state_shape, mode, to, frm):
+    # sparse matrix of T + T.dag() for T = (mode operator) * |to><from| built from the photon numbers and levels
+    n_a, n_b, atom = [index.ravel() for index in np.meshgrid(*[np.arange(n) for n in state_shape], indexing='ij')]
+    dimension = len(n_a)
+    source = np.ones(dimension, dtype=bool) if frm is None else atom == frm
+    values = np.ones(dimension)
+    target_a, target_b, target_atom = n_a.copy(), n_b.copy(), atom.copy()
+    if mode == 0:
+        source &= n_a > 0
+        values = np.sqrt(n_a.astype(float))
+        target_a = n_a - 1
+    elif mode == 1:
+        source &= n_b > 0
+        values = np.sqrt(n_b.astype(float))
+        target_b = n_b - 1
+    if to is not None:
+        target_atom = np.full(dimension, to)
+    rows = np.ravel_multi_index((target_a[source], target_b[source], target_atom[source]), state_shape)
+    columns = np.flatnonzero(source)
+    t = sp.csr_matrix((values[source], (rows, columns)), shape=(dimension, dimension))
+    return (t + t.T).tocsr()
+
+
+class NTypeKernel(spla.LinearOperator):
+    """Matrix free master equation of an N-type experiment
+
+    The kernel applies d(rho)/dt = -i(H_eff rho - rho H_eff.dag()) + sum_k X_k rho X_k.dag() directly on the
+    density matrix. The effective Hamiltonian H_eff is built from the photon numbers and atomic levels as a sparse
+    (d, d) matrix, one piece per parameter, and the jumps X_k rho X_k.dag() are applied by index shifts. The
+    Liouvillian with its (d^2, d^2) entries is never assembled, so the memory scales with the density matrix.
+
+    The kernel is a scipy LinearOperator acting on column stacked density matrices like
+    :attr:`ntypecqed.simulation.NTypeExperiment.liouvillian`, so it can be used with the *iterative* steady state
+    and the *ode* propagation of :mod:`ntypecqed.solvers`. The parameters are read from the experiment when the
+    kernel is created.
+
+    :param experiment: The experiment whose master equation is applied
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    """
+
+    def __init__(self, experiment):
+        environment = experiment.environment
+        self.state_shape = (environment.N_a, environment.N_b, environment.N_atom)
+        dimension = int(np.prod(self.state_shape))
+        super(NTypeKernel, self).__init__(dtype=complex, shape=(dimension ** 2, dimension ** 2))
+        self.dimension = dimension
+        self.parameters = dict(experiment.system_parameters)
+
+        n_a, n_b, atom = [index.ravel() for index in
+                          np.meshgrid(*[np.arange(n) for n in self.state_shape], indexing='ij')]
+        # Hamiltonian per unit (angular) parameter value, the Hamiltonian is linear in all parameters
+        self.hamiltonian_pieces = {
+            'delta_31': sp.diags((atom == S1).astype(float)),
+            'delta_42': sp.diags(-(atom == S4).astype(float)),
+            'probe_detuning': sp.diags((atom == S1).astype(float) - n_a),
+            'control_detuning': sp.diags(-((atom == S1) | (atom == S3)).astype(float)),
+            'signal_detuning': sp.diags(-(atom == S4).astype(float) - n_b)}
+        terms = list(_COUPLINGS)
+        driving = {'probe': experiment.driving_probe, 'signal': experiment.driving_signal}
+        for laser in ('probe', 'signal'):
+            terms.append(_CAVITY_DRIVES[laser] if driving[laser] == 'c' else _ATOM_DRIVES[laser])
+        for parameter, mode, to, frm in terms:
+            self.hamiltonian_pieces[parameter] = _coupling_matrix(self.state_shape, mode, to, frm)
+
+        # jump operators sqrt(rate) * (mode operator) * |to><from| with rates in angular frequencies
+        jumps = [(environment.kappa_a, 0, None, None), (environment.kappa_b, 1, None, None),
+                 (environment.gamma31, None, S1, S3), (environment.gamma32, None, S2, S3),
+                 (environment.gamma42, None, S2, S4), (environment.gamma41, None, S1, S4)]
+        if environment.gamma_dephasing > 0:
+            jumps.append((environment.gamma_dephasing, None, S2, S2))
+        self.jumps = [(2 * np.pi * rate, mode, to, frm) for rate, mode, to, frm in jumps if rate != 0]
+        decay = np.zeros(dimension)
+        for rate, mode, to, frm in self.jumps:
+            decay += rate * (n_a if mode == 0 else n_b if mode == 1 else (atom == frm))
+        self._decay = decay
+        self._atom = atom
+        self._effective_hamiltonian = None
+        self._effective_parameters = None
+
+    def effective_hamiltonian(self, parameters=None):
+        """Returns the non hermitian Hamiltonian H - i/2 sum_k X_k.dag() X_k for the given parameters
+
+        :param parameters: Parameter values, defaults to the parameters of the kernel
+        :type parameters: dict
+        :rtype: scipy.sparse.csr_matrix
+        """
+        parameters = self.parameters if parameters is None else parameters
+        key = tuple(parameters[name] for name in sorted(self.hamiltonian_pieces))
+        if key != self._effective_parameters:
+            h = sp.diags(-0.5j * self._decay)
+            for name, piece in self.hamiltonian_pieces.items():
+                if parameters[name] != 0:
+                    h = h + parameters[name] * 2 * np.pi * piece
+            self._effective_hamiltonian = sp.csr_matrix(h)
+            self._effective_conjugate = self._effective_hamiltonian.conj()
+            self._effective_parameters = key
+        return self._effective_hamiltonian
+
+    def rhs(self, rho, parameters=None):
+        """Returns the time derivative of a density matrix or of a batch of density matrices
+
+        :param rho: The density matrix (or any operator) as (d, d) array or a batch of them as (d, d, m) array
+        :type rho: numpy.ndarray
+        :param parameters: Parameter values, defaults to the parameters of the kernel
+        :type parameters: dict
+        :rtype: numpy.ndarray
+        """
+        h = self.effective_hamiltonian(parameters)
+        d = self.dimension
+        batch = rho.shape[2:]
+        # H_eff rho and rho H_eff.dag() = (conj(H_eff) rho.T).T for all operators of the batch at once
+        left = h.dot(rho.reshape((d, -1))).reshape(rho.shape)
+        transposed = np.swapaxes(rho, 0, 1).reshape((d, -1))
+        right = np.swapaxes(self._effective_conjugate.dot(transposed).reshape(rho.shape), 0, 1)
+        result = -1j * (left - right)
+        tensor = rho.reshape(self.state_shape * 2 + batch)
+        jumps = result.reshape(self.state_shape * 2 + batch)
+        extra = (slice(None),) * len(batch)
+        extra_axes = (np.newaxis,) * len(batch)
+        for rate, mode, to, frm in self.jumps:
+            if mode == 0:
+                factors = rate * np.sqrt(np.outer(np.arange(1, self.state_shape[0]), np.arange(1, self.state_shape[0])))
+                jumps[(slice(None, -1), slice(None), slice(None), slice(None, -1)) + extra] += \
+                    factors[(slice(None), None, None, slice(None), None, None) + extra_axes] * \
+                    tensor[(slice(1, None), slice(None), slice(None), slice(1, None)) + extra]
+            elif mode == 1:
+                factors = rate * np.sqrt(np.outer(np.arange(1, self.state_shape[1]), np.arange(1, self.state_shape[1])))
+                jumps[(slice(None), slice(None, -1), slice(None), slice(None), slice(None, -1)) + extra] += \
+                    factors[(None, slice(None), None, None, slice(None), None) + extra_axes] * \
+                    tensor[(slice(None), slice(1, None), slice(None), slice(None), slice(1, None)) + extra]
+            else:
+                jumps[(slice(None), slice(None), to, slice(None), slice(None), to) + extra] += \
+                    rate * tensor[(slice(None), slice(None), frm, slice(None), slice(None), frm) + extra]
+        return result
+
+    def _matvec(self, vector):
+        rho = np.asarray(vector).reshape((self.dimension, self.dimension), order='F')
+        return self.rhs(rho).ravel(order='F')
+
+    def diagonal(self):
+        """Returns the diagonal of the Liouvillian, e.g. for Jacobi preconditioning
+
+        :rtype: numpy.ndarray
+        """
+        h = self.effective_hamiltonian().diagonal()
+        diagonal = -1j * (h[:, np.newaxis] - h.conj()[np.newaxis, :])
+        for rate, mode, to, frm in self.jumps:
+            # only jumps within one atomic level contribute to the diagonal
+            if mode is None and to == frm:
+                diagonal += rate * np.outer(self._atom == to, self._atom == to)
+        return diagonal.ravel(order='F')
+
+    def preconditioner(self, cutoff=1e-3, shift=0.0):
+        """Returns an approximate inverse of the Liouvillian (minus shift times the identity) for iterative solvers
+
+        Without the jumps the master equation -i(H_eff X - X H_eff.dag()) = R is a Sylvester equation, which is solved
+        exactly in the eigenbasis of H_eff with one dense (d, d) eigendecomposition. The jumps are a small correction
+        to it, so GMRES typically converges in about ten iterations.
+
+        :param cutoff: Denominators smaller than cutoff times the largest denominator are clipped
+        :type cutoff: float
+        :param shift: Shift of the Liouvillian, e.g. for shift-invert eigenvalue solvers
+        :type shift: complex
+        :rtype: scipy.sparse.linalg.LinearOperator
+        """
+        eigenvalues, vectors = scipy.linalg.eig(self.effective_hamiltonian().toarray())
+        inverse = scipy.linalg.inv(vectors)
+        inverse_dag = inverse.conj().T
+        vectors_dag = vectors.conj().T
+        denominator = -1j * (eigenvalues[:, np.newaxis] - eigenvalues.conj()[np.newaxis, :]) - shift
+        smallest = cutoff * np.abs(denominator).max()
+        denominator = np.where(np.abs(denominator) < smallest, smallest, denominator)
+
+        def solve(vector):
+            r = np.asarray(vector).reshape((self.dimension, self.dimension), order='F')
+            x = vectors.dot(inverse.dot(r).dot(inverse_dag) / denominator).dot(vectors_dag)
+            return x.ravel(order='F')
+
+        return spla.LinearOperator(self.shape, solve, dtype=complex)
+
+    def evolve(self, rho0, times, time_dependent_parameters=None, observables=None, rtol=1e-8, atol=1e-10):
+        """Integrates the master equation, parameters can be arbitrary functions of time
+
+        :param rho0: The initial density matrix
+        :type rho0: qutip.Qobj or numpy.ndarray
+        :param times: Sorted times at which the results are returned
+        :type times: list(float)
+        :param time_dependent_parameters: Functions f(t) for the parameters that change with time
+        :type time_dependent_parameters: dict
+        :param observables: Observables whose expectation values are returned, if None the states are returned
+        :type observables: list(qutip.Qobj)
+        :param rtol: Relative tolerance of the integration
+        :type rtol: float
+        :param atol: Absolute tolerance of the integration
+        :type atol: float
+        :return: Array of expectation values with one row per observable or array of density matrices
+        :rtype: numpy.ndarray
+        """
+        from scipy.integrate import solve_ivp
+
+        rho0 = rho0 if isinstance(rho0, np.ndarray) else rho0.full()
+        dimension = rho0.shape[0]
+        time_dependent_parameters = time_dependent_parameters or dict()
+        for key in time_dependent_parameters:
+            if key not in self.parameters:
+                raise KeyError('%s is no simulation parameter' % key)
+
+        def derivative(t, y):
+            parameters = self.parameters
+            if time_dependent_parameters:
+                parameters = dict(self.parameters)
+                parameters.update({key: f(t) for key, f in time_dependent_parameters.items()})
+            return self.rhs(y.reshape((dimension, dimension)), parameters).ravel()
+
+        times = np.asarray(times, dtype=float)
+        solution = solve_ivp(derivative, (times[0], times[-1]), rho0.astype(complex).ravel(), method='DOP853',
+                             t_eval=times, rtol=rtol, atol=atol)
+        if not solution.success:
+            raise RuntimeError('Integration of the master equation failed: %s' % solution.message)
+        states = solution.y.T.reshape((len(times), dimension, dimension))
+        if observables is None:
+            return states
+        # Tr(O rho) = sum_ij O_ji rho_ij
+        return np.array([np.einsum('tij,ji->t', states, observable.full()) for observable in observables])
@@ -0,0 +1,382 @@
+""" Serve Module
+
+This module provides a long lived simulation daemon for dashboards and other tools which would otherwise start a new
+Python process per request. The daemon keeps the HilbertSpaces (with their dissipators) and the most recent steady
+states in memory and answers requests for steady state quantities, scans, coincidences and correlations. It is
+started with::
+
+    python -m ntypecqed.serve --socket /tmp/ntypecqed.sock
+
+or with ``--host`` and ``--port`` on localhost. Requests and responses are JSON objects, one per line. Requests with
+the same HilbertSpace and driving that arrive within batch_delay are calculated together, so steady states shared
+by several requests are solved once, and every response is sent as soon as its batch is finished::
+
+    {"id": 1, "kind": "scan", "system_parameters": {...}, "environment": {"N_a": 3}, "parameter": "probe_detuning",
+     "values": [-1.0, 0.0, 1.0], "quantities": ["n_a", "g2"]}
+    {"id": 1, "result": {"n_a": [...], "g2": [...]}}
+"""
+from __future__ import print_function
+import argparse
+import asyncio
+import json
+import os
+import socket
+import stat
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from ntypecqed.simulation import NTypeExperiment
+from ntypecqed.transmission_experiments import QUANTITIES, _check_quantities
+
+REQUEST_KINDS = ('steadystate', 'scan', 'double_coincidences', 'triple_coincidences', 'cross_correlation',
+                 'self_correlation', 'statistics')
+
+
+def _configuration(request):
+    # requests of the same configuration share the HilbertSpace and are batched together
+    environment = request.get('environment') or dict()
+    driving = request.get('driving') or {'probe': 'c', 'signal': 'c'}
+    configuration = tuple(sorted(environment.items())), tuple(sorted(driving.items()))
+    # the configuration is a key of the pending batches, unhashable values like lists raise a TypeError here
+    hash(configuration)
+    return configuration
+
+
+def _complex_list(values):
+    values = np.asarray(values)
+    return {'real': values.real.tolist(), 'imag': values.imag.tolist()}
+
+
+class SimulationServer(object):
+    """A simulation daemon which keeps HilbertSpaces and steady states warm and batches concurrent requests
+
+    :param batch_delay: Seconds a request waits for further requests of the same configuration
+    :type batch_delay: float
+    :param cache_size: Number of steady states which are kept
+    :type cache_size: int
+    :param workers: Number of threads which calculate batches of different configurations at once
+    :type workers: int
+    :param steadystate_method: Steady state method, *auto* selects the fastest method for the system size
+    :type steadystate_method: str
+    """
+
+    def __init__(self, batch_delay=0.005, cache_size=1024, workers=None, steadystate_method='auto'):
+        self.batch_delay = batch_delay
+        self.cache_size = cache_size
+        self.steadystate_method = steadystate_method
+        self.environments = dict()
+        self.steady_states = OrderedDict()
+        self.statistics = {'requests': 0, 'batches': 0, 'steadystates': 0, 'cache_hits': 0}
+        self._executor = ThreadPoolExecutor(workers)
+        self._lock = threading.Lock()
+        self._pending = dict()
+        self._loop = None
+        self._stopped = None
+
+    def environment(self, settings):
+        """Returns the HilbertSpace of the given settings, it is built only once
+
+        :param settings: Parameters of the HilbertSpace
+        :type settings: dict
+        :rtype: ntypecqed.hilbertspace.HilbertSpace
+        """
+        from ntypecqed.hilbertspace import HilbertSpace
+
+        key = tuple(sorted(settings.items()))
+        with self._lock:
+            if key not in self.environments:
+                self.environments[key] = HilbertSpace(**settings)
+            return self.environments[key]
+
+    def steadystate(self, configuration, experiment):
+        """Returns the steady state of an experiment from the cache or solves and caches it
+
+        :param configuration: Configuration of the experiment, see :meth:`submit`
+        :type configuration: tuple
+        :param experiment: The experiment
+        :type experiment: ntypecqed.simulation.NTypeExperiment
+        :rtype: qutip.Qobj
+        """
+        key = (configuration, tuple(sorted(experiment.system_parameters.items())))
+        with self._lock:
+            if key in self.steady_states:
+                self.steady_states.move_to_end(key)
+                self.statistics['cache_hits'] += 1
+                return self.steady_states[key]
+        state = experiment.steadystate(self.steadystate_method)
+        with self._lock:
+            self.statistics['steadystates'] += 1
+            self.steady_states[key] = state
+            while len(self.steady_states) > self.cache_size:
+                self.steady_states.popitem(last=False)
+        return state
+
+    def _answer(self, configuration, environment, request):
+        kind = request.get('kind')
+        if kind not in REQUEST_KINDS:
+            raise ValueError('%s is no request kind, possible kinds are %s' % (kind, str(REQUEST_KINDS)))
+        experiment = NTypeExperiment(request['system_parameters'], environment=environment,
+                                     driving=request.get('driving'))
+        if kind == 'cross_correlation':
+            from ntypecqed.correlation_experiments import cross_correlation
+
+            times, values = cross_correlation(experiment, **request.get('arguments', dict()))
+            return dict(times=np.asarray(times).tolist(), **_complex_list(values))
+        if kind == 'self_correlation':
+            from ntypecqed.correlation_experiments import self_correlation
+
+            times, values = self_correlation(experiment, **request.get('arguments', dict()))
+            return dict(times=np.asarray(times).tolist(), **_complex_list(values))
+        if kind == 'double_coincidences':
+            return QUANTITIES['g2'](experiment, self.steadystate(configuration, experiment))
+        if kind == 'triple_coincidences':
+            quantity = 'g3_%s' % request.get('trigger_photon', 'probe')
+            if quantity not in QUANTITIES:
+                raise ValueError("No valid trigger photon name, valid names are: 'probe' or 'signal'")
+            return QUANTITIES[quantity](experiment, self.steadystate(configuration, experiment))
+        quantities = request.get('quantities', ['n_a', 'n_b'])
+        _check_quantities(quantities)
+        if kind == 'steadystate':
+            state = self.steadystate(configuration, experiment)
+            return {quantity: QUANTITIES[quantity](experiment, state) for quantity in quantities}
+        result = {quantity: [] for quantity in quantities}
+        for value in request['values']:
+            experiment[request['parameter']] = value
+            state = self.steadystate(configuration, experiment)
+            for quantity in quantities:
+                result[quantity].append(QUANTITIES[quantity](experiment, state))
+        return result
+
+    def run_batch(self, configuration, requests):
+        """Answers a batch of requests of the same configuration
+
+        The HilbertSpace is looked up once for the batch and the steady states are shared through the cache, so points
+        requested several times in a batch are solved once.
+
+        :param configuration: Configuration of the requests
+        :type configuration: tuple
+        :param requests: The requests
+        :type requests: list(dict)
+        :return: One response per request, either with a result or an error
+        :rtype: list(dict)
+        """
+        responses = []
+        try:
+            environment = self.environment(dict(configuration[0]))
+        except Exception as error:
+            return [{'error': '%s: %s' % (type(error).__name__, error)} for _ in requests]
+        for request in requests:
+            try:
+                responses.append({'result': self._answer(configuration, environment, request)})
+            except Exception as error:
+                responses.append({'error': '%s: %s' % (type(error).__name__, error)})
+        return responses
+
+    async def submit(self, request):
+        """Answers a request together with the other requests of its configuration within batch_delay
+
+        :param request: The request
+        :type request: dict
+        :return: The response with either a result or an error
+        :rtype: dict
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.statistics['requests'] += 1
+            if request.get('kind') == 'statistics':
+                return {'result': dict(self.statistics, cached_steadystates=len(self.steady_states),
+                                       environments=len(self.environments))}
+        try:
+            configuration = _configuration(request)
+        except (AttributeError, TypeError) as error:
+            return {'error': '%s: %s' % (type(error).__name__, error)}
+        future = loop.create_future()
+        batch = self._pending.get(configuration)
+        if batch is None:
+            batch = self._pending[configuration] = []
+            loop.call_later(self.batch_delay, self._flush, configuration)
+        batch.append((request, future))
+        return await future
+
+    def _flush(self, configuration):
+        batch = self._pending.pop(configuration)
+        with self._lock:
+            self.statistics['batches'] += 1
+        calculation = self._loop.run_in_executor(self._executor, self.run_batch, configuration,
+                                                 [request for request, _ in batch])
+
+        def done(calculation):
+            if calculation.exception() is not None:
+                error = calculation.exception()
+                responses = [{'error': '%s: %s' % (type(error).__name__, error)} for _ in batch]
+            else:
+                responses = calculation.result()
+            for (_, future), response in zip(batch, responses):
+                if not future.cancelled():
+                    future.set_result(response)
+
+        calculation.add_done_callback(done)
+
+    async def _respond(self, line, writer, write_lock):
+        try:
+            request = json.loads(line.decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError('A request has to be a JSON object')
+        except ValueError as error:
+            response = {'id': None, 'error': '%s: %s' % (type(error).__name__, error)}
+        else:
+            response = await self.submit(request)
+            response['id'] = request.get('id')
+        async with write_lock:
+            writer.write((json.dumps(response) + '\n').encode('utf-8'))
+            await writer.drain()
+
+    async def _handle(self, reader, writer):
+        # every line is answered in its own task, so responses can overtake each other
+        write_lock = asyncio.Lock()
+        responses = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = asyncio.ensure_future(self._respond(line, writer, write_lock))
+                responses.add(response)
+                response.add_done_callback(responses.discard)
+            if responses:
+                await asyncio.gather(*responses)
+        finally:
+            writer.close()
+
+    async def _serve(self, address, ready):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        if isinstance(address, str):
+            # only a stale socket of an earlier daemon is replaced
+            if os.path.exists(address):
+                if not stat.S_ISSOCK(os.stat(address).st_mode):
+                    raise ValueError('%s exists and is no socket' % address)
+                os.remove(address)
+            server = await asyncio.start_unix_server(self._handle, path=address)
+        else:
+            server = await asyncio.start_server(self._handle, *address)
+        if ready is not None:
+            ready.set()
+        try:
+            await self._stopped.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            if isinstance(address, str) and os.path.exists(address):
+                os.remove(address)
+
+    def serve_forever(self, address, ready=None):
+        """Serves requests until :meth:`shutdown` is called
+
+        :param address: Path of a Unix socket or tuple (host, port)
+        :type address: str or tuple
+        :param ready: Event which is set as soon as the server accepts connections
+        :type ready: threading.Event
+        """
+        asyncio.run(self._serve(address, ready))
+
+    def shutdown(self):
+        """Stops :meth:`serve_forever`, it can be called from any thread"""
+
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+
+class SimulationClient(object):
+    """A blocking client of the simulation daemon
+
+    :param address: Path of the Unix socket or tuple (host, port) of the daemon
+    :type address: str or tuple
+    :param timeout: Timeout of the socket in seconds
+    :type timeout: float
+    """
+
+    def __init__(self, address, timeout=None):
+        if isinstance(address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(address)
+        self._file = self._socket.makefile('rwb')
+        self._next_id = 0
+
+    def requests(self, requests):
+        """Sends several requests at once, so that the daemon can batch them, and waits for all responses
+
+        :param requests: The requests, see :class:`SimulationServer`
+        :type requests: list(dict)
+        :return: The results in the order of the requests
+        :rtype: list
+        """
+        ids = []
+        for request in requests:
+            self._next_id += 1
+            ids.append(self._next_id)
+            self._file.write((json.dumps(dict(request, id=self._next_id)) + '\n').encode('utf-8'))
+        self._file.flush()
+        responses = dict()
+        while len(responses) < len(ids):
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError('The daemon closed the connection')
+            response = json.loads(line.decode('utf-8'))
+            responses[response['id']] = response
+        results = []
+        for request_id in ids:
+            if 'error' in responses[request_id]:
+                raise RuntimeError(responses[request_id]['error'])
+            results.append(responses[request_id]['result'])
+        return results
+
+    def request(self, kind, system_parameters=None, **fields):
+        """Sends one request and waits for its result
+
+        :param kind: Kind of the request, one of REQUEST_KINDS
+        :type kind: str
+        :param system_parameters: Parameters of the experiment
+        :type system_parameters: dict
+        :param fields: Further fields of the request, e.g. environment, driving, parameter and values of scans
+        :return: The result
+        """
+        return self.requests([dict(fields, kind=kind, system_parameters=system_parameters)])[0]
+
+    def close(self):
+        """Closes the connection"""
+
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulation daemon of ntypecqed')
+    parser.add_argument('--socket', help='path of the Unix socket')
+    parser.add_argument('--host', default='127.0.0.1', help='host of the TCP socket if no Unix socket is given')
+    parser.add_argument('--port', type=int, default=8765, help='port of the TCP socket if no Unix socket is given')
+    parser.add_argument('--batch-delay', type=float, default=0.005, help='seconds requests wait for their batch')
+    parser.add_argument('--cache-size', type=int, default=1024, help='number of cached steady states')
+    parser.add_argument('--workers', type=int, default=None, help='number of calculation threads')
+    arguments = parser.parse_args(argv)
+    server = SimulationServer(arguments.batch_delay, arguments.cache_size, arguments.workers)
+    address = arguments.socket or (arguments.host, arguments.port)
+    try:
+        server.serve_forever(address)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 from copy import deepcopy
 import pickle
 import numpy as np
-from ntypecqed.hilbertspace import HilbertSpace
+from ntypecqed import hilbertspace
+from ntypecqed.hilbertspace import default_environment
 
 
 class NTypeExperiment(object):
@@ -11,7 +12,8 @@ class NTypeExperiment(object):
         Needed parameters are: g_p, g_s, eta_p, eta_s, omega_c, delta_31, delta_42, probe_detuning, signal_detuning, 
         control_detuning.
     :type system_parameters: dict
-    :param environment: The HilbertSpace in which the simulations take place
+    :param environment: The HilbertSpace in which the simulations take place, defaults to the shared default
+        HilbertSpace which is built on first use
     :type environment: ntypecqed.hilbertspace.HilbertSpace
     :param driving: The driving of probe and signal beams, defaults to cavity drive
     :type driving: dict
@@ -20,7 +22,7 @@ class NTypeExperiment(object):
     necessary_params = ('g_p', 'g_s', 'eta_p', 'eta_s', 'omega_c', 'delta_31', 'delta_42', 'probe_detuning',
                         'signal_detuning', 'control_detuning')
 
-    def __init__(self, system_parameters, environment=HilbertSpace(), driving=None):
+    def __init__(self, system_parameters, environment=None, driving=None):
         self.driving = deepcopy(driving)
         if driving is None:
             driving = {'probe': 'c', 'signal': 'c'}
@@ -39,7 +41,37 @@ class NTypeExperiment(object):
             raise KeyError("Please provide all of the following parameters in a dict: %s"
                            % str(NTypeExperiment.necessary_params))
         self.system_parameters = deepcopy(system_parameters)
-        self.environment = environment
+        self._environment = environment
+
+    @property
+    def environment(self):
+        """The HilbertSpace of this experiment, the default one is only built when it is accessed first
+
+        :return: The HilbertSpace in which the simulations take place
+        :rtype: ntypecqed.hilbertspace.HilbertSpace
+        """
+        if self._environment is None:
+            self._environment = default_environment()
+        return self._environment
+
+    @environment.setter
+    def environment(self, environment):
+        self._environment = environment
+
+    def __getstate__(self):
+        """Does not pickle the shared default HilbertSpace, it is rebuilt lazily after unpickling"""
+
+        state = self.__dict__.copy()
+        if state['_environment'] is not None and state['_environment'] is hilbertspace._default_environment:
+            state['_environment'] = None
+        return state
+
+    def __setstate__(self, state):
+        """Restores pickled instances, including the ones saved before the environment was built lazily"""
+
+        if 'environment' in state:
+            state['_environment'] = state.pop('environment')
+        self.__dict__.update(state)
 
     def __setitem__(self, key, item):
         """Simplifies the setting of parameters for existing instances"""
@@ -93,7 +125,10 @@ class NTypeExperiment(object):
         :return: A deep copy of the NTypeExperiment
         :rtype: NTypeExperiment
         """
-        return NTypeExperiment(deepcopy(self.system_parameters), environment=deepcopy(self.environment),
+        environment = self._environment
+        if environment is not None and environment is not hilbertspace._default_environment:
+            environment = deepcopy(environment)
+        return NTypeExperiment(deepcopy(self.system_parameters), environment=environment,
                                driving=deepcopy(self.driving))
 
     @property
@@ -146,11 +181,11 @@ class NTypeExperiment(object):
 
         h_bare, h_inter, h_control = self.undriven_hamiltonians
 
-        if self.driving_probe is 'c':
+        if self.driving_probe == 'c':
             probe_drive = self.environment.a.dag() + self.environment.a
         else:
             probe_drive = self.environment.sigma_13 + self.environment.sigma_13.dag()
-        if self.driving_signal is 'c':
+        if self.driving_signal == 'c':
             signal_drive = self.environment.b.dag() + self.environment.b
         else:
             signal_drive = self.environment.sigma_24 + self.environment.sigma_24.dag()
@@ -158,6 +193,66 @@ class NTypeExperiment(object):
         h_drive = eta_p * probe_drive + eta_s * signal_drive
         return h_bare + h_inter + h_drive + h_control
 
+    @property
+    def liouvillian(self):
+        """Property that returns the Liouvillian of the driven system for the current parameters
+
+        :return: The Liouvillian acting on column stacked density matrices
+        :rtype: scipy.sparse.csr_matrix
+        """
+        from ntypecqed.solvers import hamiltonian_superoperator
+
+        return (hamiltonian_superoperator(self.driven_hamiltonian) + self.environment.dissipator).tocsr()
+
+    @property
+    def kernel(self):
+        """Property that returns the matrix free master equation of the driven system for the current parameters
+
+        :return: The kernel acting on column stacked density matrices
+        :rtype: ntypecqed.kernel.NTypeKernel
+        """
+        from ntypecqed.kernel import NTypeKernel
+
+        return NTypeKernel(self)
+
+    def liouvillian_operator(self, backend='liouvillian'):
+        """Returns the generator of the master equation for the given backend
+
+        :param backend: Either *liouvillian* for the assembled sparse Liouvillian or *kernel* for the matrix free
+            :class:`ntypecqed.kernel.NTypeKernel`, whose memory scales with the density matrix
+        :type backend: str
+        :rtype: scipy.sparse.csr_matrix or ntypecqed.kernel.NTypeKernel
+        """
+        if backend == 'liouvillian':
+            return self.liouvillian
+        elif backend == 'kernel':
+            return self.kernel
+        raise ValueError("backend has to be either 'liouvillian' or 'kernel'")
+
+    def steadystate(self, method='auto', backend='liouvillian', precision=None):
+        """Returns the steady state of the driven system for the current parameters
+
+        :param method: Steady state method, one of *dense*, *sparse*, *iterative* or *auto* to choose the fastest
+            method for the system size, see :func:`ntypecqed.solvers.select_method`
+        :type method: str
+        :param backend: Either *liouvillian* or *kernel*, see :meth:`liouvillian_operator`. The kernel only supports
+            the *iterative* method.
+        :type backend: str
+        :param precision: Either *double* or *single*, see :func:`ntypecqed.solvers.steadystate_matrix`, defaults to
+            the precision of the HilbertSpace
+        :type precision: str
+        :return: The steady state density matrix
+        :rtype: qutip.Qobj
+        """
+        from qutip import Qobj
+        from ntypecqed.solvers import steadystate_matrix
+
+        if precision is None:
+            # HilbertSpaces pickled before the precision was introduced are double precision
+            precision = getattr(self.environment, 'precision', 'double')
+        return Qobj(steadystate_matrix(self.liouvillian_operator(backend), method=method, precision=precision),
+                    dims=self.environment.n_a.dims)
+
     @property
     def eigenstates(self):
         """Property that returns the unsorted Eigenenergies and Eigenstates of the undriven system
@@ -0,0 +1,826 @@
+""" Solvers Module
+
+This module provides the steady state and propagation solvers which work directly on the Liouvillian and selects
+the fastest method for a given system size from a calibration table.
+
+The Liouvillian acts on density matrices stacked column by column, as in QuTiP. Without a calibration of the machine
+the methods are selected from the built-in DEFAULT_CALIBRATION. A calibration table of the machine is measured with
+:func:`calibrate` or from the command line with ``python -m ntypecqed.solvers`` and stored in
+``$NTYPECQED_CACHE_DIR`` (by default ``~/.cache/ntypecqed``).
+"""
+from __future__ import print_function
+import json
+import os
+import socket
+import sys
+import time
+import warnings
+import numpy as np
+import scipy
+import scipy.linalg
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+STEADYSTATE_METHODS = ('dense', 'sparse', 'iterative')
+# precisions of the factorizations of the steady state, single precision is refined to double precision accuracy
+PRECISIONS = ('double', 'single')
+PROPAGATION_METHODS = ('dense', 'sparse')
+# the only methods for matrix free Liouvillians like ntypecqed.kernel.NTypeKernel, they are not calibrated
+OPERATOR_METHODS = {'steadystate': 'iterative', 'propagation': 'ode'}
+
+# Liouvillians of larger dimension are never converted to dense matrices
+DENSE_LIMIT = 2000
+
+CALIBRATION_VERSION = 1
+CALIBRATION_TRUNCATIONS = (2, 3, 4)
+# run times in seconds measured by calibrate on a reference machine, used if this machine is not calibrated
+DEFAULT_CALIBRATION = {
+    'version': CALIBRATION_VERSION,
+    'steadystate': [
+        {'dimension': 256, 'nnz': 1966, 'timings': {'dense': 0.0068, 'sparse': 0.0037, 'iterative': 0.0051}},
+        {'dimension': 1296, 'nnz': 12625, 'timings': {'dense': 0.25, 'sparse': 0.11, 'iterative': 0.17}},
+        {'dimension': 4096, 'nnz': 44286, 'timings': {'sparse': 3.0, 'iterative': 1.7}}],
+    'propagation': [
+        {'dimension': 256, 'nnz': 1966, 'timings': {'dense': 0.053, 'sparse': 0.090}},
+        {'dimension': 1296, 'nnz': 12625, 'timings': {'dense': 3.4, 'sparse': 0.16}},
+        {'dimension': 4096, 'nnz': 44286, 'timings': {'sparse': 0.71}}]}
+
+_calibration_table = None
+
+
+def operator_matrix(operator):
+    """Returns the matrix of a QuTiP operator as scipy CSR matrix for QuTiP 4 and QuTiP 5
+
+    :param operator: The operator
+    :type operator: qutip.Qobj
+    :rtype: scipy.sparse.csr_matrix
+    """
+    data = operator.data
+    if sp.issparse(data):
+        return data.tocsr()
+    return sp.csr_matrix(operator.to('csr').data.as_scipy())
+
+
+def hamiltonian_superoperator(hamiltonian):
+    """Returns the superoperator of the coherent evolution -i[H, rho]
+
+    :param hamiltonian: The Hamiltonian
+    :type hamiltonian: qutip.Qobj or scipy.sparse matrix
+    :rtype: scipy.sparse.csr_matrix
+    """
+    h = hamiltonian if sp.issparse(hamiltonian) else operator_matrix(hamiltonian)
+    identity = sp.identity(h.shape[0], dtype=complex, format='csr')
+    return (-1j * (sp.kron(identity, h) - sp.kron(h.T, identity))).tocsr()
+
+
+def dissipator(c_ops):
+    """Returns the superoperator of the Lindblad dissipators of the given collapse operators
+
+    :param c_ops: The collapse operators
+    :type c_ops: list(qutip.Qobj)
+    :rtype: scipy.sparse.csr_matrix
+    """
+    matrices = [c_op if sp.issparse(c_op) else operator_matrix(c_op) for c_op in c_ops]
+    dimension = matrices[0].shape[0]
+    identity = sp.identity(dimension, dtype=complex, format='csr')
+    result = sp.csr_matrix((dimension ** 2, dimension ** 2), dtype=complex)
+    for c in matrices:
+        cdc = (c.conj().T * c).tocsr()
+        result = result + sp.kron(c.conj(), c) - 0.5 * sp.kron(identity, cdc) - 0.5 * sp.kron(cdc.T, identity)
+    return result.tocsr()
+
+
+def liouvillian(hamiltonian, c_ops):
+    """Returns the Liouvillian of a Hamiltonian and collapse operators
+
+    :param hamiltonian: The Hamiltonian
+    :type hamiltonian: qutip.Qobj
+    :param c_ops: The collapse operators
+    :type c_ops: list(qutip.Qobj)
+    :rtype: scipy.sparse.csr_matrix
+    """
+    return (hamiltonian_superoperator(hamiltonian) + dissipator(c_ops)).tocsr()
+
+
+def operator_vector(operator):
+    """Returns the column stacked vector of an operator
+
+    :param operator: The operator
+    :type operator: qutip.Qobj or numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    matrix = operator if isinstance(operator, np.ndarray) else operator.full()
+    return matrix.ravel(order='F')
+
+
+def trace_vector(dimension):
+    """Returns the row vector t with t.dot(operator_vector(rho)) == Tr(rho)"""
+
+    t = np.zeros(dimension ** 2, dtype=complex)
+    t[::dimension + 1] = 1.0
+    return t
+
+
+def expectation_vector(operator):
+    """Returns the row vector e with e.dot(operator_vector(rho)) == Tr(operator rho)"""
+
+    matrix = operator if isinstance(operator, np.ndarray) else operator.full()
+    return matrix.T.ravel(order='F')
+
+
+def constrained(liouvillian_matrix):
+    """Returns the Liouvillian with its first row replaced by the trace row, see :func:`trace_vector`
+
+    The first equation is redundant because of trace conservation. With Tr(rho) = 1 in its place the steady state
+    solves constrained(L).dot(operator_vector(rho)) == unit_vector(L.shape[0]).
+    """
+
+    dimension = int(round(np.sqrt(liouvillian_matrix.shape[0])))
+    trace_row = sp.csr_matrix(trace_vector(dimension)[np.newaxis, :].astype(liouvillian_matrix.dtype))
+    return sp.vstack([trace_row, liouvillian_matrix.tocsr()[1:]], format='csr')
+
+
+def unit_vector(size):
+    """Returns the right hand side of the steady state equation with :func:`constrained`, the first unit vector"""
+
+    b = np.zeros(size, dtype=complex)
+    b[0] = 1.0
+    return b
+
+
+def _iterative_solve(matrix, b, tol=1e-12):
+    ilu = spla.spilu(matrix.tocsc(), drop_tol=1e-6, fill_factor=20)
+    preconditioner = spla.LinearOperator(matrix.shape, ilu.solve, dtype=complex)
+    try:
+        x, info = spla.gmres(matrix, b, M=preconditioner, rtol=tol, atol=0.0, restart=50, maxiter=1000)
+    except TypeError:  # scipy < 1.12
+        x, info = spla.gmres(matrix, b, M=preconditioner, tol=tol, atol=0.0, restart=50, maxiter=1000)
+    if info != 0:
+        # the preconditioner was not good enough, a direct solve is always possible
+        return spla.spsolve(matrix.tocsc(), b)
+    return x
+
+
+def _single_solver(single, method, operator):
+    # factorizes the single precision matrix and returns a solve function in double precision, the iterative method
+    # runs GMRES on the double precision constrained operator
+    if method == 'dense':
+        factors = scipy.linalg.lu_factor(single.toarray(), check_finite=False)
+
+        def solve(b):
+            return scipy.linalg.lu_solve(factors, b.astype(np.complex64), check_finite=False).astype(complex)
+    elif method == 'sparse':
+        lu = spla.splu(single)
+
+        def solve(b):
+            return lu.solve(b.astype(np.complex64)).astype(complex)
+    else:
+        # GMRES in double precision with a single precision incomplete LU as preconditioner
+        ilu = spla.spilu(single, drop_tol=1e-6, fill_factor=20)
+        preconditioner = spla.LinearOperator(single.shape, lambda v: ilu.solve(v.astype(np.complex64)).astype(complex),
+                                             dtype=complex)
+
+        def solve(b):
+            try:
+                x, info = spla.gmres(operator, b, M=preconditioner, rtol=1e-6, atol=0.0, restart=50, maxiter=1000)
+            except TypeError:  # scipy < 1.12
+                x, info = spla.gmres(operator, b, M=preconditioner, tol=1e-6, atol=0.0, restart=50, maxiter=1000)
+            if info != 0:
+                raise RuntimeError('The single precision preconditioner is not good enough')
+            return x
+    return solve
+
+
+def _refined_solve(liouvillian_matrix, method, tol=1e-14, max_iterations=20):
+    # mixed precision iterative refinement: the corrections are solved with the single precision factorization and
+    # the residuals are calculated in double precision, so x reaches double precision accuracy. The constrained
+    # matrix is only built in single precision, the residuals use the double precision Liouvillian with the trace
+    # row applied separately.
+    size = liouvillian_matrix.shape[0]
+    trace = trace_vector(int(round(np.sqrt(size))))
+    b = unit_vector(size)
+
+    def constrained_dot(vector):
+        result = liouvillian_matrix.dot(vector)
+        result[0] = trace.dot(vector)
+        return result
+
+    operator = spla.LinearOperator(liouvillian_matrix.shape, constrained_dot, dtype=complex)
+    solve = None
+    try:
+        solve = _single_solver(constrained(liouvillian_matrix.astype(np.complex64)).tocsc(), method, operator)
+        x = solve(b)
+        matrix_norm = max(spla.norm(liouvillian_matrix, np.inf), float(np.abs(trace).sum()))
+        for _ in range(max_iterations):
+            residual = b - constrained_dot(x)
+            residual_norm = np.abs(residual).max()
+            if residual_norm <= tol * (matrix_norm * np.abs(x).max() + np.abs(b).max()):
+                return x
+            # the residual is scaled to avoid underflows in single precision
+            x = x + residual_norm * solve(residual / residual_norm)
+    except RuntimeError:
+        pass
+    # the single precision factorization is too inaccurate for the refinement to converge, its factors are released
+    # before the double precision factorization
+    del solve
+    warnings.warn('The single precision steady state did not converge, it is solved in double precision',
+                  RuntimeWarning)
+    return spla.spsolve(constrained(liouvillian_matrix).tocsc(), b)
+
+
+def _operator_solve(operator, tol=1e-12):
+    # GMRES on a matrix free Liouvillian with the first equation replaced by Tr(rho) = 1
+    size = operator.shape[0]
+    trace = trace_vector(int(round(np.sqrt(size))))
+
+    def constrained_dot(vector):
+        result = operator.matvec(vector)
+        result[0] = trace.dot(vector)
+        return result
+
+    matrix = spla.LinearOperator(operator.shape, constrained_dot, dtype=complex)
+    if hasattr(operator, 'preconditioner'):
+        preconditioner = operator.preconditioner()
+    elif hasattr(operator, 'diagonal'):
+        diagonal = operator.diagonal()
+        diagonal[diagonal == 0] = 1.0
+        preconditioner = spla.LinearOperator(operator.shape, lambda vector: vector / diagonal, dtype=complex)
+    else:
+        preconditioner = None
+    try:
+        x, info = spla.gmres(matrix, unit_vector(size), M=preconditioner, rtol=tol, atol=0.0, restart=200,
+                             maxiter=20)
+    except TypeError:  # scipy < 1.12
+        x, info = spla.gmres(matrix, unit_vector(size), M=preconditioner, tol=tol, atol=0.0, restart=200,
+                             maxiter=20)
+    if info != 0:
+        raise RuntimeError('The iterative steady state did not converge')
+    return x
+
+
+def steadystate_matrix(liouvillian_matrix, method='auto', precision='double'):
+    """Returns the steady state of a Liouvillian as density matrix
+
+    :param liouvillian_matrix: The Liouvillian, see :func:`liouvillian`, or a matrix free Liouvillian like
+        :class:`ntypecqed.kernel.NTypeKernel`, which is only solved with the *iterative* method
+    :type liouvillian_matrix: scipy.sparse matrix or scipy.sparse.linalg.LinearOperator
+    :param method: One of *dense*, *sparse*, *iterative* or *auto* to select the method with :func:`select_method`
+    :type method: str
+    :param precision: Either *double* or *single*, which factorizes the Liouvillian in complex64 with half the memory
+        and refines the solution with residuals in double precision to double precision accuracy. Single precision
+        only reduces the memory of the factors, it is not faster, because SuperLU and LAPACK factorize complex64
+        about as fast as complex128. Matrix free Liouvillians are not factorized and always solved in double
+        precision.
+    :type precision: str
+    :rtype: numpy.ndarray
+    """
+    if precision not in PRECISIONS:
+        raise ValueError('%s is no precision, valid precisions are %s' % (precision, str(PRECISIONS)))
+    size = liouvillian_matrix.shape[0]
+    dimension = int(round(np.sqrt(size)))
+    method = choose_method('steadystate', liouvillian_matrix, method)
+    if not sp.issparse(liouvillian_matrix):
+        x = _operator_solve(liouvillian_matrix)
+        rho = x.reshape((dimension, dimension), order='F')
+        rho = 0.5 * (rho + rho.conj().T)
+        return rho / np.trace(rho)
+    if precision == 'single':
+        rho = _refined_solve(liouvillian_matrix, method).reshape((dimension, dimension), order='F')
+        rho = 0.5 * (rho + rho.conj().T)
+        return rho / np.trace(rho)
+    matrix = constrained(liouvillian_matrix)
+    b = unit_vector(size)
+    if method == 'dense':
+        x = scipy.linalg.solve(matrix.toarray(), b)
+    elif method == 'sparse':
+        x = spla.spsolve(matrix.tocsc(), b)
+    else:
+        x = _iterative_solve(matrix, b)
+    rho = x.reshape((dimension, dimension), order='F')
+    rho = 0.5 * (rho + rho.conj().T)
+    return rho / np.trace(rho)
+
+
+def steadystate(hamiltonian, c_ops, method='auto', precision='double'):
+    """Returns the steady state for a Hamiltonian and collapse operators, the counterpart of qutip.steadystate
+
+    :param hamiltonian: The Hamiltonian
+    :type hamiltonian: qutip.Qobj
+    :param c_ops: The collapse operators
+    :type c_ops: list(qutip.Qobj)
+    :param method: One of *dense*, *sparse*, *iterative* or *auto* to select the method with :func:`select_method`
+    :type method: str
+    :param precision: Precision of the factorization, see :func:`steadystate_matrix`
+    :type precision: str
+    :rtype: qutip.Qobj
+    """
+    from qutip import Qobj
+
+    rho = steadystate_matrix(liouvillian(hamiltonian, c_ops), method=method, precision=precision)
+    return Qobj(rho, dims=hamiltonian.dims)
+
+
+def steadystate_gradients(liouvillian_matrix, derivatives, operators):
+    """Returns the steady state expectation values of operators and their derivatives with respect to parameters
+
+    The constrained Liouvillian M (see :func:`steadystate_matrix`) is factored once by sparse LU. The steady state
+    solves M x = e_0, so a parameter change dL gives dx = -M^-1 dM x and the derivative of Tr(O rho) is -l.dot(dM x)
+    with the adjoint solution M^T l = e_O. The factorization is reused for the adjoint solves, one per operator,
+    and every parameter only costs a sparse matrix vector product.
+
+    :param liouvillian_matrix: The Liouvillian, see :func:`liouvillian`
+    :type liouvillian_matrix: scipy.sparse matrix
+    :param derivatives: Derivatives dL/dp of the Liouvillian for every parameter p
+    :type derivatives: dict
+    :param operators: Operators O whose expectation values are differentiated
+    :type operators: list(qutip.Qobj)
+    :return: tuple(steady state, array of the expectation values, dict with the array of derivatives per parameter)
+    :rtype: tuple(numpy.ndarray, numpy.ndarray, dict)
+    """
+    size = liouvillian_matrix.shape[0]
+    dimension = int(round(np.sqrt(size)))
+    lu = spla.splu(constrained(liouvillian_matrix).tocsc())
+    x = lu.solve(unit_vector(size))
+    expectations = np.column_stack([expectation_vector(operator) for operator in operators])
+    adjoints = lu.solve(expectations.astype(complex), trans='T')
+    gradients = dict()
+    for parameter, derivative in derivatives.items():
+        change = derivative.dot(x)
+        # the trace row of the constrained Liouvillian does not depend on any parameter
+        change[0] = 0.0
+        gradients[parameter] = -adjoints.T.dot(change)
+    return x.reshape((dimension, dimension), order='F'), expectations.T.dot(x), gradients
+
+
+def _time_steps(taulist):
+    steps = np.diff(np.asarray(taulist, dtype=float))
+    if np.any(steps < 0):
+        raise ValueError('taulist has to be sorted')
+    return steps
+
+
+def propagate(liouvillian_matrix, vector, taulist, method='auto'):
+    """Propagates a column stacked operator with the Liouvillian and returns it at all times of taulist
+
+    :param liouvillian_matrix: The Liouvillian, see :func:`liouvillian`, or a matrix free Liouvillian like
+        :class:`ntypecqed.kernel.NTypeKernel`, which is only propagated with the *ode* method
+    :type liouvillian_matrix: scipy.sparse matrix or scipy.sparse.linalg.LinearOperator
+    :param vector: The column stacked operator at time taulist[0]
+    :type vector: numpy.ndarray
+    :param taulist: Sorted times
+    :type taulist: list(float)
+    :param method: Either *dense* (exact propagators for every distinct time step), *sparse* (action of the matrix
+        exponential), *ode* (Runge-Kutta integration with matrix vector products only) or *auto* to select the
+        method with :func:`select_method`
+    :type method: str
+    :return: Array with the propagated vector in every row
+    :rtype: numpy.ndarray
+    """
+    size = liouvillian_matrix.shape[0]
+    method = choose_method('propagation', liouvillian_matrix, method)
+    steps = _time_steps(taulist)
+    result = np.empty((len(taulist), size), dtype=complex)
+    result[0] = vector
+    if method == 'ode':
+        from scipy.integrate import solve_ivp
+
+        if len(steps) == 0 or taulist[-1] == taulist[0]:
+            result[:] = vector
+            return result
+        # the absolute tolerance follows the scale of the vector, e.g. C rho A of weakly driven systems is tiny
+        solution = solve_ivp(lambda t, y: liouvillian_matrix.dot(y), (taulist[0], taulist[-1]),
+                             np.asarray(vector, dtype=complex), method='DOP853', t_eval=taulist, rtol=1e-8,
+                             atol=1e-10 * max(np.abs(vector).max(), np.finfo(float).tiny))
+        if not solution.success:
+            raise RuntimeError('Propagation failed: %s' % solution.message)
+        result[:] = solution.y.T
+    elif method == 'dense':
+        dense_liouvillian = liouvillian_matrix.toarray()
+        propagators = dict()
+        for i, step in enumerate(steps):
+            # uniform grids and grids with few distinct steps need few matrix exponentials
+            key = round(step, 12)
+            if key not in propagators:
+                propagators[key] = scipy.linalg.expm(dense_liouvillian * step)
+            result[i + 1] = propagators[key].dot(result[i])
+    else:
+        matrix = liouvillian_matrix.tocsc()
+        if len(steps) > 0 and np.allclose(steps, steps[0]):
+            result[:] = spla.expm_multiply(matrix, vector, start=0.0, stop=taulist[-1] - taulist[0],
+                                           num=len(taulist), endpoint=True)
+        else:
+            for i, step in enumerate(steps):
+                result[i + 1] = spla.expm_multiply(matrix * step, result[i]) if step > 0 else result[i]
+    return result
+
+
+def correlation_3op_1t(liouvillian_matrix, rho0, taulist, a_op, b_op, c_op, method='auto'):
+    """Returns <A(0)B(tau)C(0)> = Tr[B exp(L tau)(C rho0 A)], the counterpart of qutip.correlation_3op_1t
+
+    :param liouvillian_matrix: The Liouvillian, see :func:`liouvillian`, or a matrix free Liouvillian
+    :type liouvillian_matrix: scipy.sparse matrix or scipy.sparse.linalg.LinearOperator
+    :param rho0: The initial density matrix
+    :type rho0: qutip.Qobj
+    :param taulist: Sorted times starting at 0
+    :type taulist: list(float)
+    :param a_op: Operator A
+    :type a_op: qutip.Qobj
+    :param b_op: Operator B
+    :type b_op: qutip.Qobj
+    :param c_op: Operator C
+    :type c_op: qutip.Qobj
+    :param method: Propagation method, see :func:`propagate`
+    :type method: str
+    :rtype: numpy.ndarray
+    """
+    initial = c_op.full().dot(rho0.full()).dot(a_op.full())
+    vectors = propagate(liouvillian_matrix, operator_vector(initial), taulist, method=method)
+    return vectors.dot(expectation_vector(b_op))
+
+
+def rate_scale(liouvillian_matrix):
+    """Returns the largest absolute diagonal element, which estimates the fastest rate of the Liouvillian"""
+
+    return max(np.abs(liouvillian_matrix.diagonal()).max(), 1e-12)
+
+
+def slowest_eigenvalues(liouvillian_matrix, count=6):
+    """Returns the eigenvalues of the Liouvillian closest to zero without the steady state eigenvalue
+
+    The eigenvalues are found by shift-invert Arnoldi iteration close to zero. Matrix free Liouvillians are
+    inverted by preconditioned GMRES.
+
+    :param liouvillian_matrix: The Liouvillian, see :func:`liouvillian`, or a matrix free Liouvillian
+    :type liouvillian_matrix: scipy.sparse matrix or scipy.sparse.linalg.LinearOperator
+    :param count: Number of eigenvalues
+    :type count: int
+    :return: The eigenvalues sorted by their decay rate -Re(eigenvalue)
+    :rtype: numpy.ndarray
+    """
+    size = liouvillian_matrix.shape[0]
+    scale = rate_scale(liouvillian_matrix)
+    shift = -1e-3 * scale
+    k = min(count + 1, size - 2)
+    if sp.issparse(liouvillian_matrix):
+        if size <= 64:
+            eigenvalues = scipy.linalg.eigvals(liouvillian_matrix.toarray())
+        else:
+            eigenvalues = spla.eigs(liouvillian_matrix.tocsc(), k=k, sigma=shift, return_eigenvectors=False)
+    else:
+        shifted = spla.LinearOperator(liouvillian_matrix.shape, lambda v: liouvillian_matrix.matvec(v) - shift * v,
+                                      dtype=complex)
+        preconditioner = None
+        if hasattr(liouvillian_matrix, 'preconditioner'):
+            preconditioner = liouvillian_matrix.preconditioner(shift=shift)
+
+        def solve(vector):
+            try:
+                x, info = spla.gmres(shifted, vector, M=preconditioner, rtol=1e-10, atol=0.0, restart=200, maxiter=20)
+            except TypeError:  # scipy < 1.12
+                x, info = spla.gmres(shifted, vector, M=preconditioner, tol=1e-10, atol=0.0, restart=200, maxiter=20)
+            if info != 0:
+                raise RuntimeError('The shifted Liouvillian could not be inverted')
+            return x
+
+        inverse = spla.LinearOperator(liouvillian_matrix.shape, solve, dtype=complex)
+        eigenvalues = spla.eigs(liouvillian_matrix, k=k, sigma=shift, OPinv=inverse, return_eigenvectors=False)
+    # the steady state belongs to the eigenvalue zero
+    eigenvalues = eigenvalues[np.abs(eigenvalues) > 1e-8 * scale]
+    return eigenvalues[np.argsort(-eigenvalues.real)][:count]
+
+
+def spectral_gap(liouvillian_matrix):
+    """Returns the slowest relaxation rate towards the steady state, -Re of the slowest non zero eigenvalue
+
+    :param liouvillian_matrix: The Liouvillian, see :func:`liouvillian`, or a matrix free Liouvillian
+    :type liouvillian_matrix: scipy.sparse matrix or scipy.sparse.linalg.LinearOperator
+    :rtype: float
+    """
+    gap = -slowest_eigenvalues(liouvillian_matrix, count=1)[0].real
+    if gap <= 0:
+        raise ValueError('The Liouvillian has no unique steady state, the spectral gap is %g' % gap)
+    return gap
+
+
+def _correlation_limits(liouvillian_matrix, rho0, a_op, b_op, c_op):
+    # <A(0)B(tau)C(0)> at tau = 0 and for tau to infinity, where exp(L tau) X tends to Tr(X) rho_ss
+    rho = rho0.full()
+    initial = c_op.full().dot(rho).dot(a_op.full())
+    b_matrix = b_op.full()
+    start = np.trace(b_matrix.dot(initial))
+    if np.abs(liouvillian_matrix.dot(operator_vector(rho))).max() < 1e-10 * rate_scale(liouvillian_matrix):
+        # correlations are usually calculated in the steady state
+        rho_ss = rho
+    else:
+        rho_ss = steadystate_matrix(liouvillian_matrix)
+    return initial, start, np.trace(initial) * np.trace(b_matrix.dot(rho_ss))
+
+
+def correlation_time(liouvillian_matrix, rho0, a_op, b_op, c_op, tolerance=1e-3, method='auto'):
+    """Returns the time after which <A(0)B(tau)C(0)> deviates less than tolerance from its limit for large tau
+
+    The deviation from the limit decays like exp(-gap tau) with the :func:`spectral_gap`. The time is first estimated
+    as ln(|C(0) - C(inf)| / (tolerance max(|C(0)|, |C(inf)|))) / gap and extended until the propagated correlation
+    is within the tolerance, because faster modes may have larger amplitudes than C(0) - C(inf).
+
+    :param liouvillian_matrix: The Liouvillian, see :func:`liouvillian`, or a matrix free Liouvillian
+    :type liouvillian_matrix: scipy.sparse matrix or scipy.sparse.linalg.LinearOperator
+    :param rho0: The initial density matrix
+    :type rho0: qutip.Qobj
+    :param a_op: Operator A
+    :type a_op: qutip.Qobj
+    :param b_op: Operator B
+    :type b_op: qutip.Qobj
+    :param c_op: Operator C
+    :type c_op: qutip.Qobj
+    :param tolerance: Relative deviation from the limit
+    :type tolerance: float
+    :param method: Propagation method used for the check, see :func:`propagate`
+    :type method: str
+    :rtype: float
+    """
+    initial, start, limit = _correlation_limits(liouvillian_matrix, rho0, a_op, b_op, c_op)
+    scale = max(abs(start), abs(limit))
+    if scale == 0:
+        return 0.0
+    gap = spectral_gap(liouvillian_matrix)
+    stop_time = max(np.log(abs(start - limit) / (tolerance * scale)), 1.0) / gap
+    vector = operator_vector(initial)
+    expectation = expectation_vector(b_op)
+    elapsed = 0.0
+    for _ in range(20):
+        vector = propagate(liouvillian_matrix, vector, [elapsed, stop_time], method=method)[-1]
+        elapsed = stop_time
+        deviation = abs(vector.dot(expectation) - limit)
+        if deviation <= tolerance * scale:
+            break
+        stop_time += max(np.log(deviation / (tolerance * scale)), 0.1) / gap
+    return stop_time
+
+
+def _stepper(liouvillian_matrix, method):
+    # returns a function that propagates a vector by a single time step
+    if method == 'dense':
+        dense_liouvillian = liouvillian_matrix.toarray()
+        propagators = dict()
+
+        def step(vector, time_step):
+            key = round(time_step, 12)
+            if key not in propagators:
+                propagators[key] = scipy.linalg.expm(dense_liouvillian * time_step)
+            return propagators[key].dot(vector)
+    elif method == 'sparse':
+        matrix = liouvillian_matrix.tocsc()
+
+        def step(vector, time_step):
+            return spla.expm_multiply(matrix * time_step, vector)
+    else:
+        def step(vector, time_step):
+            return propagate(liouvillian_matrix, vector, [0.0, time_step], method='ode')[-1]
+    return step
+
+
+def adaptive_correlation_3op_1t(liouvillian_matrix, rho0, a_op, b_op, c_op, stop_time=None, tolerance=1e-3,
+                                method='auto', initial_steps=32, max_steps=2000):
+    """Returns <A(0)B(tau)C(0)> on adaptively chosen times from 0 to stop_time
+
+    The correlation is first calculated on times which are dense close to tau = 0 and grow geometrically towards
+    stop_time. Every interval whose midpoint deviates by more than tolerance (relative to the largest value) from
+    the linear interpolation is bisected until the correlation is resolved, so the bunching and antibunching
+    features are sampled densely and the exponential tail sparsely.
+
+    :param liouvillian_matrix: The Liouvillian, see :func:`liouvillian`, or a matrix free Liouvillian
+    :type liouvillian_matrix: scipy.sparse matrix or scipy.sparse.linalg.LinearOperator
+    :param rho0: The initial density matrix
+    :type rho0: qutip.Qobj
+    :param a_op: Operator A
+    :type a_op: qutip.Qobj
+    :param b_op: Operator B
+    :type b_op: qutip.Qobj
+    :param c_op: Operator C
+    :type c_op: qutip.Qobj
+    :param stop_time: Last time, defaults to the :func:`correlation_time`
+    :type stop_time: float
+    :param tolerance: Relative interpolation error of the correlation
+    :type tolerance: float
+    :param method: Propagation method, see :func:`propagate`
+    :type method: str
+    :param initial_steps: Number of geometrically growing steps before the refinement
+    :type initial_steps: int
+    :param max_steps: The refinement stops at this number of steps
+    :type max_steps: int
+    :return: tuple(times, correlation values)
+    """
+    method = choose_method('propagation', liouvillian_matrix, method)
+    initial, start, limit = _correlation_limits(liouvillian_matrix, rho0, a_op, b_op, c_op)
+    if stop_time is None:
+        stop_time = correlation_time(liouvillian_matrix, rho0, a_op, b_op, c_op, tolerance, method)
+    smallest_step = min(1.0 / rate_scale(liouvillian_matrix), stop_time / initial_steps)
+    times = np.concatenate(([0.0], np.geomspace(smallest_step, stop_time, initial_steps)))
+    vectors = list(propagate(liouvillian_matrix, operator_vector(initial), times, method=method))
+    expectation = expectation_vector(b_op)
+    values = [vector.dot(expectation) for vector in vectors]
+    times = list(times)
+    step = _stepper(liouvillian_matrix, method)
+    scale = max(abs(start), abs(limit))
+
+    unchecked = list(range(len(times) - 1))
+    while unchecked and len(times) < max_steps:
+        # intervals are checked from the end, so that the indices of the remaining ones stay valid
+        new_unchecked = []
+        for index in sorted(unchecked, reverse=True):
+            half_step = 0.5 * (times[index + 1] - times[index])
+            vector = step(vectors[index], half_step)
+            value = vector.dot(expectation)
+            times.insert(index + 1, times[index] + half_step)
+            vectors.insert(index + 1, vector)
+            values.insert(index + 1, value)
+            new_unchecked = [i + 1 for i in new_unchecked]
+            if abs(value - 0.5 * (values[index] + values[index + 2])) > tolerance * scale:
+                new_unchecked.extend([index, index + 1])
+        unchecked = new_unchecked
+    return np.array(times), np.array(values)
+
+
+def calibration_path():
+    """Returns the path of the calibration table of this machine
+
+    :rtype: str
+    """
+    cache_dir = os.environ.get('NTYPECQED_CACHE_DIR')
+    if cache_dir is None:
+        cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                                 'ntypecqed')
+    return os.path.join(cache_dir, 'solver_calibration_%s.json' % socket.gethostname())
+
+
+def _best_time(function, repeats):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def calibrate(truncations=CALIBRATION_TRUNCATIONS, save=True, verbose=False):
+    """Measures the run time of all methods for N-type systems of different size and stores the calibration table
+
+    :param truncations: Photon number truncations N_a = N_b of the measured systems
+    :type truncations: tuple(int)
+    :param save: Store the table at :func:`calibration_path`
+    :type save: bool
+    :param verbose: Print the measured times
+    :type verbose: bool
+    :return: The calibration table
+    :rtype: dict
+    """
+    from ntypecqed.hilbertspace import HilbertSpace
+    from ntypecqed.simulation import NTypeExperiment
+
+    global _calibration_table
+    system_parameters = {'g_p': 11, 'g_s': 9.5, 'eta_p': 0.2, 'eta_s': 0.2, 'omega_c': 3.0, 'delta_31': 0.0,
+                         'delta_42': 0.0, 'probe_detuning': 0.0, 'control_detuning': 0.0, 'signal_detuning': 0.0}
+    table = {'version': CALIBRATION_VERSION, 'numpy': np.__version__, 'scipy': scipy.__version__,
+             'steadystate': [], 'propagation': []}
+    for truncation in truncations:
+        environment = HilbertSpace(N_a=truncation, N_b=truncation)
+        experiment = NTypeExperiment(system_parameters, environment=environment)
+        matrix = liouvillian(experiment.driven_hamiltonian, environment.c_ops)
+        size = matrix.shape[0]
+        repeats = 3 if size < 1000 else 1
+
+        timings = dict()
+        for method in STEADYSTATE_METHODS:
+            if method == 'dense' and size > DENSE_LIMIT:
+                continue
+            timings[method] = _best_time(lambda: steadystate_matrix(matrix, method), repeats)
+        table['steadystate'].append({'dimension': size, 'nnz': int(matrix.nnz), 'timings': timings})
+
+        rho = steadystate_matrix(matrix, 'sparse')
+        vector = operator_vector(environment.a.full().dot(rho).dot(environment.a.dag().full()))
+        taulist = np.linspace(0, 2.0, 100)
+        timings = dict()
+        for method in PROPAGATION_METHODS:
+            if method == 'dense' and size > DENSE_LIMIT:
+                continue
+            timings[method] = _best_time(lambda: propagate(matrix, vector, taulist, method), repeats)
+        table['propagation'].append({'dimension': size, 'nnz': int(matrix.nnz), 'timings': timings})
+        if verbose:
+            print('dimension %d: steady state %s, propagation %s'
+                  % (size, table['steadystate'][-1]['timings'], timings))
+    if save:
+        path = calibration_path()
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp_path = path + '.%d.tmp' % os.getpid()
+        with open(tmp_path, 'w') as fh:
+            json.dump(table, fh, indent=1)
+        os.replace(tmp_path, path)
+        _calibration_table = table
+    return table
+
+
+def calibration_table():
+    """Returns the calibration table of this machine, or DEFAULT_CALIBRATION if it was not calibrated with
+    :func:`calibrate`
+
+    :rtype: dict
+    """
+    global _calibration_table
+    if _calibration_table is None:
+        try:
+            with open(calibration_path()) as fh:
+                table = json.load(fh)
+        except (IOError, ValueError):
+            table = None
+        if table is None or table.get('version') != CALIBRATION_VERSION:
+            table = DEFAULT_CALIBRATION
+        _calibration_table = table
+    return _calibration_table
+
+
+def select_method(kind, dimension, nnz=None, table=None):
+    """Selects the fastest method for a Liouvillian of the given dimension and number of non zero elements
+
+    The method that was fastest for the calibrated system closest in size (and sparsity, if nnz is given) is chosen.
+    Dense methods are never chosen for Liouvillians larger than DENSE_LIMIT.
+
+    :param kind: Either *steadystate* or *propagation*
+    :type kind: str
+    :param dimension: Dimension of the Liouvillian
+    :type dimension: int
+    :param nnz: Number of non zero elements of the Liouvillian
+    :type nnz: int
+    :param table: Calibration table, defaults to :func:`calibration_table`
+    :type table: dict
+    :return: The name of the method
+    :rtype: str
+    """
+    if kind not in ('steadystate', 'propagation'):
+        raise ValueError("kind has to be either 'steadystate' or 'propagation'")
+    if table is None:
+        table = calibration_table()
+
+    def distance(entry):
+        result = abs(np.log(entry['dimension']) - np.log(dimension))
+        if nnz:
+            result += abs(np.log(entry['nnz']) - np.log(nnz))
+        return result
+
+    timings = dict(min(table[kind], key=distance)['timings'])
+    if dimension > DENSE_LIMIT:
+        timings.pop('dense', None)
+    if not timings:
+        return 'sparse'
+    return min(timings, key=timings.get)
+
+
+def _check_method(kind, method):
+    valid_methods = STEADYSTATE_METHODS if kind == 'steadystate' else PROPAGATION_METHODS + ('ode',)
+    if method not in valid_methods:
+        raise ValueError('%s is no %s method, valid methods are %s and auto' % (method, kind, str(valid_methods)))
+    return method
+
+
+def choose_method(kind, liouvillian_matrix, method='auto'):
+    """Returns the given method or, for *auto*, the method selected for the Liouvillian by :func:`select_method`
+
+    Matrix free Liouvillians only support the methods in OPERATOR_METHODS.
+
+    :param kind: Either *steadystate* or *propagation*
+    :type kind: str
+    :param liouvillian_matrix: The Liouvillian
+    :type liouvillian_matrix: scipy.sparse matrix or scipy.sparse.linalg.LinearOperator
+    :param method: A method name or *auto*
+    :type method: str
+    :rtype: str
+    """
+    if not sp.issparse(liouvillian_matrix):
+        if method not in ('auto', OPERATOR_METHODS[kind]):
+            raise ValueError('Matrix free Liouvillians only support the %s method %s' % (kind, OPERATOR_METHODS[kind]))
+        return OPERATOR_METHODS[kind]
+    if method != 'auto':
+        return _check_method(kind, method)
+    return select_method(kind, liouvillian_matrix.shape[0], liouvillian_matrix.nnz)
+
+
+def choose_experiment_method(kind, experiment, method='auto'):
+    """Like :func:`choose_method` for the Liouvillian of an experiment, which is only built for *auto*
+
+    :param kind: Either *steadystate* or *propagation*
+    :type kind: str
+    :param experiment: The experiment
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param method: A method name or *auto*
+    :type method: str
+    :rtype: str
+    """
+    if method != 'auto':
+        return _check_method(kind, method)
+    return choose_method(kind, experiment.liouvillian, method)
+
+
+if __name__ == '__main__':
+    calibrate(verbose=True)
+    print('calibration table stored in %s' % calibration_path(), file=sys.stderr)
@@ -0,0 +1,255 @@
+""" Surrogates Module
+
+This module precomputes steady state quantities like the transmission and the cross correlation g2(0) on a grid
+over a box of parameters and stores them in a compact table on disk. Lookups interpolate in the memory mapped table
+and take microseconds instead of a steady state solve, e.g. for feedback loops of the lab control software.
+"""
+import bisect
+import itertools
+import json
+import os
+import numpy as np
+from ntypecqed.transmission_experiments import QUANTITIES
+
+
+def _hyperplane_points(grid):
+    # all points of a rectilinear grid in C order
+    return np.array(list(itertools.product(*grid)), dtype=float).reshape((-1, len(grid)))
+
+
+def refine_grid(evaluate, grid, tolerance=1e-3, max_steps=65):
+    """Refines a rectilinear grid axis by axis until linear interpolation reaches the tolerance
+
+    Every interval of an axis is checked by evaluating the hyperplane through its midpoint. If the midpoint deviates
+    from the linear interpolation by more than tolerance times the range of a quantity, the midpoint hyperplane is
+    inserted into the grid and both halves are checked again in the next round. Otherwise the deviation is kept as
+    error estimate of the interval.
+
+    :param evaluate: Function which returns the quantities as (n, q) array for an (n, d) array of points
+    :type evaluate: callable
+    :param grid: Initial grid points of every axis
+    :type grid: list(numpy.ndarray)
+    :param tolerance: Interpolation error relative to the range of each quantity
+    :type tolerance: float
+    :param max_steps: Largest number of grid points of one axis
+    :type max_steps: int
+    :return: tuple(grid, values with shape (n_1, ..., n_d, q), list of the (n_i - 1, q) error estimates per axis)
+    """
+    grid = [np.array(axis, dtype=float) for axis in grid]
+    shape = tuple(len(axis) for axis in grid)
+    values = evaluate(_hyperplane_points(grid))
+    values = values.reshape(shape + (values.shape[-1],))
+    errors = [np.full((len(axis) - 1, values.shape[-1]), np.inf) for axis in grid]
+    pending = [list(range(len(axis) - 1)) for axis in grid]
+    while any(pending):
+        scale = np.ptp(values.reshape((-1, values.shape[-1])), axis=0)
+        scale[scale == 0] = 1.0
+        for axis, intervals in enumerate(pending):
+            if not intervals:
+                continue
+            intervals = np.array(intervals)
+            midpoints = 0.5 * (grid[axis][intervals] + grid[axis][intervals + 1])
+            planes = list(grid)
+            planes[axis] = midpoints
+            new_shape = values.shape[:axis] + (len(midpoints),) + values.shape[axis + 1:]
+            new_values = evaluate(_hyperplane_points(planes)).reshape(new_shape)
+            interpolated = 0.5 * (np.take(values, intervals, axis) + np.take(values, intervals + 1, axis))
+            other_axes = tuple(i for i in range(values.ndim - 1) if i != axis)
+            deviation = np.abs(new_values - interpolated).max(axis=other_axes)
+            errors[axis][intervals] = deviation
+            relative = (deviation / scale).max(axis=1)
+            split = np.flatnonzero(relative > tolerance)
+            # only the worst intervals are split when the axis reaches max_steps
+            split = np.sort(split[np.argsort(-relative[split])][:max(max_steps - len(grid[axis]), 0)])
+            pending[axis] = []
+            if len(split) == 0:
+                continue
+            # insert the midpoint hyperplanes of the split intervals, their halves get a quarter of the error
+            positions = intervals[split] + 1
+            grid[axis] = np.insert(grid[axis], positions, midpoints[split])
+            values = np.insert(values, positions, np.take(new_values, split, axis), axis=axis)
+            halves = errors[axis][intervals[split]] / 4
+            errors[axis][intervals[split]] = halves
+            errors[axis] = np.insert(errors[axis], positions, halves, axis=0)
+            pending[axis] = sorted(set(positions + np.arange(len(positions)) - 1) |
+                                   set(positions + np.arange(len(positions))))
+    return grid, values, errors
+
+
+class SurrogateTable(object):
+    """A precomputed table of steady state quantities over a box of parameters
+
+    The table is built once with :meth:`build`, which is slow, and stored in a directory as a JSON header and the
+    values as .npy file. Opening a table memory maps the values, so :meth:`query` only reads the corners of the cell
+    that contains the point and interpolates multilinearly::
+
+        table = SurrogateTable.build(example_experiment, {'probe_detuning': (-25, 25), 'eta_p': (0.05, 0.5)},
+                                     '/data/tables/transmission', quantities=('n_a', 'g2'))
+        values, errors = SurrogateTable('/data/tables/transmission').query({'probe_detuning': 1.5, 'eta_p': 0.2})
+
+    :param path: Directory of the table
+    :type path: str
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'table.json')) as fh:
+            header = json.load(fh)
+        self.path = path
+        self.parameters = tuple(header['parameters'])
+        self.quantities = tuple(header['quantities'])
+        self.system_parameters = header['system_parameters']
+        self.environment = header['environment']
+        self.driving = header['driving']
+        self.tolerance = header['tolerance']
+        self.grid = [np.array(axis) for axis in header['grid']]
+        self.errors = [np.array(error).reshape((-1, len(self.quantities))) for error in header['errors']]
+        self.values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+        self._axes = [list(axis) for axis in self.grid]
+        shape = tuple(len(axis) for axis in self.grid)
+        strides = np.cumprod((1,) + shape[:0:-1])[::-1]
+        self._strides = [int(stride) for stride in strides]
+        self._flat_values = self.values.reshape((-1, len(self.quantities)))
+        self._corner_bits = list(itertools.product((0, 1), repeat=len(shape)))
+        self._corners = np.array([sum(stride * bit for stride, bit in zip(strides, corner))
+                                  for corner in self._corner_bits])
+
+    @classmethod
+    def build(cls, experiment, box, path, quantities=('n_a', 'n_b', 'g2'), initial_steps=5, tolerance=1e-3,
+              max_steps=65, pool=None, steadystate_method='auto'):
+        """Calculates the table of an experiment over a box of parameters and stores it in path
+
+        :param experiment: The experiment, parameters outside of the box keep their values
+        :type experiment: ntypecqed.simulation.NTypeExperiment
+        :param box: (start, stop) of every parameter of the box
+        :type box: dict
+        :param path: Directory of the table, it is created if it does not exist
+        :type path: str
+        :param quantities: Names of the tabulated quantities, see QUANTITIES of
+            :mod:`ntypecqed.transmission_experiments`
+        :type quantities: list(str)
+        :param initial_steps: Number of grid points of every axis before the refinement
+        :type initial_steps: int
+        :param tolerance: Interpolation error relative to the range of each quantity, see :func:`refine_grid`
+        :type tolerance: float
+        :param max_steps: Largest number of grid points of one axis
+        :type max_steps: int
+        :param pool: A running pool of the same experiment to calculate the steady states, a pool of a different
+            experiment raises a ValueError
+        :type pool: ntypecqed.transmission_experiments.SteadyStatePool
+        :param steadystate_method: Steady state method, *auto* selects the fastest method for the system size
+        :type steadystate_method: str
+        :return: The opened table
+        :rtype: SurrogateTable
+        """
+        for key in box:
+            if key not in experiment.system_parameters:
+                raise KeyError('%s is no simulation parameter' % key)
+        for quantity in quantities:
+            if quantity not in QUANTITIES:
+                raise ValueError('%s is no tabulated quantity, possible quantities are %s'
+                                 % (quantity, str(sorted(QUANTITIES))))
+        if pool is not None:
+            pool._check(experiment, box, steadystate_method)
+        parameters = list(box)
+        environment = experiment.environment
+        tmp_experiment = experiment.copy()
+
+        def evaluate(points):
+            updates = [dict(zip(parameters, point)) for point in points]
+            if pool is not None:
+                # the quantities are evaluated in the workers, so no steady states are sent back
+                values = [point_values for _, point_values, _ in pool.iter_expectations(updates, list(quantities))]
+                return np.array(values).reshape((len(points), len(quantities)))
+            values = []
+            for update in updates:
+                # the quantities are evaluated with the parameters of the point
+                for key, value in update.items():
+                    tmp_experiment[key] = value
+                rho = tmp_experiment.steadystate(steadystate_method)
+                values.append([QUANTITIES[quantity](tmp_experiment, rho) for quantity in quantities])
+            return np.array(values).reshape((len(points), len(quantities)))
+
+        initial_grid = [np.linspace(start, stop, initial_steps) for start, stop in box.values()]
+        grid, values, errors = refine_grid(evaluate, initial_grid, tolerance, max_steps)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'values.npy'), values)
+        header = {'parameters': parameters, 'quantities': list(quantities), 'tolerance': tolerance,
+                  'system_parameters': {key: float(value) for key, value in experiment.system_parameters.items()},
+                  'environment': {key: value.item() if isinstance(value, np.generic) else value
+                                  for key, value in environment.parameters.items()},
+                  'driving': experiment.driving, 'grid': [axis.tolist() for axis in grid],
+                  'errors': [error.tolist() for error in errors]}
+        # the header is written last, a table without header is incomplete
+        tmp_path = os.path.join(path, 'table.json.tmp')
+        with open(tmp_path, 'w') as fh:
+            json.dump(header, fh)
+        os.replace(tmp_path, os.path.join(path, 'table.json'))
+        return cls(path)
+
+    def matches(self, experiment):
+        """Returns whether the table was built for an experiment, apart from the parameters of the box
+
+        :param experiment: The experiment
+        :type experiment: ntypecqed.simulation.NTypeExperiment
+        :rtype: bool
+        """
+        if experiment.driving != self.driving or set(experiment.system_parameters) != set(self.system_parameters):
+            return False
+        if any(float(experiment[key]) != value for key, value in self.system_parameters.items()
+               if key not in self.parameters):
+            return False
+        return experiment.environment.parameters == self.environment
+
+    def query(self, point):
+        """Interpolates the quantities at one point of the box
+
+        :param point: Values of the parameters of the box, as dict or in the order of parameters
+        :type point: dict or list(float)
+        :return: tuple(array of the quantities, array of their estimated interpolation errors)
+        :rtype: tuple(numpy.ndarray, numpy.ndarray)
+        """
+        if isinstance(point, dict):
+            point = [point[parameter] for parameter in self.parameters]
+        if len(point) != len(self.parameters):
+            raise ValueError('The point needs one value for each of the parameters %s' % str(self.parameters))
+        base = 0
+        # the weights of the corners in the order of _corners are the outer product of (1 - f, f) of all axes
+        weights = [1.0]
+        error = 0.0
+        for axis, value, stride, errors in zip(self._axes, point, self._strides, self.errors):
+            if not axis[0] <= value <= axis[-1]:
+                raise ValueError('%s is outside of the table range [%s, %s]' % (value, axis[0], axis[-1]))
+            index = min(bisect.bisect_right(axis, value), len(axis) - 1) - 1
+            fraction = (value - axis[index]) / (axis[index + 1] - axis[index])
+            weights = [weight * factor for weight in weights for factor in (1.0 - fraction, fraction)]
+            base += index * stride
+            error = error + errors[index]
+        return np.dot(weights, self._flat_values[base + self._corners]), error
+
+    def query_many(self, points):
+        """Interpolates the quantities at many points of the box
+
+        :param points: (n, d) array with the values of the parameters in the order of parameters
+        :type points: numpy.ndarray
+        :return: tuple((n, q) array of the quantities, (n, q) array of their estimated interpolation errors)
+        :rtype: tuple(numpy.ndarray, numpy.ndarray)
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        if points.shape[1] != len(self.parameters):
+            raise ValueError('The points need one value for each of the parameters %s' % str(self.parameters))
+        base = np.zeros(len(points), dtype=int)
+        weights = np.ones((len(points), len(self._corners)))
+        error = np.zeros((len(points), len(self.quantities)))
+        for i, (axis, stride, errors) in enumerate(zip(self.grid, self._strides, self.errors)):
+            values = points[:, i]
+            if np.any(values < axis[0]) or np.any(values > axis[-1]):
+                raise ValueError('%s is outside of the table range [%s, %s]' % (self.parameters[i], axis[0], axis[-1]))
+            index = np.minimum(np.searchsorted(axis, values, side='right'), len(axis) - 1) - 1
+            fraction = (values - axis[index]) / (axis[index + 1] - axis[index])
+            for corner, bits in enumerate(self._corner_bits):
+                weights[:, corner] *= fraction if bits[i] else 1.0 - fraction
+            base += index * stride
+            error += errors[index]
+        corners = self._flat_values[base[:, np.newaxis] + self._corners[np.newaxis, :]]
+        return np.einsum('nc,ncq->nq', weights, corners), error
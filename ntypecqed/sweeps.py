@@ -0,0 +1,259 @@
+""" Sweeps Module
+
+This module runs large parameter studies in shards which are stored on a (shared) filesystem, so that
+a study survives failing nodes and can be distributed over several hosts.
+"""
+import errno
+import functools
+import hashlib
+import os
+import pickle
+import socket
+import time
+import uuid
+import numpy as np
+
+
+def _describe_value(value):
+    # the default repr of objects and functions contains their memory address, which changes between runs, so the
+    # arguments of a task are described by their values
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return type(value).__name__, [_describe_value(item) for item in value]
+    if isinstance(value, dict):
+        return 'dict', sorted((repr(key), _describe_value(item)) for key, item in value.items())
+    if isinstance(value, np.ndarray):
+        return 'ndarray', str(value.dtype), value.shape, hashlib.sha256(np.ascontiguousarray(value)).hexdigest()
+    if isinstance(value, np.generic):
+        return repr(value.item())
+    if isinstance(value, functools.partial) or callable(value) and hasattr(value, '__qualname__'):
+        return _describe_task(value)
+    name = '%s.%s' % (type(value).__module__, type(value).__qualname__)
+    if type(value).__repr__ is object.__repr__:
+        return name, _describe_value(getattr(value, '__dict__', {}))
+    return name, repr(value)
+
+
+def _describe_task(task):
+    if isinstance(task, functools.partial):
+        return _describe_task(task.func), _describe_value(task.args), _describe_value(task.keywords)
+    name = getattr(task, '__qualname__', getattr(task, '__name__', None))
+    if name is None:
+        return _describe_value(task)
+    return '%s.%s' % (getattr(task, '__module__', ''), name)
+
+
+class SweepRunner(object):
+    """Runs a parameter study shard by shard and stores every finished shard in a directory
+
+    The study is split into deterministic shards of `shard_size` consecutive parameter sets. A finished shard is
+    written atomically to `store`, so after a restart only the missing shards are calculated. Several processes or
+    hosts sharing the directory can work on the same study at once, each shard is claimed by atomically creating a
+    lock file (O_CREAT | O_EXCL, which is atomic on local filesystems and NFS).
+
+    Example for a study of transmission spectra::
+
+        task = functools.partial(scan_laser_freq, start_freq=-25, stop_freq=25, progress_bar=False)
+        parameter_sets = [{'omega_c': omega_c} for omega_c in np.linspace(0, 10, 200)]
+        runner = SweepRunner(example_experiment, task, parameter_sets, '/shared/studies/omega_c')
+        runner.run()
+        results = runner.results()
+
+    :param experiment: The experiment on which the study is performed
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param task: Picklable function which is called with an experiment for every parameter set
+    :type task: callable
+    :param parameter_sets: One dict of changed parameters per point of the study
+    :type parameter_sets: list(dict)
+    :param store: Directory in which the shards are stored
+    :type store: str
+    :param shard_size: Number of parameter sets per shard
+    :type shard_size: int
+    :param lock_timeout: Seconds after which the lock of a shard without progress is considered stale and the shard
+        is claimed again, None never takes over locks
+    :type lock_timeout: float
+    """
+
+    def __init__(self, experiment, task, parameter_sets, store, shard_size=10, lock_timeout=None):
+        if shard_size < 1:
+            raise ValueError('shard_size has to be at least 1')
+        self.experiment = experiment
+        self.task = task
+        self.parameter_sets = [dict(parameter_set) for parameter_set in parameter_sets]
+        for parameter_set in self.parameter_sets:
+            for key in parameter_set:
+                if key not in experiment.system_parameters:
+                    raise KeyError('%s is no simulation parameter' % key)
+        self.store = store
+        self.shard_size = shard_size
+        self.lock_timeout = lock_timeout
+        self._tokens = dict()
+        if not os.path.isdir(store):
+            os.makedirs(store)
+        self._check_manifest()
+
+    @property
+    def fingerprint(self):
+        """Identifies the study, a store can only hold the shards of one study
+
+        :return: hex digest of the study definition
+        :rtype: str
+        """
+        definition = (_describe_value(self.experiment.system_parameters),
+                      _describe_value(self.experiment.environment.parameters),
+                      _describe_value(self.experiment.driving), _describe_value(self.parameter_sets),
+                      self.shard_size, _describe_task(self.task))
+        return hashlib.sha256(repr(definition).encode('utf-8')).hexdigest()
+
+    @property
+    def shard_count(self):
+        """Number of shards of the study"""
+
+        return (len(self.parameter_sets) + self.shard_size - 1) // self.shard_size
+
+    def _shard_path(self, index):
+        return os.path.join(self.store, 'shard_%06d.pkl' % index)
+
+    def _lock_path(self, index):
+        return os.path.join(self.store, 'shard_%06d.lock' % index)
+
+    def _write_atomic(self, path, obj):
+        tmp_path = '%s.%s.%d.tmp' % (path, socket.gethostname(), os.getpid())
+        with open(tmp_path, 'wb') as fh:
+            pickle.dump(obj, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, path)
+
+    def _check_manifest(self):
+        manifest_path = os.path.join(self.store, 'study.pkl')
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'rb') as fh:
+                manifest = pickle.load(fh)
+            if manifest['fingerprint'] != self.fingerprint:
+                raise ValueError('The store %s belongs to a different study' % self.store)
+        else:
+            self._write_atomic(manifest_path, {'fingerprint': self.fingerprint, 'shard_size': self.shard_size,
+                                               'points': len(self.parameter_sets)})
+
+    def is_done(self, index):
+        """Returns if the shard with the given index is stored
+
+        :param index: Index of the shard
+        :type index: int
+        :rtype: bool
+        """
+        return os.path.exists(self._shard_path(index))
+
+    @property
+    def completed_shards(self):
+        """Indices of all stored shards"""
+
+        return [index for index in range(self.shard_count) if self.is_done(index)]
+
+    @property
+    def is_complete(self):
+        """True if all shards of the study are stored"""
+
+        return len(self.completed_shards) == self.shard_count
+
+    def _claim(self, index):
+        lock_path = self._lock_path(index)
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+            if self.lock_timeout is None or not self._is_stale(lock_path):
+                return False
+            # only the process which moves the stale lock away may retry the claim
+            stale_path = '%s.%s.%d.stale' % (lock_path, socket.gethostname(), os.getpid())
+            try:
+                os.rename(lock_path, stale_path)
+            except OSError:
+                return False
+            os.remove(stale_path)
+            return self._claim(index)
+        # the owner token tells the locks of this runner apart from the locks of a host which took over the shard
+        token = '%s %d %f %s' % (socket.gethostname(), os.getpid(), time.time(), uuid.uuid4().hex)
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(token + '\n')
+        self._tokens[index] = token
+        return True
+
+    def _is_stale(self, lock_path):
+        try:
+            return time.time() - os.path.getmtime(lock_path) > self.lock_timeout
+        except OSError:
+            return False
+
+    def _owns(self, index):
+        try:
+            with open(self._lock_path(index)) as fh:
+                return fh.read().strip() == self._tokens.get(index)
+        except OSError:
+            return False
+
+    def _release(self, index):
+        # the lock is only removed if no other host has taken it over in the meantime
+        if self._owns(index):
+            try:
+                os.remove(self._lock_path(index))
+            except OSError:
+                pass
+        self._tokens.pop(index, None)
+
+    def _run_shard(self, index):
+        results = []
+        for parameter_set in self.parameter_sets[index * self.shard_size:(index + 1) * self.shard_size]:
+            tmp_experiment = self.experiment.copy()
+            for key, value in parameter_set.items():
+                tmp_experiment[key] = value
+            results.append(self.task(tmp_experiment))
+            # mark progress, so that other hosts do not consider the lock as stale
+            if self._owns(index):
+                try:
+                    os.utime(self._lock_path(index), None)
+                except OSError:
+                    # another host has taken over the lock, both write the same shard atomically
+                    pass
+        return results
+
+    def run(self, max_shards=None):
+        """Calculates and stores all shards that are neither stored nor claimed by another process
+
+        :param max_shards: Stop after this number of calculated shards, None calculates all available shards
+        :type max_shards: int
+        :return: Number of shards calculated by this call
+        :rtype: int
+        """
+        calculated = 0
+        for index in range(self.shard_count):
+            if max_shards is not None and calculated >= max_shards:
+                break
+            if self.is_done(index) or not self._claim(index):
+                continue
+            try:
+                # another process may have finished the shard between the check and the claim
+                if not self.is_done(index):
+                    self._write_atomic(self._shard_path(index), self._run_shard(index))
+                    calculated += 1
+            finally:
+                self._release(index)
+        return calculated
+
+    def results(self):
+        """Loads the results of the study in the order of the parameter sets
+
+        :return: The results of the task for every parameter set
+        :rtype: list
+        """
+        missing = [index for index in range(self.shard_count) if not self.is_done(index)]
+        if missing:
+            raise RuntimeError('The study is not complete, missing shards: %s' % missing)
+        results = []
+        for index in range(self.shard_count):
+            with open(self._shard_path(index), 'rb') as fh:
+                results.extend(pickle.load(fh))
+        return results
@@ -1,27 +1,389 @@
 from __future__ import print_function
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, TYPE_CHECKING
+import multiprocessing
+import os
+import time
 from ntypecqed.simulation import NTypeExperiment
-from qutip import steadystate, expect, Qobj, mesolve, parallel_map, serial_map
 import numpy as np
 
+if TYPE_CHECKING:
+    from qutip import Qobj
 
-def ss_freq(freq, experiment, scan_laser):
+
+def _expect(operator, rho):
+    from qutip import expect
+
+    return expect(operator, rho).real
+
+
+def _normed_double(experiment, rho):
+    environment = experiment.environment
+    n_a, n_b = _expect(environment.n_a, rho), _expect(environment.n_b, rho)
+    return _expect(environment.a.dag() * environment.b.dag() * environment.b * environment.a, rho) / (n_a * n_b)
+
+
+def _normed_triple(trig_op, self_op, n_trig, n_self, rho):
+    operator = trig_op.dag() * self_op.dag() * self_op.dag() * self_op * self_op * trig_op
+    return _expect(operator, rho) / (_expect(n_trig, rho) * _expect(n_self, rho) ** 2)
+
+
+def _normed_transmission(experiment, rho, laser):
+    # photon number relative to the empty cavity which is driven on resonance, (2 eta / kappa)^2
+    environment = experiment.environment
+    if laser == 'probe':
+        number_operator, kappa, eta, driving = environment.n_a, environment.kappa_a, 'eta_p', experiment.driving_probe
+    else:
+        number_operator, kappa, eta, driving = environment.n_b, environment.kappa_b, 'eta_s', experiment.driving_signal
+    if driving != 'c':
+        raise ValueError('The %s transmission is normalized to the driven cavity, but the %s laser drives the atom'
+                         % (laser, laser))
+    if experiment[eta] == 0:
+        raise ValueError('The %s transmission is not defined for %s = 0' % (laser, eta))
+    return _expect(number_operator, rho) * kappa ** 2 / (4 * experiment[eta] ** 2)
+
+
+# derived steady state quantities, functions of the experiment with the parameters of the point and its steady state
+QUANTITIES = {
+    'n_a': lambda experiment, rho: _expect(experiment.environment.n_a, rho),
+    'n_b': lambda experiment, rho: _expect(experiment.environment.n_b, rho),
+    'g2': _normed_double,
+    'g3_probe': lambda experiment, rho: _normed_triple(experiment.environment.a, experiment.environment.b,
+                                                       experiment.environment.n_a, experiment.environment.n_b, rho),
+    'g3_signal': lambda experiment, rho: _normed_triple(experiment.environment.b, experiment.environment.a,
+                                                        experiment.environment.n_b, experiment.environment.n_a, rho),
+    'transmission_probe': lambda experiment, rho: _normed_transmission(experiment, rho, 'probe'),
+    'transmission_signal': lambda experiment, rho: _normed_transmission(experiment, rho, 'signal'),
+}
+
+
+def _check_quantities(quantities):
+    for quantity in quantities:
+        if isinstance(quantity, str) and quantity not in QUANTITIES:
+            raise ValueError('%s is no quantity, possible quantities are %s' % (quantity, str(sorted(QUANTITIES))))
+
+
+def _quantity_values(quantities, experiment, state):
+    # expectation values of observables and values of the named QUANTITIES, the experiment has the point's parameters
+    from qutip import expect
+
+    return tuple(QUANTITIES[quantity](experiment, state) if isinstance(quantity, str) else expect(quantity, state)
+                 for quantity in quantities)
+
+
+def _records(quantities, results):
+    # one field per quantity, (name, observable) tuples are named by their name
+    names = [quantity if isinstance(quantity, str) else quantity[0] for quantity in quantities]
+    columns = [np.array(column) for column in zip(*results)] if results else [np.array([]) for _ in names]
+    return np.rec.fromarrays(columns, names=names)
+
+
+def ss_freq(freq, experiment, scan_laser, steadystate_method='auto'):
     tmp_exp = experiment.copy()
     tmp_exp[scan_laser] = freq
-    return steadystate(tmp_exp.driven_hamiltonian, tmp_exp.environment.c_ops)
+    return tmp_exp.steadystate(steadystate_method)
 
 
-def ss_power(power, experiment, power_scanned_laser):
+def ss_power(power, experiment, power_scanned_laser, steadystate_method='auto'):
     tmp_exp = experiment.copy()
     tmp_exp[power_scanned_laser] = power
-    return steadystate(tmp_exp.driven_hamiltonian, tmp_exp.environment.c_ops)
+    return tmp_exp.steadystate(steadystate_method)
+
+
+_BLAS_THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS',
+                          'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# experiment and steady state method of the current pool worker process, set once by the pool initializer
+_worker_experiment = None
+_worker_steadystate_method = None
+
+
+def _init_pool_worker(experiment, blas_threads, steadystate_method):
+    global _worker_experiment, _worker_steadystate_method
+    _worker_experiment = experiment
+    _worker_steadystate_method = steadystate_method
+    if blas_threads is not None:
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            pass
+        else:
+            threadpool_limits(blas_threads)
+
+
+def _pool_steadystates(updates_chunk, evaluate=None):
+    # evaluate(experiment, state) is called while the experiment has the parameters of the point
+    results = []
+    for updates in updates_chunk:
+        old_values = {key: _worker_experiment[key] for key in updates}
+        for key, value in updates.items():
+            _worker_experiment[key] = value
+        try:
+            state = _worker_experiment.steadystate(_worker_steadystate_method)
+            results.append(state if evaluate is None else evaluate(_worker_experiment, state))
+        finally:
+            for key, value in old_values.items():
+                _worker_experiment[key] = value
+    return results
+
+
+def _pool_expectations(task):
+    # evaluates the observables in the worker, so only the kept steady states are sent back
+    start, updates_chunk, observables, keep_states = task
+
+    def evaluate(experiment, state):
+        return _quantity_values(observables, experiment, state), state if keep_states else None
+
+    return [(start + i, values, state) for i, (values, state) in
+            enumerate(_pool_steadystates(updates_chunk, evaluate))]
+
+
+class SteadyStatePool(object):
+    """A persistent pool of worker processes which calculates steady states of one experiment
+
+    The experiment (with its HilbertSpace) is sent to every worker only once when the pool starts. Afterwards
+    each task only carries the changed parameter values and several points are batched into one task.
+    The BLAS libraries of the workers are limited to `blas_threads` threads to avoid oversubscription of the cores.
+    The pool can be reused for many scans and is closed by :meth:`close` or by using it as a context manager::
+
+        with SteadyStatePool(example_experiment) as pool:
+            freqs, result = scan_laser_freq(example_experiment, -25, 25, pool=pool)
+
+    :param experiment: The experiment of which the steady states are calculated
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param processes: Number of worker processes, defaults to the number of cores
+    :type processes: int
+    :param chunk_size: Number of points per task, by default the points are split in four tasks per worker
+    :type chunk_size: int
+    :param blas_threads: Number of BLAS threads per worker, None leaves the BLAS configuration untouched
+    :type blas_threads: int
+    :param context: The multiprocessing start method, None uses the default of the platform. With *spawn* the BLAS
+        thread limit is always effective, but the main module of the script has to be guarded by
+        ``if __name__ == '__main__':``
+    :type context: str
+    :param steadystate_method: Steady state method, *auto* selects the method once for all points
+    :type steadystate_method: str
+    """
+
+    def __init__(self, experiment, processes=None, chunk_size=None, blas_threads=1, context=None,
+                 steadystate_method='auto'):
+        from ntypecqed.solvers import choose_experiment_method
+
+        self.experiment = experiment.copy()
+        self.steadystate_method = choose_experiment_method('steadystate', experiment, steadystate_method)
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.blas_threads = blas_threads
+
+        # the workers read the thread variables when they load their BLAS library
+        old_environ = {key: os.environ.get(key) for key in _BLAS_THREAD_VARIABLES}
+        if blas_threads is not None:
+            os.environ.update({key: str(blas_threads) for key in _BLAS_THREAD_VARIABLES})
+        try:
+            self._pool = multiprocessing.get_context(context).Pool(self.processes, initializer=_init_pool_worker,
+                                                                   initargs=(self.experiment, blas_threads,
+                                                                             self.steadystate_method))
+        finally:
+            for key, value in old_environ.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+    def matches(self, experiment, ignored=()):
+        """Returns whether an experiment equals the experiment of the pool apart from the ignored parameters
+
+        :param experiment: The experiment
+        :type experiment: ntypecqed.simulation.NTypeExperiment
+        :param ignored: Names of parameters which are set for every point anyway, e.g. the scanned parameter
+        :type ignored: iterable(str)
+        :rtype: bool
+        """
+        own = self.experiment
+        if own.driving_probe != experiment.driving_probe or own.driving_signal != experiment.driving_signal:
+            return False
+        if set(own.system_parameters) != set(experiment.system_parameters):
+            return False
+        if any(own[key] != experiment[key] for key in own.system_parameters if key not in ignored):
+            return False
+        return own.environment is experiment.environment or \
+            own.environment.parameters == experiment.environment.parameters
+
+    def _check(self, experiment, ignored=(), steadystate_method='auto'):
+        # a pool of another experiment would silently calculate the steady states of its own experiment
+        if not self.matches(experiment, ignored):
+            raise ValueError('The pool was started for a different experiment')
+        if steadystate_method != 'auto' and steadystate_method != self.steadystate_method:
+            raise ValueError('The pool uses the steady state method %s instead of %s'
+                             % (self.steadystate_method, steadystate_method))
+
+    def _chunks(self, updates):
+        chunk_size = self.chunk_size or max(1, int(np.ceil(len(updates) / (4.0 * self.processes))))
+        return [updates[i:i + chunk_size] for i in range(0, len(updates), chunk_size)]
+
+    def steadystates(self, updates):
+        """Calculates the steady states for a list of parameter changes with respect to the pool's experiment
+
+        :param updates: One dict of changed parameters per point
+        :type updates: list(dict)
+        :return: The steady states in the order of the updates
+        :rtype: list(qutip.Qobj)
+        """
+        for point in updates:
+            for key in point:
+                if key not in self.experiment.system_parameters:
+                    raise KeyError('%s is no simulation parameter' % key)
+        results = []
+        for chunk_result in self._pool.map(_pool_steadystates, self._chunks(list(updates))):
+            results.extend(chunk_result)
+        return results
+
+    def scan(self, parameter, values):
+        """Calculates the steady states while one parameter takes the given values
+
+        :param parameter: Name of the scanned parameter, e.g. *probe_detuning*
+        :type parameter: str
+        :param values: Values of the scanned parameter
+        :type values: iterable(float)
+        :return: The steady states in the order of the values
+        :rtype: list(qutip.Qobj)
+        """
+        return self.steadystates([{parameter: value} for value in values])
+
+    def iter_expectations(self, updates, observables, keep_states=False, ordered=True):
+        """Calculates the expectation values of observables for a list of parameter changes as they finish
+
+        :param updates: One dict of changed parameters per point
+        :type updates: list(dict)
+        :param observables: Observables or names of QUANTITIES which are evaluated in the workers
+        :type observables: list(qutip.Qobj or str)
+        :param keep_states: Also send the steady states back, otherwise they are dropped in the workers
+        :type keep_states: bool
+        :param ordered: Yield the points in the order of the updates, otherwise in the order they finish
+        :type ordered: bool
+        :return: Generator of tuples (index of the update, expectation values, steady state or None)
+        """
+        updates = list(updates)
+        for point in updates:
+            for key in point:
+                if key not in self.experiment.system_parameters:
+                    raise KeyError('%s is no simulation parameter' % key)
+        _check_quantities(observables)
+        tasks = []
+        start = 0
+        for chunk in self._chunks(updates):
+            tasks.append((start, chunk, observables, keep_states))
+            start += len(chunk)
+        imap = self._pool.imap if ordered else self._pool.imap_unordered
+        for chunk_result in imap(_pool_expectations, tasks):
+            for result in chunk_result:
+                yield result
+
+    def close(self):
+        """Stops the worker processes"""
+
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _progress(items, total):
+    # prints the progress in steps of 10 percent like the progress bar of qutip.serial_map
+    start = time.time()
+    next_percent = 10
+    for count, item in enumerate(items, 1):
+        yield item
+        while total and 100 * count >= next_percent * total:
+            print('%.1f%%. Run time: %.2fs' % (next_percent, time.time() - start))
+            next_percent += 10
+
+
+def iter_scan(experiment, parameter, values, observables=None, keep_states=False, ordered=True, parallelize=False,
+              progress_bar=False, pool=None, steadystate_method='auto'):
+    """Scans one parameter and yields the observables of every point as soon as it is calculated
+
+    The steady state of a point is dropped as soon as its observables are evaluated, so the memory does not grow
+    with the number of points unless keep_states is set::
+
+        for probe_detuning, (n_a, n_b) in iter_scan(example_experiment, 'probe_detuning', np.linspace(-25, 25, 1000)):
+            print(probe_detuning, n_a, n_b)
+
+    :param experiment: The experiment on which the scan is performed
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param parameter: Name of the scanned parameter, e.g. *probe_detuning*
+    :type parameter: str
+    :param values: Values of the scanned parameter
+    :type values: iterable(float)
+    :param observables: Observables for which the steadystate is calculated or names of derived quantities in
+        QUANTITIES like *g2*, which are calculated from the same steady state, defaults to n_a and n_b
+    :type observables: list(qutip.operator or str)
+    :param keep_states: Also yield the steady state of every point
+    :type keep_states: bool
+    :param ordered: Yield the points in the order of values, otherwise in the order they finish on the pool
+    :type ordered: bool
+    :param parallelize: Use multiple cores to calculate, a temporary :class:`SteadyStatePool` with the default start
+        method of the platform is used
+    :type parallelize: bool
+    :param progress_bar: Print the progress
+    :type progress_bar: bool
+    :param pool: A running pool of the same experiment to calculate the steady states, a pool of a different
+        experiment raises a ValueError
+    :type pool: SteadyStatePool
+    :param steadystate_method: Steady state method, *auto* selects the fastest method for the system size once,
+        see :func:`ntypecqed.solvers.select_method`
+    :type steadystate_method: str
+    :return: Generator of tuples (value, observables) or (value, observables, steady state) with keep_states
+    """
+
+    if parameter not in experiment.system_parameters:
+        raise KeyError('%s is no simulation parameter' % parameter)
+    values = list(values)
+    if observables is None:
+        observables = experiment.environment.n_a, experiment.environment.n_b
+    _check_quantities(observables)
+    if pool is not None or parallelize:
+        tmp_pool = None
+        if pool is None:
+            tmp_pool = pool = SteadyStatePool(experiment, steadystate_method=steadystate_method)
+        else:
+            pool._check(experiment, (parameter,), steadystate_method)
+        try:
+            results = pool.iter_expectations([{parameter: value} for value in values], observables, keep_states,
+                                             ordered)
+            if progress_bar:
+                results = _progress(results, len(values))
+            for index, expectations, state in results:
+                yield (values[index], expectations, state) if keep_states else (values[index], expectations)
+        finally:
+            if tmp_pool is not None:
+                tmp_pool.close()
+        return
+
+    from ntypecqed.solvers import choose_experiment_method
+
+    steadystate_method = choose_experiment_method('steadystate', experiment, steadystate_method)
+    tmp_experiment = experiment.copy()
+    points = _progress(values, len(values)) if progress_bar else values
+    for value in points:
+        tmp_experiment[parameter] = value
+        state = tmp_experiment.steadystate(steadystate_method)
+        expectations = _quantity_values(observables, tmp_experiment, state)
+        yield (value, expectations, state) if keep_states else (value, expectations)
 
 
 def scan_laser_freq(experiment, start_freq, stop_freq, observables=None, scan_laser='probe', steps=100,
-                    parallelize=False, progress_bar=True):
+                    parallelize=False, progress_bar=True, pool=None, steadystate_method='auto',
+                    quantities=None):
     """Scans the frequency of a laser and returns transmission by default or user given observables
 
-    :param parallelize: Use multiple cores to calculate
+    The steady states are not kept, see :func:`iter_scan`.
+
+    :param parallelize: Use multiple cores to calculate, a temporary :class:`SteadyStatePool` with the default start
+        method of the platform is used
     :type parallelize: bool
     :param experiment: The experiment on which the scan is performed
     :type experiment: ntypecqed.simulation.NTypeExperiment
@@ -35,33 +397,50 @@ def scan_laser_freq(experiment, start_freq, stop_freq, observables=None, scan_la
     :type scan_laser: str
     :param steps: Number of steps
     :type steps: int
-    :return: tuple(frequencies, list of lists of the steadystates of the observables)
+    :param progress_bar: Show a progress bar
+    :type progress_bar: bool
+    :param pool: A running pool of the same experiment to calculate the steady states, a pool of a different
+        experiment raises a ValueError
+    :type pool: SteadyStatePool
+    :param steadystate_method: Steady state method, *auto* selects the fastest method for the system size once,
+        see :func:`ntypecqed.solvers.select_method`
+    :type steadystate_method: str
+    :param quantities: Names of derived quantities in QUANTITIES, like *g2*, *g3_probe* or *transmission_probe*, or
+        tuples (name, observable), which are all calculated from the one steady state of every point. The
+        transmissions are normalized to the empty cavity, they raise a ValueError for a laser which drives the atom
+        or has no driving strength
+    :type quantities: list(str or tuple)
+    :return: tuple(frequencies, list of lists of the steadystates of the observables) or, if quantities are given,
+        tuple(frequencies, record array with one field per quantity)
     """
 
     freqs = np.linspace(start_freq, stop_freq, steps)
-    tmp_experiment = experiment.copy()
     if scan_laser in ['signal', 'control', 'probe']:
         scan_laser += '_detuning'
     else:
-        raise (KeyError, "No valid scan laser, must be one of signal, control, probe")
+        raise KeyError("No valid scan laser, must be one of signal, control, probe")
 
-    if observables is None:
-        observables = tmp_experiment.environment.n_a, tmp_experiment.environment.n_b
-    if parallelize:
-        steady_states = parallel_map(ss_freq, freqs, task_args=(experiment, scan_laser), progress_bar=progress_bar)
-    else:
-        steady_states = serial_map(ss_freq, freqs, task_args=(experiment, scan_laser), progress_bar=progress_bar)
-    ob_results = []
-    for result in steady_states:
-        ob_results.append(tuple(expect(result, ob) for ob in observables))
+    if quantities is not None:
+        if observables is not None:
+            raise ValueError('Either observables or quantities can be given')
+        observables = [quantity if isinstance(quantity, str) else quantity[1] for quantity in quantities]
+    ob_results = [expectations for _, expectations in
+                  iter_scan(experiment, scan_laser, freqs, observables, parallelize=parallelize,
+                            progress_bar=progress_bar, pool=pool, steadystate_method=steadystate_method)]
+    if quantities is not None:
+        return freqs, _records(quantities, ob_results)
     return freqs, list(map(list, zip(*ob_results)))
 
 
 def scan_laser_power(experiment, start_power, stop_power, observables=None, scan_laser='probe', steps=100,
-                     parallelize=False, progress_bar=True):
+                     parallelize=False, progress_bar=True, pool=None, steadystate_method='auto',
+                     quantities=None):
     """Scans the frequency of a laser and returns transmission by default or user given observables
 
-    :param parallelize: Use multiple cores to calculate
+    The steady states are not kept, see :func:`iter_scan`.
+
+    :param parallelize: Use multiple cores to calculate, a temporary :class:`SteadyStatePool` with the default start
+        method of the platform is used
     :type parallelize: bool
     :param experiment: The experiment on which the scan is performed
     :type experiment: ntypecqed.simulation.NTypeExperiment
@@ -75,39 +454,141 @@ def scan_laser_power(experiment, start_power, stop_power, observables=None, scan
     :type scan_laser: str
     :param steps: Number of steps
     :type steps: int
-    :return: tuple(powers, list of lists of the steadystates of the observables)
+    :param progress_bar: Show a progress bar
+    :type progress_bar: bool
+    :param pool: A running pool of the same experiment to calculate the steady states, a pool of a different
+        experiment raises a ValueError
+    :type pool: SteadyStatePool
+    :param steadystate_method: Steady state method, *auto* selects the fastest method for the system size once,
+        see :func:`ntypecqed.solvers.select_method`
+    :type steadystate_method: str
+    :param quantities: Names of derived quantities in QUANTITIES, like *g2*, *g3_probe* or *transmission_probe*, or
+        tuples (name, observable), which are all calculated from the one steady state of every point. The
+        transmissions are normalized to the empty cavity, they raise a ValueError for a laser which drives the atom
+        or has no driving strength
+    :type quantities: list(str or tuple)
+    :return: tuple(powers, list of lists of the steadystates of the observables) or, if quantities are given,
+        tuple(powers, record array with one field per quantity)
     """
 
     laser_powers = {'probe': 'eta_p', 'signal': 'eta_s', 'control': 'omega_c'}
     powers = np.linspace(start_power, stop_power, steps)
-    tmp_experiment = experiment.copy()
 
     try:
         power_scanned_laser = laser_powers[scan_laser]
     except KeyError:
-        raise (KeyError, "No valid scan laser, must be one of signal, control, probe")
+        raise KeyError("No valid scan laser, must be one of signal, control, probe")
 
-    if observables is None:
-        observables = tmp_experiment.environment.n_a, tmp_experiment.environment.n_b
-    if parallelize:
-        steady_states = parallel_map(ss_power, powers, task_args=(experiment, power_scanned_laser),
-                                     progress_bar=progress_bar)
-    else:
-        steady_states = serial_map(ss_power, powers, task_args=(experiment, power_scanned_laser),
-                                   progress_bar=progress_bar)
-    ob_results = []
-    for result in steady_states:
-        ob_results.append(tuple(expect(result, ob) for ob in observables))
+    if quantities is not None:
+        if observables is not None:
+            raise ValueError('Either observables or quantities can be given')
+        observables = [quantity if isinstance(quantity, str) else quantity[1] for quantity in quantities]
+    ob_results = [expectations for _, expectations in
+                  iter_scan(experiment, power_scanned_laser, powers, observables, parallelize=parallelize,
+                            progress_bar=progress_bar, pool=pool, steadystate_method=steadystate_method)]
+    if quantities is not None:
+        return powers, _records(quantities, ob_results)
     return powers, list(map(list, zip(*ob_results)))
 
 
+def scan_laser_freq_gradient(experiment, start_freq, stop_freq, observables=None, scan_laser='probe', steps=100,
+                             parameters=None, progress_bar=True):
+    """Scans the frequency of a laser and returns the observables and their derivatives with respect to parameters
 
-def solve_me(experiment: NTypeExperiment, starting_state: Qobj, hamiltonian: Qobj,
+    The derivatives are calculated with one adjoint solve per observable and point, see
+    :func:`ntypecqed.gradients.expectation_gradients`, which makes gradient based fits of spectra tractable. The
+    derivatives of the Liouvillian do not depend on the point and are built once per scan.
+
+    :param experiment: The experiment on which the scan is performed
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param start_freq: Start frequency of the scan
+    :type start_freq: float
+    :param stop_freq: Stop frequency of the scan
+    :type stop_freq: float
+    :param observables: Observables for which the steadystate is calculated
+    :type observables: list(qutip.operator)
+    :param scan_laser: Which laser to scan, either *probe*, *signal* or *control*
+    :type scan_laser: str
+    :param steps: Number of steps
+    :type steps: int
+    :param parameters: Names of the parameters, defaults to all simulation parameters and decay rates, see
+        :func:`ntypecqed.gradients.liouvillian_derivatives`
+    :type parameters: list(str)
+    :param progress_bar: Show a progress bar
+    :type progress_bar: bool
+    :return: tuple(frequencies, list of lists of the steadystates of the observables, dict with the list of lists of
+        the derivatives for every parameter)
+    """
+    from ntypecqed.gradients import expectation_gradients, liouvillian_derivatives
+
+    freqs = np.linspace(start_freq, stop_freq, steps)
+    if scan_laser in ['signal', 'control', 'probe']:
+        scan_laser += '_detuning'
+    else:
+        raise KeyError("No valid scan laser, must be one of signal, control, probe")
+
+    if observables is None:
+        observables = experiment.environment.n_a, experiment.environment.n_b
+    derivatives = liouvillian_derivatives(experiment, parameters)
+    tmp_experiment = experiment.copy()
+    results = []
+    for freq in _progress(freqs, len(freqs)) if progress_bar else freqs:
+        tmp_experiment[scan_laser] = freq
+        results.append(expectation_gradients(tmp_experiment, observables, derivatives=derivatives))
+    ob_results = [[values[i] for values, _ in results] for i in range(len(observables))]
+    gradients = {parameter: [[gradient[parameter][i] for _, gradient in results] for i in range(len(observables))]
+                 for parameter in derivatives}
+    return freqs, ob_results, gradients
+
+
+def solve_me(experiment: NTypeExperiment, starting_state: 'Qobj', hamiltonian: 'Qobj',
              time_dependent_parameters: Dict = None, start_time: float = 0.0, stop_time: float = 20.0,
-             observables: List[Qobj] = None, steps: int = 1000) -> List[List[float]]:
+             observables: List['Qobj'] = None, steps: int = 1000, backend: str = 'qutip') -> List[List[float]]:
+    """Solves the master equation of an experiment in time
+
+    With the *qutip* backend the (time dependent) hamiltonian is passed to qutip.mesolve together with
+    time_dependent_parameters as its args. The *kernel* backend integrates the matrix free
+    :class:`ntypecqed.kernel.NTypeKernel` of the experiment instead, then hamiltonian has to be None and
+    time_dependent_parameters maps simulation parameters to functions f(t).
+
+    :param experiment: The experiment which is solved
+    :type experiment: ntypecqed.simulation.NTypeExperiment
+    :param starting_state: The density matrix at start_time
+    :type starting_state: qutip.Qobj
+    :param hamiltonian: The Hamiltonian in a format accepted by qutip.mesolve, None for the kernel backend
+    :param time_dependent_parameters: Arguments of the Hamiltonian or, for the kernel backend, functions of time
+    :type time_dependent_parameters: dict
+    :param start_time: Start time
+    :type start_time: float
+    :param stop_time: Stop time
+    :type stop_time: float
+    :param observables: Observables whose expectation values are calculated, defaults to n_a and n_b
+    :type observables: list(qutip.Qobj)
+    :param steps: Number of time steps
+    :type steps: int
+    :param backend: Either *qutip* or *kernel*
+    :type backend: str
+    :return: tuple(times, result), the expectation values are stored in result.expect
+    """
     time_list = np.linspace(start_time, stop_time, steps)
     if observables is None:
         observables = [experiment.environment.n_a, experiment.environment.n_b]
+    if backend == 'kernel':
+        from types import SimpleNamespace
+
+        if hamiltonian is not None:
+            raise ValueError('The kernel backend builds the Hamiltonian from the experiment, '
+                             'hamiltonian has to be None')
+        expectations = experiment.kernel.evolve(starting_state, time_list, time_dependent_parameters, observables)
+        hermitian = [observable.isherm for observable in observables]
+        return time_list, SimpleNamespace(times=time_list, expect=[values.real if is_hermitian else values
+                                                                   for values, is_hermitian in
+                                                                   zip(expectations, hermitian)])
+    elif backend != 'qutip':
+        raise ValueError("backend has to be either 'qutip' or 'kernel'")
+
+    from qutip import mesolve
+
     res = mesolve(hamiltonian, starting_state, time_list, c_ops=experiment.environment.c_ops,
                   e_ops=observables, args=time_dependent_parameters, progress_bar=True)
     return time_list, res
@@ -9,5 +9,5 @@ setup(
     author='Nicolas Tolazzi',
     author_email='nicolas.tolazzi@mpq.mpg.de',
     description='A package for simulating Cavity QED with N-type atoms',
-    install_requires=['qutip', 'numpy']
+    install_requires=['qutip', 'numpy', 'scipy']
 )
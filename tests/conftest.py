@@ -0,0 +1,45 @@
+import os
+import pytest
+from ntypecqed import solvers
+from ntypecqed.simulation import NTypeExperiment
+
+EXAMPLE_PARAMETERS = {'g_p': 11, 'g_s': 9.5, 'eta_p': 0.2, 'eta_s': 0.2, 'omega_c': 3.0, 'delta_31': 1.0,
+                      'delta_42': 2.0, 'probe_detuning': -2.0, 'control_detuning': -1.0, 'signal_detuning': -3.0}
+# all lasers and atomic levels on resonance
+RESONANT_PARAMETERS = {'delta_31': 0.0, 'delta_42': 0.0, 'probe_detuning': 0.0, 'control_detuning': 0.0,
+                       'signal_detuning': 0.0}
+
+
+@pytest.fixture(autouse=True, scope='session')
+def cache_dir(tmp_path_factory):
+    # calibration tables of the tests must not end up in the cache of the user
+    old_cache_dir = os.environ.get('NTYPECQED_CACHE_DIR')
+    os.environ['NTYPECQED_CACHE_DIR'] = str(tmp_path_factory.mktemp('cache'))
+    solvers._calibration_table = None
+    yield os.environ['NTYPECQED_CACHE_DIR']
+    if old_cache_dir is None:
+        del os.environ['NTYPECQED_CACHE_DIR']
+    else:
+        os.environ['NTYPECQED_CACHE_DIR'] = old_cache_dir
+    solvers._calibration_table = None
+
+
+@pytest.fixture
+def example_parameters():
+    # returns a new dict of system parameters for every call, resonant sets all detunings to zero and keyword
+    # arguments replace single parameters
+    def make(resonant=False, **parameters):
+        system_parameters = dict(EXAMPLE_PARAMETERS)
+        if resonant:
+            system_parameters.update(RESONANT_PARAMETERS)
+        system_parameters.update(parameters)
+        return system_parameters
+    return make
+
+
+@pytest.fixture
+def example_experiment(example_parameters):
+    # returns a new experiment for every call, see example_parameters
+    def make(environment=None, driving=None, resonant=False, **parameters):
+        return NTypeExperiment(example_parameters(resonant, **parameters), environment=environment, driving=driving)
+    return make
@@ -1,5 +1,8 @@
+import numpy as np
+import pytest
 from ntypecqed.simulation import NTypeExperiment
-from ntypecqed.correlation_experiments import cross_correlation, self_correlation
+from ntypecqed.correlation_experiments import cross_correlation, self_correlation, two_time_correlation
+from ntypecqed import solvers
 from numpy.testing import assert_allclose
 
 
@@ -27,16 +30,16 @@ def test_cross_correlation():
                       0.52631579, 0.63157895, 0.73684211, 0.84210526, 0.94736842,
                       1.05263158, 1.15789474, 1.26315789, 1.36842105, 1.47368421,
                       1.57894737, 1.68421053, 1.78947368, 1.89473684, 2.]
-    expected_correlations = [0.99993557 + 0.j, 0.99991693 + 0.j, 0.99986206 + 0.j, 0.99979364 + 0.j,
-                             0.99969029 + 0.j, 0.99956057 + 0.j, 0.99936930 + 0.j, 0.99908206 + 0.j,
-                             0.99866195 + 0.j, 0.99806245 + 0.j, 0.99716982 + 0.j, 0.99578161 + 0.j,
-                             0.99344483 + 0.j, 0.98909764 + 0.j, 0.97993880 + 0.j, 0.95864573 + 0.j,
-                             0.90597578 + 0.j, 0.77511853 + 0.j, 0.47708228 + 0.j, 0.03676378 + 0.j,
-                             0.03676378 + 0.j, 0.12388339 + 0.j, 0.31794529 + 0.j, 0.48181659 + 0.j,
-                             0.61795296 + 0.j, 0.72543200 + 0.j, 0.80526852 + 0.j, 0.86324383 + 0.j,
-                             0.90466378 + 0.j, 0.93387119 + 0.j, 0.95432092 + 0.j, 0.96853616 + 0.j,
-                             0.97838206 + 0.j, 0.98515430 + 0.j, 0.98982813 + 0.j, 0.99304255 + 0.j,
-                             0.99523819 + 0.j, 0.99674103 + 0.j, 0.99776668 + 0.j, 0.99846928 + 0.j]
+    expected_correlations = [0.99993368 + 0.j, 0.99990314 + 0.j, 0.99985866 + 0.j, 0.99979396 + 0.j,
+                             0.99970004 + 0.j, 0.99956393 + 0.j, 0.99936702 + 0.j, 0.99908237 + 0.j,
+                             0.99867006 + 0.j, 0.99806804 + 0.j, 0.99717092 + 0.j, 0.99577638 + 0.j,
+                             0.99344139 + 0.j, 0.98908962 + 0.j, 0.97994020 + 0.j, 0.95864060 + 0.j,
+                             0.90598109 + 0.j, 0.77512235 + 0.j, 0.47708221 + 0.j, 0.03676378 + 0.j,
+                             0.03676378 + 0.j, 0.12402160 + 0.j, 0.31810546 + 0.j, 0.48182828 + 0.j,
+                             0.61795150 + 0.j, 0.72542881 + 0.j, 0.80526596 + 0.j, 0.86323789 + 0.j,
+                             0.90465855 + 0.j, 0.93388164 + 0.j, 0.95432462 + 0.j, 0.96853796 + 0.j,
+                             0.97837506 + 0.j, 0.98516050 + 0.j, 0.98982924 + 0.j, 0.99303554 + 0.j,
+                             0.99523440 + 0.j, 0.99674074 + 0.j, 0.99777184 + 0.j, 0.99847721 + 0.j]
     assert_allclose(freqs, expected_freqs, rtol=1e-4)
     assert_allclose(result, expected_correlations, rtol=1e-4)
 
@@ -63,16 +66,13 @@ def test_self_correlation():
                       1.05263158, 1.15789474, 1.26315789, 1.36842105, 1.47368421,
                       1.57894737, 1.68421053, 1.78947368, 1.89473684, 2.]
 
-    expected_correlations_probe = [0.60925398 + 0.00000000e+00j, 0.64446492 - 7.32366060e-11j,
-                                   0.89245198 + 6.95411475e-10j, 0.98525430 - 1.00115380e-08j,
-                                   0.90535706 - 1.65945730e-08j, 0.93164471 - 4.61875257e-09j,
-                                   0.99810073 + 3.53295437e-09j, 0.95555689 - 9.99006400e-09j,
-                                   0.94996060 + 2.33921725e-08j, 0.99799319 - 3.51579729e-08j,
-                                   0.98283165 + 2.18928764e-08j, 0.96661069 - 1.88689782e-08j,
-                                   0.99568820 + 5.94834881e-08j, 0.99553840 - 3.78230333e-08j,
-                                   0.97972187 + 4.07606921e-08j, 0.99428544 - 2.09818798e-08j,
-                                   1.00030556 + 5.05881961e-08j, 0.98891312 - 6.18797872e-08j,
-                                   0.99427521 + 4.38604691e-08j, 1.00131922 - 4.36222466e-08j]
+    expected_correlations_probe = [0.60925444 + 0.j, 0.64888088 + 0.j, 0.89155749 + 0.j,
+                                   0.98452050 + 0.j, 0.90378996 + 0.j, 0.93506556 + 0.j,
+                                   0.99833816 + 0.j, 0.95068581 + 0.j, 0.95342899 + 0.j,
+                                   1.00059137 + 0.j, 0.97735560 + 0.j, 0.96815998 + 0.j,
+                                   0.99968431 + 0.j, 0.99122792 + 0.j, 0.97927022 + 0.j,
+                                   0.99838945 + 0.j, 0.99776687 + 0.j, 0.98721057 + 0.j,
+                                   0.99761734 + 0.j, 1.00038596 + 0.j]
     expected_correlations_signal = [0.97626066 + 0.00000000e+00j, 0.98635155 - 2.99312684e-13j,
                                     0.99551888 - 2.20551006e-11j, 0.99951349 - 1.75969337e-11j,
                                     1.00089791 - 2.67736178e-11j, 1.00126515 + 2.33598677e-11j,
@@ -87,3 +87,60 @@ def test_self_correlation():
     assert_allclose(result_probe, expected_correlations_probe, rtol=1e-4)
     assert_allclose(result_signal, expected_correlations_signal, rtol=1e-4)
 
+
+def test_adaptive_self_correlation():
+    system_parameters = dict()
+    system_parameters["g_p"] = 11
+    system_parameters["g_s"] = 9.5
+    system_parameters["eta_p"] = 0.4
+    system_parameters["eta_s"] = 0.2
+    system_parameters["omega_c"] = 6.0
+    system_parameters["delta_31"] = 0.0
+    system_parameters["delta_42"] = 0.0
+    system_parameters["probe_detuning"] = 0.0
+    system_parameters["control_detuning"] = 0.0
+    system_parameters["signal_detuning"] = 0.0
+
+    example_experiment = NTypeExperiment(system_parameters)
+    times, result = self_correlation(example_experiment, adaptive=True, tolerance=1e-3)
+    # the window ends where the correlation has relaxed to 1 within the tolerance relative to its largest value
+    assert_allclose(result[-1], 1.0, atol=2e-3 * abs(result).max())
+    reference_times, reference = self_correlation(example_experiment, times[-1], steps=2000,
+                                                  propagation_method='dense')
+    assert len(times) < 200
+    assert_allclose(np.interp(reference_times, times, result.real), reference.real, atol=2e-3 * abs(reference).max())
+
+
+def _constant_probe(t):
+    return 0.2
+
+
+def test_two_time_correlation():
+    system_parameters = dict()
+    system_parameters["g_p"] = 11
+    system_parameters["g_s"] = 9.5
+    system_parameters["eta_p"] = 0.2
+    system_parameters["eta_s"] = 0.2
+    system_parameters["omega_c"] = 3.0
+    system_parameters["delta_31"] = 0.0
+    system_parameters["delta_42"] = 0.0
+    system_parameters["probe_detuning"] = 12.5
+    system_parameters["control_detuning"] = 0.0
+    system_parameters["signal_detuning"] = 0.0
+
+    example_experiment = NTypeExperiment(system_parameters)
+    environment = example_experiment.environment
+    tau_list = np.linspace(0, 0.5, 11)
+    ss = example_experiment.steadystate('sparse')
+    expected = solvers.correlation_3op_1t(example_experiment.liouvillian, ss, tau_list, environment.a.dag(),
+                                          environment.n_a, environment.a, method='dense')
+    # a constant pulse starting in the steady state gives the one time correlation for every start time
+    t_list = np.linspace(0, 1, 5)
+    for backend in ('liouvillian', 'kernel'):
+        result = two_time_correlation(example_experiment, {'eta_p': _constant_probe}, t_list, tau_list,
+                                      starting_state=ss, backend=backend)
+        assert result.shape == (len(t_list), len(tau_list))
+        for row in result:
+            assert_allclose(row, expected, rtol=1e-5, atol=1e-8 * abs(expected).max())
+    with pytest.raises(KeyError):
+        two_time_correlation(example_experiment, {'kappa': _constant_probe}, t_list, tau_list, starting_state=ss)
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from math import factorial
+from numpy.testing import assert_allclose
+from ntypecqed.hilbertspace import HilbertSpace
+from ntypecqed.counting import cumulants, cumulant_generating_function, fano_factors
+
+
+def test_cumulants(example_experiment):
+    experiment = example_experiment(HilbertSpace(N_a=3, N_b=2), eta_p=0.4, eta_s=0.3)
+    environment = experiment.environment
+    rates = cumulants(experiment, order=3)
+    assert len(rates) == 9
+    rho = experiment.steadystate('sparse')
+    assert_allclose(rates[(1, 0)], 2 * np.pi * environment.kappa_a * (environment.n_a * rho).tr().real, rtol=1e-10)
+    assert_allclose(rates[(0, 1)], 2 * np.pi * environment.kappa_b * (environment.n_b * rho).tr().real, rtol=1e-10)
+    assert_allclose(fano_factors(rates), [rates[(2, 0)] / rates[(1, 0)], rates[(0, 2)] / rates[(0, 1)]])
+
+    # Taylor coefficients of the cumulant generating function from a Cauchy integral over the counting fields
+    points, radius = 16, 0.5
+    fields = radius * np.exp(2j * np.pi * np.arange(points) / points)
+    values = np.array([[cumulant_generating_function(experiment, [s_a, s_b]) for s_b in fields] for s_a in fields])
+    coefficients = np.fft.fft2(values) / points ** 2
+    for (m, n), rate in rates.items():
+        expected = (coefficients[m, n] * factorial(m) * factorial(n) / radius ** (m + n)).real
+        assert_allclose(rate, expected, rtol=1e-8, atol=1e-12)
+
+    with pytest.raises(ValueError):
+        cumulants(experiment, order=0)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from ntypecqed.hilbertspace import HilbertSpace
+from ntypecqed.transmission_experiments import scan_laser_freq
+from ntypecqed.ensembles import ensemble_average
+
+
+def test_ensemble_average_methods(example_experiment):
+    experiment = example_experiment(HilbertSpace(N_a=2, N_b=2), eta_p=0.4, eta_s=0.3)
+    distributions = {'g_p': ('uniform', 5.0, 11.0), 'probe_detuning': ('normal', -2.0, 0.5)}
+    quadrature, quadrature_error = ensemble_average(experiment, distributions, method='quadrature', tolerance=1e-4,
+                                                    steadystate_method='sparse')
+    qmc, qmc_error = ensemble_average(experiment, distributions, tolerance=1e-3, seed=1, steadystate_method='sparse')
+    assert quadrature.shape == (2,)
+    assert np.all(qmc_error <= 1e-3 * np.abs(qmc).max())
+    assert_allclose(qmc, quadrature, rtol=1e-2)
+    with pytest.raises(KeyError):
+        ensemble_average(experiment, {'kappa': ('normal', 1.0, 0.1)})
+    # the 4 x 4 nodes of the tensor quadrature exceed max_samples
+    with pytest.raises(ValueError):
+        ensemble_average(experiment, distributions, method='quadrature', max_samples=10)
+    with pytest.raises(ValueError):
+        ensemble_average(experiment, distributions, method='quadrature', order=64)
+    with pytest.raises(ValueError):
+        ensemble_average(experiment, distributions, replicas=1)
+
+
+def test_ensemble_average_scan(example_experiment):
+    experiment = example_experiment(HilbertSpace(N_a=2, N_b=2), eta_p=0.4, eta_s=0.3)
+    freqs, expected = scan_laser_freq(experiment, -5, 5, steps=3, progress_bar=False, steadystate_method='sparse')
+    # a narrow distribution of a parameter that is not scanned reproduces the plain scan
+    mean, _ = ensemble_average(experiment, {'g_s': ('normal', 9.5, 1e-9)}, scan=('probe_detuning', freqs),
+                               method='quadrature', order=2, max_order=4, steadystate_method='sparse')
+    assert mean.shape == (2, 3)
+    assert_allclose(mean, expected, rtol=1e-6)
+    # a Doppler shift of the scanned laser shifts every scan value
+    shifted, _ = ensemble_average(experiment, {'probe_detuning': ('uniform', -1.0, -1.0)},
+                                  scan=('probe_detuning', freqs), method='quadrature', order=2, max_order=4,
+                                  steadystate_method='sparse')
+    _, expected_shifted = scan_laser_freq(experiment, -4, 6, steps=3, progress_bar=False, steadystate_method='sparse')
+    assert_allclose(shifted, expected_shifted, rtol=1e-6)
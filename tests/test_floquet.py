@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from ntypecqed.hilbertspace import HilbertSpace
+from ntypecqed.floquet import periodic_steadystate, periodic_expectations
+from ntypecqed.transmission_experiments import solve_me
+
+
+def test_periodic_steadystate(example_experiment):
+    experiment = example_experiment(HilbertSpace(N_a=2, N_b=2), eta_p=0.4, eta_s=0.3)
+    frequency = 0.5
+    modulation = {'omega_c': lambda t: 3.0 + 1.5 * np.cos(2 * np.pi * frequency * t),
+                  'probe_detuning': lambda t: -2.0 + 2.0 * np.sin(2 * np.pi * frequency * t)}
+    harmonics = periodic_steadystate(experiment, modulation, frequency)
+    assert len(harmonics) % 2 == 1
+    assert_allclose(harmonics[len(harmonics) // 2].tr(), 1.0, atol=1e-10)
+
+    # integrate through the transients and compare the last period
+    time_list, result = solve_me(experiment, experiment.steadystate('sparse'), None, modulation, 0.0, 40.0,
+                                 steps=401, backend='kernel')
+    averages, values = periodic_expectations(experiment, modulation, frequency, times=time_list[-21:])
+    assert_allclose(values, np.array(result.expect)[:, -21:], rtol=1e-5, atol=1e-8)
+    _, period_values = periodic_expectations(experiment, modulation, frequency,
+                                             times=np.arange(128) / (128 * frequency))
+    assert_allclose(averages, period_values.mean(axis=1), rtol=1e-10)
+
+    # without modulation the periodic steady state is the steady state
+    constant = periodic_expectations(experiment, {'omega_c': lambda t: 3.0}, frequency)
+    rho = experiment.steadystate('sparse')
+    assert_allclose(constant, [(experiment.environment.n_a * rho).tr().real,
+                               (experiment.environment.n_b * rho).tr().real], rtol=1e-10)
+
+    with pytest.raises(KeyError):
+        periodic_expectations(experiment, {'omega': lambda t: 3.0}, frequency)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from ntypecqed.simulation import NTypeExperiment
+from ntypecqed.hilbertspace import HilbertSpace
+from ntypecqed.correlation_experiments import double_coincidences, triple_coincidences
+from ntypecqed.gradients import expectation_gradients, double_coincidences_gradient, triple_coincidences_gradient
+from ntypecqed.transmission_experiments import scan_laser_freq, scan_laser_freq_gradient
+
+
+def gradient_experiment(example_experiment, **rates):
+    return example_experiment(HilbertSpace(N_a=3, N_b=2, **rates), eta_p=0.4, eta_s=0.3)
+
+
+def finite_difference(example_experiment, function, parameter, step=1e-5):
+    # central difference of function(experiment) in a simulation parameter or a decay rate of the HilbertSpace
+    values = []
+    for sign in (1, -1):
+        if parameter in NTypeExperiment.necessary_params:
+            experiment = gradient_experiment(example_experiment)
+            experiment[parameter] += sign * step
+        else:
+            default = getattr(HilbertSpace(), 'gamma_dephasing' if parameter == 'dephasing' else parameter)
+            experiment = gradient_experiment(example_experiment, **{parameter: default + sign * step})
+        values.append(function(experiment))
+    return (np.asarray(values[0]) - np.asarray(values[1])) / (2 * step)
+
+
+@pytest.mark.parametrize('parameter', ['g_p', 'eta_s', 'omega_c', 'probe_detuning', 'kappa_a', 'gamma42',
+                                       'dephasing'])
+def test_expectation_gradients(parameter, example_experiment):
+    experiment = gradient_experiment(example_experiment)
+    environment = experiment.environment
+    values, gradients = expectation_gradients(experiment)
+    assert_allclose(values, [expectation_gradients(experiment, [environment.n_a], [])[0][0],
+                             expectation_gradients(experiment, [environment.n_b], [])[0][0]])
+    expected = finite_difference(example_experiment, lambda e: expectation_gradients(e, parameters=[])[0], parameter)
+    assert_allclose(gradients[parameter], expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize('parameter', ['g_s', 'eta_p', 'delta_42'])
+def test_coincidences_gradients(parameter, example_experiment):
+    experiment = gradient_experiment(example_experiment)
+    value, gradients = double_coincidences_gradient(experiment, parameters=[parameter])
+    assert_allclose(value, double_coincidences(experiment, steadystate_method='sparse'), rtol=1e-8)
+    expected = finite_difference(example_experiment, lambda e: double_coincidences(e, steadystate_method='sparse'),
+                                 parameter)
+    assert_allclose(gradients[parameter], expected, rtol=1e-5)
+    value, gradients = triple_coincidences_gradient(experiment, 'signal', parameters=[parameter])
+    assert_allclose(value, triple_coincidences(experiment, 'signal', steadystate_method='sparse'), rtol=1e-8)
+    expected = finite_difference(example_experiment,
+                                 lambda e: triple_coincidences(e, 'signal', steadystate_method='sparse'), parameter)
+    assert_allclose(gradients[parameter], expected, rtol=1e-5)
+
+
+def test_scan_laser_freq_gradient(example_experiment):
+    experiment = gradient_experiment(example_experiment)
+    freqs, result, gradients = scan_laser_freq_gradient(experiment, -5, 5, steps=4, parameters=['g_p'],
+                                                        progress_bar=False)
+    expected_freqs, expected = scan_laser_freq(experiment, -5, 5, steps=4, progress_bar=False,
+                                               steadystate_method='sparse')
+    assert_allclose(freqs, expected_freqs)
+    assert_allclose(result, expected, rtol=1e-8)
+    assert list(gradients) == ['g_p']
+    assert np.shape(gradients['g_p']) == (2, 4)
+    _, result, gradients = scan_laser_freq_gradient(experiment, -5, 5, steps=0, parameters=['g_p'],
+                                                    progress_bar=False)
+    assert result == [[], []]
+    assert gradients == {'g_p': [[], []]}
+    with pytest.raises(KeyError):
+        expectation_gradients(experiment, parameters=['N_a'])
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from ntypecqed.hilbertspace import HilbertSpace
+from ntypecqed import solvers
+
+
+@pytest.mark.parametrize('driving', [None, {'probe': 'a', 'signal': 'a'}])
+def test_kernel_matches_liouvillian(driving, example_experiment):
+    environment = HilbertSpace(N_a=3, N_b=2, gamma41=0.5, dephasing=0.3)
+    experiment = example_experiment(environment, driving)
+    kernel = experiment.kernel
+    liouvillian = experiment.liouvillian
+    vector = np.random.RandomState(1).randn(kernel.shape[0]) + 1j * np.random.RandomState(2).randn(kernel.shape[0])
+    assert_allclose(kernel.matvec(vector), liouvillian.dot(vector), atol=1e-10)
+    assert_allclose(kernel.diagonal(), liouvillian.diagonal(), atol=1e-10)
+
+
+def test_kernel_steadystate(example_experiment):
+    experiment = example_experiment()
+    expected = experiment.steadystate('sparse').full()
+    assert_allclose(experiment.steadystate(backend='kernel').full(), expected, atol=1e-10)
+    with pytest.raises(ValueError):
+        experiment.steadystate('sparse', backend='kernel')
+
+
+def test_kernel_propagation(example_experiment):
+    experiment = example_experiment()
+    environment = experiment.environment
+    ss = experiment.steadystate('sparse')
+    taulist = np.linspace(0, 1, 11)
+    expected = solvers.correlation_3op_1t(experiment.liouvillian, ss, taulist, environment.a.dag(), environment.n_b,
+                                          environment.a, method='dense')
+    result = solvers.correlation_3op_1t(experiment.kernel, ss, taulist, environment.a.dag(), environment.n_b,
+                                        environment.a)
+    assert_allclose(result, expected, rtol=1e-6)
+
+
+def test_kernel_time_dependent_evolution(example_experiment):
+    experiment = example_experiment()
+    environment = experiment.environment
+    start = np.zeros((environment.n_a.shape[0],) * 2)
+    start[0, 0] = 1.0
+    times = np.linspace(0, 1, 21)
+    # a constant parameter given as function of time has to agree with the propagation of the Liouvillian
+    expected = solvers.propagate(experiment.liouvillian, solvers.operator_vector(start), times, method='dense')
+    expected = expected.dot(solvers.expectation_vector(environment.n_a))
+    result = experiment.kernel.evolve(start, times, {'eta_p': lambda t: 0.2}, [environment.n_a])[0]
+    assert_allclose(result, expected, rtol=1e-6, atol=1e-8)
+
+
+def test_kernel_batch_rhs(example_experiment):
+    kernel = example_experiment(HilbertSpace(N_a=3, N_b=2)).kernel
+    d = kernel.dimension
+    batch = np.random.RandomState(3).randn(d, d, 4) + 1j * np.random.RandomState(4).randn(d, d, 4)
+    result = kernel.rhs(batch)
+    for index in range(batch.shape[2]):
+        assert_allclose(result[:, :, index], kernel.rhs(batch[:, :, index]), atol=1e-12)
@@ -0,0 +1,57 @@
+import threading
+import pytest
+from numpy.testing import assert_allclose
+from ntypecqed.simulation import NTypeExperiment
+from ntypecqed.hilbertspace import HilbertSpace
+from ntypecqed.correlation_experiments import double_coincidences
+from ntypecqed.transmission_experiments import scan_laser_freq
+from ntypecqed.serve import SimulationServer, SimulationClient
+
+
+@pytest.fixture
+def address(tmpdir):
+    server = SimulationServer(batch_delay=0.05, steadystate_method='sparse')
+    path = str(tmpdir.join('ntypecqed.sock'))
+    ready = threading.Event()
+    thread = threading.Thread(target=server.serve_forever, args=(path, ready))
+    thread.start()
+    assert ready.wait(10)
+    yield path
+    server.shutdown()
+    thread.join(10)
+
+
+def test_simulation_server(address, example_parameters):
+    system_parameters = example_parameters()
+    environment = {'N_a': 2, 'N_b': 2}
+    experiment = NTypeExperiment(system_parameters, environment=HilbertSpace(**environment))
+    freqs, expected = scan_laser_freq(experiment, -4, 0, steps=5, progress_bar=False, steadystate_method='sparse')
+    scan = {'kind': 'scan', 'system_parameters': system_parameters, 'environment': environment,
+            'parameter': 'probe_detuning', 'values': list(freqs), 'quantities': ['n_a', 'n_b']}
+    coincidences = {'kind': 'double_coincidences', 'system_parameters': system_parameters, 'environment': environment}
+    with SimulationClient(address, timeout=60) as client:
+        # both requests are batched, the steady state of the coincidences is taken from the scan
+        scan_result, coincidences_result = client.requests([scan, coincidences])
+        statistics = client.request('statistics')
+        with pytest.raises(RuntimeError):
+            client.request('scan', system_parameters, environment=environment, parameter='kappa', values=[1.0])
+        # unhashable values are answered with an error and the connection stays open
+        with pytest.raises(RuntimeError):
+            client.request('double_coincidences', system_parameters, environment={'N_a': [2], 'N_b': 2})
+        with pytest.raises(RuntimeError):
+            client.request('double_coincidences', dict(system_parameters, g_p=[11]), environment=environment)
+        assert client.request('statistics')['requests'] == 7
+    assert_allclose(scan_result['n_a'], expected[0], rtol=1e-8)
+    assert_allclose(scan_result['n_b'], expected[1], rtol=1e-8)
+    assert_allclose(coincidences_result, double_coincidences(experiment, steadystate_method='sparse'), rtol=1e-8)
+    assert statistics['steadystates'] == 5
+    assert statistics['cache_hits'] == 1
+    assert statistics['environments'] == 1
+
+
+def test_simulation_server_no_socket(tmpdir):
+    path = tmpdir.join('ntypecqed.sock')
+    path.write('no socket')
+    with pytest.raises(ValueError):
+        SimulationServer().serve_forever(str(path))
+    assert path.read() == 'no socket'
@@ -0,0 +1,27 @@
+import pickle
+import subprocess
+import sys
+from ntypecqed import hilbertspace
+from ntypecqed.simulation import NTypeExperiment
+
+
+def test_import_does_not_load_qutip():
+    code = "import sys, ntypecqed.simulation, ntypecqed.transmission_experiments, " \
+           "ntypecqed.correlation_experiments; assert 'qutip' not in sys.modules"
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+def test_lazy_default_environment(example_parameters):
+    example_experiment = NTypeExperiment(example_parameters(resonant=True))
+    assert example_experiment._environment is None
+    assert example_experiment.environment is hilbertspace.default_environment()
+    assert example_experiment.copy().environment is example_experiment.environment
+
+    restored_experiment = pickle.loads(pickle.dumps(example_experiment))
+    assert restored_experiment._environment is None
+    assert restored_experiment.environment is hilbertspace.default_environment()
+
+    own_environment = hilbertspace.HilbertSpace(N_a=2)
+    other_experiment = NTypeExperiment(example_parameters(resonant=True), environment=own_environment)
+    assert pickle.loads(pickle.dumps(other_experiment)).environment.N_a == 2
+    assert other_experiment.copy().environment is not own_environment
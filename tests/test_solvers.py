@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import pytest
+import qutip
+from numpy.testing import assert_allclose
+from ntypecqed.hilbertspace import HilbertSpace
+from ntypecqed import solvers
+
+
+def test_steadystate_methods(example_experiment):
+    experiment = example_experiment()
+    expected = qutip.steadystate(experiment.driven_hamiltonian, experiment.environment.c_ops).full()
+    for method in solvers.STEADYSTATE_METHODS:
+        assert_allclose(experiment.steadystate(method).full(), expected, atol=1e-10)
+    with pytest.raises(ValueError):
+        experiment.steadystate('lu')
+
+
+def test_single_precision(example_experiment):
+    experiment = example_experiment()
+    expected = experiment.steadystate('sparse').full()
+    single_experiment = example_experiment(HilbertSpace(precision='single'))
+    for method in solvers.STEADYSTATE_METHODS:
+        assert_allclose(single_experiment.steadystate(method).full(), expected, atol=1e-10)
+        assert_allclose(experiment.steadystate(method, precision='single').full(), expected, atol=1e-10)
+    with pytest.raises(ValueError):
+        HilbertSpace(precision='half')
+
+
+def test_propagation_methods(example_experiment):
+    experiment = example_experiment()
+    environment = experiment.environment
+    ss = experiment.steadystate('sparse')
+    taulist = np.linspace(0, 1, 11)
+    expected = qutip.correlation_3op_1t(experiment.driven_hamiltonian, ss, taulist, environment.c_ops,
+                                        environment.a.dag(), environment.n_b, environment.a,
+                                        options={'atol': 1e-12, 'rtol': 1e-10})
+    for method in solvers.PROPAGATION_METHODS:
+        result = solvers.correlation_3op_1t(experiment.liouvillian, ss, taulist, environment.a.dag(),
+                                            environment.n_b, environment.a, method=method)
+        assert_allclose(result, expected, rtol=1e-6, atol=1e-12)
+
+
+def test_select_method():
+    table = {'steadystate': [{'dimension': 256, 'nnz': 2000, 'timings': {'dense': 1.0, 'sparse': 2.0}},
+                             {'dimension': 4096, 'nnz': 44000, 'timings': {'sparse': 2.0, 'iterative': 1.0}}],
+             'propagation': [{'dimension': 256, 'nnz': 2000, 'timings': {'dense': 1.0, 'sparse': 2.0}}]}
+    assert solvers.select_method('steadystate', 300, table=table) == 'dense'
+    assert solvers.select_method('steadystate', 10000, table=table) == 'iterative'
+    assert solvers.select_method('propagation', 300, table=table) == 'dense'
+    assert solvers.select_method('propagation', 10000, table=table) == 'sparse'
+
+    # without a calibration of the machine the built-in table is used and nothing is measured or stored
+    assert solvers.calibration_table() is solvers.DEFAULT_CALIBRATION
+    assert not os.path.exists(solvers.calibration_path())
+    assert solvers.select_method('steadystate', 4096) == 'iterative'
+
+    calibration = solvers.calibrate(truncations=(2,), save=False)
+    assert calibration['steadystate'][0]['dimension'] == 256
+    assert set(calibration['steadystate'][0]['timings']) == set(solvers.STEADYSTATE_METHODS)
+    assert solvers.select_method('steadystate', 256, table=calibration) in solvers.STEADYSTATE_METHODS
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from ntypecqed.hilbertspace import HilbertSpace
+from ntypecqed.correlation_experiments import double_coincidences
+from ntypecqed.surrogates import SurrogateTable
+from ntypecqed.transmission_experiments import SteadyStatePool
+
+
+def test_surrogate_table(tmpdir, example_experiment):
+    experiment = example_experiment(HilbertSpace(N_a=2, N_b=2), resonant=True)
+    # numpy scalars are stored in the header as floats
+    experiment['omega_c'] = np.int64(3)
+    path = str(tmpdir.join('table'))
+    box = {'probe_detuning': (-20, 20), 'eta_p': (0.1, 0.3)}
+    table = SurrogateTable.build(experiment, box, path, quantities=('n_a', 'g2'), initial_steps=3, tolerance=1e-2,
+                                 max_steps=33, steadystate_method='sparse')
+    assert len(table.grid[0]) > 3
+    reopened = SurrogateTable(path)
+    assert reopened.parameters == ('probe_detuning', 'eta_p')
+    assert isinstance(reopened.values, np.memmap)
+    assert reopened.matches(experiment)
+    assert not reopened.matches(example_experiment(HilbertSpace(N_a=2, N_b=2, dephasing=0.5), resonant=True))
+
+    for probe_detuning, eta_p in [(reopened.grid[0][2], 0.3), (3.1, 0.17), (-12.7, 0.25)]:
+        point_experiment = experiment.copy()
+        point_experiment['probe_detuning'] = probe_detuning
+        point_experiment['eta_p'] = eta_p
+        expected = [point_experiment.steadystate('sparse').full().dot(experiment.environment.n_a.full()).trace().real,
+                    double_coincidences(point_experiment, steadystate_method='sparse')]
+        values, errors = reopened.query({'probe_detuning': probe_detuning, 'eta_p': eta_p})
+        assert np.all(np.abs(values - expected) <= 3 * errors + 1e-10)
+        many_values, many_errors = reopened.query_many([[probe_detuning, eta_p]])
+        assert_allclose(many_values[0], values)
+        assert_allclose(many_errors[0], errors)
+    with pytest.raises(ValueError):
+        reopened.query([25.0, 0.2])
+    with pytest.raises(ValueError):
+        reopened.query([3.1])
+    with pytest.raises(ValueError):
+        reopened.query_many([[3.1]])
+
+
+def test_surrogate_table_pool(tmpdir, example_experiment):
+    experiment = example_experiment(HilbertSpace(N_a=2, N_b=2), resonant=True)
+    box = {'probe_detuning': (-20, 20), 'eta_p': (0.1, 0.3)}
+    expected = SurrogateTable.build(experiment, box, str(tmpdir.join('serial')), initial_steps=3, tolerance=1e-2,
+                                    max_steps=9, steadystate_method='sparse')
+    with SteadyStatePool(experiment, processes=2, steadystate_method='sparse') as pool:
+        table = SurrogateTable.build(experiment, box, str(tmpdir.join('pool')), initial_steps=3, tolerance=1e-2,
+                                     max_steps=9, pool=pool, steadystate_method='sparse')
+    assert_allclose(table.values, expected.values, rtol=1e-8, atol=1e-12)
@@ -0,0 +1,73 @@
+import functools
+import os
+import time
+import pytest
+from ntypecqed.correlation_experiments import double_coincidences
+from ntypecqed.sweeps import SweepRunner
+
+
+class NodeFailure(object):
+    # the default repr of the failure contains its memory address, which must not change the study
+
+    def __init__(self, marker, omega_c):
+        self.marker = marker
+        self.omega_c = omega_c
+
+
+def failing_double_coincidences(experiment, failure):
+    if experiment['omega_c'] == failure.omega_c and os.path.exists(failure.marker):
+        raise RuntimeError('node failure')
+    return double_coincidences(experiment)
+
+
+def test_sweep_runner(tmpdir, example_experiment):
+    experiment = example_experiment(resonant=True)
+    parameter_sets = [{'omega_c': omega_c} for omega_c in (1.0, 2.0, 3.0, 4.0, 5.0)]
+    store = str(tmpdir.join('study'))
+
+    marker = tmpdir.join('node_failure')
+    marker.write('')
+    failing_task = functools.partial(failing_double_coincidences, failure=NodeFailure(str(marker), 4.0))
+    runner = SweepRunner(experiment, failing_task, parameter_sets, store, shard_size=2)
+    assert runner.shard_count == 3
+    with pytest.raises(RuntimeError):
+        runner.run()
+    assert runner.completed_shards == [0]
+    assert not os.path.exists(os.path.join(store, 'shard_000001.lock'))
+    with pytest.raises(RuntimeError):
+        runner.results()
+
+    with pytest.raises(ValueError):
+        SweepRunner(experiment, double_coincidences, parameter_sets, store, shard_size=2)
+
+    # the failure is gone after the restart, the finished shard is not calculated again
+    marker.remove()
+    runner = SweepRunner(experiment.copy(), functools.partial(failing_double_coincidences,
+                                                              failure=NodeFailure(str(marker), 4.0)),
+                         parameter_sets, store, shard_size=2)
+    # another host holds the lock of shard 2
+    with open(os.path.join(store, 'shard_000002.lock'), 'w') as fh:
+        fh.write('other-host 1 0\n')
+    assert runner.run() == 1
+    assert runner.completed_shards == [0, 1]
+
+    runner.lock_timeout = 60.0
+    assert runner.run() == 0
+    old = time.time() - 120.0
+    os.utime(os.path.join(store, 'shard_000002.lock'), (old, old))
+    assert runner.run() == 1
+    assert runner.is_complete
+
+    # a lock which another host has taken over is left alone
+    with open(os.path.join(store, 'shard_000000.lock'), 'w') as fh:
+        fh.write('other-host 1 0\n')
+    runner._release(0)
+    assert os.path.exists(os.path.join(store, 'shard_000000.lock'))
+
+    results = runner.results()
+    expected = []
+    for parameter_set in parameter_sets:
+        tmp_experiment = experiment.copy()
+        tmp_experiment['omega_c'] = parameter_set['omega_c']
+        expected.append(double_coincidences(tmp_experiment))
+    assert results == expected
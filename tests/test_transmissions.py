@@ -1,6 +1,8 @@
 from ntypecqed.simulation import NTypeExperiment
-from ntypecqed.transmission_experiments import scan_laser_freq, scan_laser_power
+from ntypecqed.transmission_experiments import scan_laser_freq, scan_laser_power, SteadyStatePool, iter_scan
+from ntypecqed.correlation_experiments import double_coincidences, triple_coincidences
 from numpy.testing import assert_allclose
+import pytest
 
 
 def test_scan_laser_freq():
@@ -79,3 +81,110 @@ def test_scan_laser_power():
     assert_allclose(result[0], expected_transmission_1, rtol=1e-4)
     assert_allclose(result[1], expected_transmission_2, rtol=1e-4)
 
+
+def test_steady_state_pool():
+    system_parameters = dict()
+    system_parameters["g_p"] = 11
+    system_parameters["g_s"] = 9.5
+    system_parameters["eta_p"] = 0.2
+    system_parameters["eta_s"] = 0.2
+    system_parameters["omega_c"] = 3.0
+    system_parameters["delta_31"] = 1.0
+    system_parameters["delta_42"] = 2.0
+    system_parameters["probe_detuning"] = -2.0
+    system_parameters["control_detuning"] = -1.0
+    system_parameters["signal_detuning"] = -3.0
+
+    example_experiment = NTypeExperiment(system_parameters)
+    _, expected_freq_result = scan_laser_freq(example_experiment, -25, 25, steps=7, progress_bar=False)
+    _, expected_power_result = scan_laser_power(example_experiment, 0, 1, steps=5, progress_bar=False)
+    with SteadyStatePool(example_experiment, processes=2, chunk_size=2) as pool:
+        _, freq_result = scan_laser_freq(example_experiment, -25, 25, steps=7, pool=pool)
+        _, power_result = scan_laser_power(example_experiment, 0, 1, steps=5, pool=pool)
+        other_experiment = example_experiment.copy()
+        other_experiment['g_p'] = 5.0
+        with pytest.raises(ValueError):
+            scan_laser_freq(other_experiment, -25, 25, steps=7, pool=pool)
+    assert example_experiment['probe_detuning'] == -2.0
+    assert_allclose(freq_result, expected_freq_result, rtol=1e-8)
+    assert_allclose(power_result, expected_power_result, rtol=1e-8)
+
+
+def test_iter_scan():
+    system_parameters = dict()
+    system_parameters["g_p"] = 11
+    system_parameters["g_s"] = 9.5
+    system_parameters["eta_p"] = 0.2
+    system_parameters["eta_s"] = 0.2
+    system_parameters["omega_c"] = 3.0
+    system_parameters["delta_31"] = 1.0
+    system_parameters["delta_42"] = 2.0
+    system_parameters["probe_detuning"] = -2.0
+    system_parameters["control_detuning"] = -1.0
+    system_parameters["signal_detuning"] = -3.0
+
+    example_experiment = NTypeExperiment(system_parameters)
+    freqs, expected = scan_laser_freq(example_experiment, -25, 25, steps=7, progress_bar=False)
+    environment = example_experiment.environment
+    scan = iter_scan(example_experiment, 'probe_detuning', freqs, keep_states=True)
+    for i, (freq, observables, state) in enumerate(scan):
+        assert freq == freqs[i]
+        assert_allclose(observables, [expected[0][i], expected[1][i]], rtol=1e-8)
+        assert_allclose(state.full().dot(environment.n_a.full()).trace().real, expected[0][i], rtol=1e-8)
+    with SteadyStatePool(example_experiment, processes=2, chunk_size=2) as pool:
+        results = list(iter_scan(example_experiment, 'probe_detuning', freqs, ordered=False, pool=pool))
+    assert sorted(freq for freq, _ in results) == list(freqs)
+    for freq, observables in results:
+        i = list(freqs).index(freq)
+        assert_allclose(observables, [expected[0][i], expected[1][i]], rtol=1e-8)
+
+
+def test_scan_quantities():
+    system_parameters = dict()
+    system_parameters["g_p"] = 11
+    system_parameters["g_s"] = 9.5
+    system_parameters["eta_p"] = 0.2
+    system_parameters["eta_s"] = 0.2
+    system_parameters["omega_c"] = 3.0
+    system_parameters["delta_31"] = 1.0
+    system_parameters["delta_42"] = 2.0
+    system_parameters["probe_detuning"] = -2.0
+    system_parameters["control_detuning"] = -1.0
+    system_parameters["signal_detuning"] = -3.0
+
+    example_experiment = NTypeExperiment(system_parameters)
+    environment = example_experiment.environment
+    quantities = ['n_a', 'g2', 'g3_probe', 'g3_signal', 'transmission_probe', ('sigma_33', environment.sigma_33)]
+    freqs, records = scan_laser_freq(example_experiment, -25, 25, steps=5, progress_bar=False, quantities=quantities)
+    _, expected = scan_laser_freq(example_experiment, -25, 25, steps=5, progress_bar=False,
+                                  observables=[environment.n_a, environment.sigma_33])
+    assert records.dtype.names == ('n_a', 'g2', 'g3_probe', 'g3_signal', 'transmission_probe', 'sigma_33')
+    assert len(records) == 5
+    assert_allclose(records.n_a, expected[0], rtol=1e-8)
+    assert_allclose(records.sigma_33, expected[1], rtol=1e-8)
+    kappa_a, eta_p = environment.kappa_a, system_parameters["eta_p"]
+    assert_allclose(records.transmission_probe, records.n_a * kappa_a ** 2 / (4 * eta_p ** 2), rtol=1e-12)
+    tmp_experiment = example_experiment.copy()
+    for freq, record in zip(freqs, records):
+        tmp_experiment['probe_detuning'] = freq
+        assert_allclose(record.g2, double_coincidences(tmp_experiment), rtol=1e-8)
+        assert_allclose(record.g3_probe, triple_coincidences(tmp_experiment, 'probe'), rtol=1e-8)
+        assert_allclose(record.g3_signal, triple_coincidences(tmp_experiment, 'signal'), rtol=1e-8)
+
+    # the transmission is normalized with the scanned driving strength of every point
+    powers, records = scan_laser_power(example_experiment, 0.1, 0.3, steps=3, progress_bar=False,
+                                       quantities=['n_a', 'transmission_probe'])
+    assert_allclose(records.transmission_probe, records.n_a * kappa_a ** 2 / (4 * powers ** 2), rtol=1e-12)
+    with SteadyStatePool(example_experiment, processes=2, chunk_size=2) as pool:
+        _, pool_records = scan_laser_power(example_experiment, 0.1, 0.3, steps=3, pool=pool,
+                                           quantities=['n_a', 'transmission_probe'])
+    assert_allclose(pool_records.transmission_probe, records.transmission_probe, rtol=1e-8)
+
+    with pytest.raises(ValueError):
+        scan_laser_freq(example_experiment, -25, 25, steps=5, quantities=['g4'])
+    # the transmission is not defined without driving strength or for a laser which drives the atom
+    with pytest.raises(ValueError):
+        scan_laser_power(example_experiment, 0, 0.3, steps=3, progress_bar=False, quantities=['transmission_probe'])
+    atom_experiment = NTypeExperiment(system_parameters, driving={'probe': 'a', 'signal': 'c'})
+    with pytest.raises(ValueError):
+        scan_laser_freq(atom_experiment, -25, 25, steps=5, progress_bar=False, quantities=['transmission_probe'])